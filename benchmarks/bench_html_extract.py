@@ -0,0 +1,50 @@
+"""
+Compare the HTML text extractors on a corpus of saved pages.
+
+    python -m benchmarks.bench_html_extract --corpus saved-pages/
+
+The corpus is a directory of *.html files, for example pages saved with curl
+from real conversations. Without --corpus, synthetic pages of a few sizes are
+used. lxml is only measured when it is installed.
+"""
+
+import argparse
+import time
+from pathlib import Path
+from benchmarks.pages import synthetic_html
+from rudeadvisor import extract
+
+
+def load_corpus(directory: str | None) -> list[bytes]:
+    if directory is None:
+        return [
+            synthetic_html(size, seed)
+            for seed, size in enumerate([20_000, 100_000, 300_000, 1_000_000])
+        ]
+    return [path.read_bytes() for path in sorted(Path(directory).glob("*.html"))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", help="Directory of saved *.html pages")
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+
+    pages = load_corpus(arguments.corpus)
+    total_bytes = sum(len(page) for page in pages)
+    print(f"{len(pages)} pages, {total_bytes / 1e6:.1f} MB")
+    print(f"{'extractor':>14} {'ms/page':>10} {'MB/s':>8} {'text chars':>12}")
+    for name, extractor in extract.HTML_EXTRACTORS.items():
+        if name == "lxml" and extract.etree is None:
+            continue
+        started = time.perf_counter()
+        for _ in range(arguments.repeat):
+            text_chars = sum(len(extractor(page, "utf-8")) for page in pages)
+        elapsed = (time.perf_counter() - started) / arguments.repeat
+        print(
+            f"{name:>14} {elapsed / len(pages) * 1000:>10.2f} {total_bytes / elapsed / 1e6:>8.1f} {text_chars:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Run whole conversations through worker.process_action with local stand-ins
+for the LLM, DuckDuckGo, the scraped sites and Redis, and report the latency
+of every StateAction, conversations per second, peak RSS and the size of the
+published messages as JSON.
+
+    python -m benchmarks.bench_pipeline --conversations 200 --concurrency 50
+
+The sites serve large synthetic HTML pages and a multi page PDF. Upstream
+latency is simulated with sleeps, so a run is deterministic apart from
+scheduling. Compare runs with the JSON output, for example by saving it per
+commit with --output.
+"""
+
+import os
+
+# The caches and the local index would hide the work after the first
+# conversation, and must be off before the modules are imported. Blobs are
+# kept in memory, as there is no Redis.
+os.environ.update(
+    {
+        "RUDEADVISOR_INDEX_ENABLED": "false",
+        "RUDEADVISOR_LLM_CACHE_ENABLED": "false",
+        "RUDEADVISOR_SEARCH_CACHE_BACKEND": "none",
+        "RUDEADVISOR_CONTENT_CACHE_BACKEND": "none",
+        "RUDEADVISOR_BLOB_BACKEND": "memory",
+    }
+)
+
+import argparse
+import asyncio
+import json
+import re
+import resource
+import statistics
+import subprocess
+import time
+from collections import defaultdict
+from typing import AsyncIterator
+import httpx
+from pydantic import BaseModel
+from benchmarks.pages import synthetic_html, synthetic_pdf
+from rudeadvisor import llm
+from rudeadvisor import model as edu_model
+from rudeadvisor import tools
+from rudeadvisor import worker
+
+
+ANSWER_TEXT = (
+    "Napoleon married Josephine in 1796 and divorced her in 1810 because she "
+    "had not given him an heir. They stayed close until her death in 1814."
+)
+
+
+class FakeLLMBackend:
+    """
+    Answers every structured completion with a fixed valid result. The sources
+    check approves every URL it is shown.
+    """
+
+    def __init__(self, latency: float):
+        self._latency = latency
+
+    async def complete_structured(
+        self,
+        model: str,
+        messages: list[dict],
+        response_format: type[BaseModel],
+        max_tokens: int | None,
+    ) -> BaseModel | None:
+        await asyncio.sleep(self._latency)
+        if response_format is edu_model.QuestionsScore:
+            return edu_model.QuestionsScore(score=90, score_comment="Fine questions")
+        if response_format is edu_model.Query:
+            return edu_model.Query(query_text="napoleon josephine marriage")
+        if response_format is edu_model.Sources:
+            return edu_model.Sources(
+                links=re.findall(r"URL: (\S+)", messages[-1]["content"]),
+                query_tuning_suggestion=None,
+                removed_links_explaination=None,
+            )
+        if response_format is edu_model.Answer:
+            return edu_model.Answer(answer_text=ANSWER_TEXT)
+        return None
+
+    async def complete_stream(
+        self, model: str, messages: list[dict], max_tokens: int | None
+    ) -> AsyncIterator[str]:
+        await asyncio.sleep(self._latency)
+        for word in ANSWER_TEXT.split(" "):
+            await asyncio.sleep(0)
+            yield word + " "
+
+    async def close(self):
+        pass
+
+
+class FakeSites:
+    """
+    The scraped sites, served through an httpx mock transport.
+    """
+
+    def __init__(self, html_bytes: int, pdf_pages: int, latency: float):
+        self.links = [f"https://site{i}.example.org/article" for i in range(3)] + [
+            "https://archive.example.org/letters.pdf"
+        ]
+        self._pages = {
+            link: synthetic_html(html_bytes, seed)
+            for seed, link in enumerate(self.links)
+        }
+        self._pages[self.links[-1]] = synthetic_pdf(pdf_pages, 50, seed=99)
+        self._latency = latency
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self._latency)
+        link = str(request.url)
+        content_type = "application/pdf" if link.endswith(".pdf") else "text/html"
+        return httpx.Response(
+            200, content=self._pages[link], headers={"content-type": content_type}
+        )
+
+    def search(self, query: edu_model.Query, latency: float):
+        time.sleep(latency)
+        return edu_model.WebSearchResults(
+            web_search_results=[
+                edu_model.WebSearchResult(
+                    snippet=f"About {query.query_text}", title=link, link=link
+                )
+                for link in self.links
+            ]
+        )
+
+
+class RecordingPublisher:
+    """
+    Stands in for the async Redis client of the worker and records the size of
+    every published message by message type.
+    """
+
+    def __init__(self):
+        self.message_bytes: dict[str, list[int]] = defaultdict(list)
+
+    def pipeline(self, transaction: bool = True):
+        return HistoryPipeline()
+
+    async def publish(self, channel: str, message: str):
+        message_type = json.loads(message)["message"]["message_type"]
+        self.message_bytes[message_type].append(len(message.encode()))
+
+
+class HistoryPipeline:
+    """
+    Drops the appends to the message history and returns an event id.
+    """
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    async def execute(self):
+        return [b"0-1", True]
+
+
+class NullPipeline:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        return []
+
+
+class NullRedis:
+    """
+    Stands in for the sync Redis client used for checkpoints and the
+    conversation store.
+    """
+
+    def pipeline(self):
+        return NullPipeline()
+
+    def hget(self, name: str, key: str):
+        return None
+
+
+def latency_summary(durations: list[float]) -> dict[str, float]:
+    milliseconds = sorted(duration * 1000 for duration in durations)
+    return {
+        "count": len(milliseconds),
+        "mean_ms": statistics.fmean(milliseconds),
+        "p50_ms": milliseconds[len(milliseconds) // 2],
+        "p95_ms": milliseconds[int(len(milliseconds) * 0.95)],
+        "max_ms": milliseconds[-1],
+    }
+
+
+def current_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def conversation_state(conversation_id: str) -> edu_model.ConversationState:
+    return edu_model.create_initial_state(conversation_id).immutable_copy_questions(
+        edu_model.Questions(
+            questions=[
+                edu_model.Question(
+                    question_text="Why did Napoleon divorce Josephine? Answer in a short essay."
+                )
+            ],
+            questions_score=None,
+        )
+    )
+
+
+async def run_conversations(
+    conversations: int,
+    concurrency: int,
+    sites: FakeSites,
+    step_durations: dict[str, list[float]],
+) -> float:
+    upstreams = tools.get_upstreams()
+    await upstreams.http_client.aclose()
+    upstreams.http_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(sites.handle), follow_redirects=True
+    )
+
+    checkpoint_after_step = worker.checkpoint_after_step
+
+    def timed_checkpoint_after_step(
+        job_id: str, steps_taken: int, entry_id: str | None = None
+    ):
+        on_step = checkpoint_after_step(job_id, steps_taken, entry_id)
+
+        async def record_and_checkpoint(
+            step_record: edu_model.StepRecord, state: edu_model.ConversationState
+        ):
+            step_durations[step_record.action.value].append(
+                step_record.duration_seconds
+            )
+            await on_step(step_record, state)
+
+        return record_and_checkpoint
+
+    worker.checkpoint_after_step = timed_checkpoint_after_step
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def converse(number: int):
+        async with semaphore:
+            await worker.process_action(
+                conversation_state(f"bench-{number}"),
+                None,
+                edu_model.StateAction.COORDINATE,
+                job_id=f"bench-job-{number}",
+            )
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(converse(number) for number in range(conversations)))
+    finally:
+        worker.checkpoint_after_step = checkpoint_after_step
+        await tools.close_upstreams()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=25)
+    parser.add_argument("--llm-latency-ms", type=float, default=50)
+    parser.add_argument("--search-latency-ms", type=float, default=50)
+    parser.add_argument("--http-latency-ms", type=float, default=20)
+    parser.add_argument("--html-bytes", type=int, default=300_000)
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--output", help="Write the results to this file")
+    arguments = parser.parse_args()
+
+    sites = FakeSites(
+        arguments.html_bytes, arguments.pdf_pages, arguments.http_latency_ms / 1000
+    )
+    llm.create_backend = lambda provider: FakeLLMBackend(
+        arguments.llm_latency_ms / 1000
+    )
+    tools.search_duckduckgo = lambda query: sites.search(
+        query, arguments.search_latency_ms / 1000
+    )
+    publisher = RecordingPublisher()
+    worker.async_redis_client = publisher
+    worker.redis_client = NullRedis()
+
+    rss_before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    step_durations: dict[str, list[float]] = defaultdict(list)
+    elapsed = asyncio.run(
+        run_conversations(
+            arguments.conversations, arguments.concurrency, sites, step_durations
+        )
+    )
+
+    results = {
+        "commit": current_commit(),
+        "parameters": vars(arguments),
+        "elapsed_seconds": elapsed,
+        "conversations_per_second": arguments.conversations / elapsed,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "rss_before_run_kb": rss_before_kb,
+        "step_latency": {
+            action: latency_summary(durations)
+            for action, durations in sorted(step_durations.items())
+        },
+        "published_message_bytes": {
+            message_type: {
+                "count": len(sizes),
+                "mean": statistics.fmean(sizes),
+                "max": max(sizes),
+                "total": sum(sizes),
+            }
+            for message_type, sizes in sorted(publisher.message_bytes.items())
+        },
+    }
+    output = json.dumps(results, indent=2)
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            output_file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
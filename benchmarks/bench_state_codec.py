@@ -0,0 +1,76 @@
+"""
+Compare the state codecs with plain JSON: encode and decode time and the size
+of a ConversationState with growing amounts of scraped text.
+
+    python -m benchmarks.bench_state_codec
+
+msgpack is only measured when it is installed.
+"""
+
+import argparse
+import random
+import timeit
+from benchmarks.pages import WORDS
+from rudeadvisor import codec
+from rudeadvisor import model as edu_model
+
+
+CODECS = [
+    ("json", dict(codec="json")),
+    ("binary json", dict(codec="binary", encoding="json", compress_min_bytes=-1)),
+    ("binary json zlib", dict(codec="binary", encoding="json", compress_min_bytes=0)),
+    ("binary msgpack", dict(codec="binary", encoding="msgpack", compress_min_bytes=-1)),
+    (
+        "binary msgpack zlib",
+        dict(codec="binary", encoding="msgpack", compress_min_bytes=0),
+    ),
+]
+
+
+def state_with_pages(
+    page_count: int, page_words: int = 3_000
+) -> edu_model.ConversationState:
+    generator = random.Random(page_count)
+    web_data_collection = edu_model.WebDataCollection(
+        web_data_collection=[
+            edu_model.WebData(
+                link=f"https://example.org/{i}",
+                data=" ".join(generator.choices(WORDS, k=page_words)),
+            )
+            for i in range(page_count)
+        ],
+        web_data_retrival_errors=[],
+    )
+    return edu_model.create_initial_state("bench").immutable_copy_web_data_collection(
+        web_data_collection
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    arguments = parser.parse_args()
+
+    print(
+        f"{'pages':>6} {'codec':>20} {'encode (us)':>12} {'decode (us)':>12} {'bytes':>10}"
+    )
+    for page_count in [0, 5, 20, 50]:
+        state = state_with_pages(page_count)
+        for name, options in CODECS:
+            if options.get("encoding") == "msgpack" and codec.msgpack is None:
+                continue
+            data = codec.encode(state, **options)
+            encode = timeit.timeit(
+                lambda: codec.encode(state, **options), number=arguments.repeat
+            )
+            decode = timeit.timeit(
+                lambda: codec.decode(data, edu_model.ConversationState),
+                number=arguments.repeat,
+            )
+            print(
+                f"{page_count:>6} {name:>20} {encode / arguments.repeat * 1e6:>12.1f} {decode / arguments.repeat * 1e6:>12.1f} {len(data):>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
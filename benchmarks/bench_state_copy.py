@@ -0,0 +1,43 @@
+"""
+Compare the cost of a one-field ConversationState update with structural
+sharing against the old deep copy, for growing amounts of scraped data.
+
+    python -m benchmarks.bench_state_copy
+"""
+
+import timeit
+from rudeadvisor import model as edu_model
+
+
+def state_with_pages(page_count: int, page_size: int = 20_000):
+    web_data_collection = edu_model.WebDataCollection(
+        web_data_collection=[
+            edu_model.WebData(link=f"https://example.org/{i}", data="x" * page_size)
+            for i in range(page_count)
+        ],
+        web_data_retrival_errors=[],
+    )
+    return edu_model.create_initial_state("bench").immutable_copy_web_data_collection(
+        web_data_collection
+    )
+
+
+def main(repeat: int = 200):
+    answer = edu_model.Answer(answer_text="42")
+    print(f"{'pages':>6} {'deep copy (us)':>16} {'shared copy (us)':>18}")
+    for page_count in [0, 10, 100, 1000]:
+        state = state_with_pages(page_count)
+        deep = timeit.timeit(
+            lambda: state.model_copy(update={"answer": answer}, deep=True),
+            number=repeat,
+        )
+        shared = timeit.timeit(
+            lambda: state.immutable_copy_answer(answer), number=repeat
+        )
+        print(
+            f"{page_count:>6} {deep / repeat * 1e6:>16.1f} {shared / repeat * 1e6:>18.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
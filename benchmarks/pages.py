@@ -0,0 +1,72 @@
+"""
+Synthetic pages shared by the benchmarks.
+"""
+
+import random
+
+
+WORDS = """
+napoleon josephine empire marriage divorce paris france emperor letters court
+history revolution army campaign italy egypt malmaison coronation heir family
+""".split()
+
+
+def synthetic_html(size_bytes: int, seed: int) -> bytes:
+    """
+    A page with navigation, scripts and styles around paragraphs of text, about
+    size_bytes long.
+    """
+    generator = random.Random(seed)
+    parts = [
+        "<html><head><style>body { font-family: serif; }</style>",
+        "<script>var tracking = {};</script></head><body>",
+        "<nav><a href='/'>Home</a><a href='/about'>About</a></nav>",
+    ]
+    size = sum(len(part) for part in parts)
+    while size < size_bytes:
+        paragraph = f"<p>{' '.join(generator.choices(WORDS, k=80))}.</p>\n"
+        parts.append(paragraph)
+        size += len(paragraph)
+    parts.append("<footer>Copyright</footer></body></html>")
+    return "".join(parts).encode()
+
+
+def synthetic_pdf(page_count: int, lines_per_page: int, seed: int) -> bytes:
+    """
+    A PDF with page_count pages of text in Helvetica.
+    """
+    generator = random.Random(seed)
+    page_ids = [4 + 2 * page for page in range(page_count)]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {page_count} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for page_id in page_ids:
+        lines = " ".join(
+            f"({' '.join(generator.choices(WORDS, k=10))}) '"
+            for _ in range(lines_per_page)
+        )
+        content = f"BT /F1 10 Tf 50 780 Td 12 TL {lines} ET".encode()
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {page_id + 1} 0 R /Resources << /Font << /F1 3 0 R >> >> >>".encode()
+        )
+        objects.append(
+            f"<< /Length {len(content)} >>\nstream\n".encode()
+            + content
+            + b"\nendstream"
+        )
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf.extend(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref_offset = len(pdf)
+    pdf.extend(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        pdf.extend(f"{offset:010d} 00000 n \n".encode())
+    pdf.extend(
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    )
+    return bytes(pdf)
@@ -1,20 +1,168 @@
+import asyncio
+import inspect
 import logging
-from math import acos
+import time
+from collections import Counter
 from rudeadvisor import model as edu_model
-from typing import Callable
+from typing import Any, Awaitable, Callable
+from rudeadvisor import blobs
+from rudeadvisor import context
+from rudeadvisor import index
+from rudeadvisor import metrics
 from rudeadvisor import tools
+from rudeadvisor.config import settings
+
+
+StepResult = tuple[edu_model.ConversationState, edu_model.StateAction | None]
+SendMessage = Callable[
+    [edu_model.ConversationState, edu_model.StateAction, str], Awaitable[None]
+]
+
+
+def as_async(callback: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    """
+    Callers may pass plain functions or coroutine functions as callbacks. The
+    agents always await them.
+    """
+
+    async def call(*args):
+        result = callback(*args)
+        if inspect.isawaitable(result):
+            return await result
+        return result
+
+    return call
+
+
+async def transition_async(
+    state: edu_model.ConversationState,
+    previous_action: edu_model.StateAction | None,
+    action: edu_model.StateAction,
+    send_state_to_user: Callable[..., Any],
+    limits: edu_model.PipelineLimits | None = None,
+    on_step: Callable[..., Any] | None = None,
+    send_fragment_to_user: Callable[..., Any] | None = None,
+) -> edu_model.ConversationState:
+    """
+    Run the pipeline from the given action. Every agent is one step that returns
+    the updated state and the next action, or None when the pipeline is done.
+    The run stops when it has taken limits.max_steps steps, or when the same
+    transition (previous action to action) would be retried more than
+    limits.max_action_retries times. Each step is timed and reported to on_step.
+    With send_fragment_to_user the answer is streamed to the user as it is
+    generated. The callbacks can be plain functions or coroutine functions.
+    """
+    send_state_to_user = as_async(send_state_to_user)
+    on_step = as_async(on_step) if on_step else None
+    send_fragment_to_user = (
+        as_async(send_fragment_to_user) if send_fragment_to_user else None
+    )
+    limits = limits or edu_model.PipelineLimits(
+        max_steps=settings.pipeline_max_steps,
+        max_action_retries=settings.pipeline_max_action_retries,
+    )
+    transitions_taken: Counter = Counter()
+    step = 0
+    next_action: edu_model.StateAction | None = action
+
+    while next_action is not None:
+        if step >= limits.max_steps:
+            logging.warning(f"Stopping the pipeline after {step} steps")
+            await send_state_to_user(
+                state,
+                next_action,
+                "I have spent all the effort I'm willing to spend on this. Please retry with better questions.",
+            )
+            break
+
+        transitions_taken[(previous_action, next_action)] += 1
+        retries = transitions_taken[(previous_action, next_action)] - 1
+        if retries > limits.max_action_retries:
+            logging.warning(
+                f"Stopping the pipeline, {previous_action} to {next_action} was retried too often"
+            )
+            await send_state_to_user(
+                state,
+                next_action,
+                "I keep going around in circles with your questions. Please retry with better ones.",
+            )
+            break
+        if retries > 0:
+            metrics.increment(
+                "rudeadvisor_step_retries_total", action=next_action.value
+            )
+
+        started = time.perf_counter()
+        state, following_action = await run_agent(
+            state,
+            previous_action,
+            next_action,
+            send_state_to_user,
+            send_fragment_to_user,
+        )
+        step_record = edu_model.StepRecord(
+            step=step,
+            previous_action=previous_action,
+            action=next_action,
+            next_action=following_action,
+            duration_seconds=time.perf_counter() - started,
+        )
+        logging.info(
+            f"Step {step_record.step} {step_record.action} took {step_record.duration_seconds:.3f}s"
+        )
+        metrics.observe(
+            "rudeadvisor_step_duration_seconds",
+            step_record.duration_seconds,
+            action=step_record.action.value,
+        )
+        if on_step:
+            await on_step(step_record, state)
+
+        previous_action, next_action = next_action, following_action
+        step += 1
+
+    return state
 
 
 def transition(
     state: edu_model.ConversationState,
     previous_action: edu_model.StateAction | None,
     action: edu_model.StateAction,
-    send_state_to_user: Callable[
-        [edu_model.ConversationState, edu_model.StateAction, str], None
-    ],
+    send_state_to_user: Callable[..., Any],
+    limits: edu_model.PipelineLimits | None = None,
+    on_step: Callable[..., Any] | None = None,
+    send_fragment_to_user: Callable[..., Any] | None = None,
 ) -> edu_model.ConversationState:
     """
-    Process the state transition based on the current action.
+    Run transition_async on a new event loop, for callers without one.
+    """
+
+    async def run() -> edu_model.ConversationState:
+        try:
+            return await transition_async(
+                state,
+                previous_action,
+                action,
+                send_state_to_user,
+                limits,
+                on_step,
+                send_fragment_to_user,
+            )
+        finally:
+            await tools.close_upstreams()
+
+    return asyncio.run(run())
+
+
+async def run_agent(
+    state: edu_model.ConversationState,
+    previous_action: edu_model.StateAction | None,
+    action: edu_model.StateAction,
+    send_state_to_user: SendMessage,
+    send_fragment_to_user: SendMessage | None = None,
+) -> StepResult:
+    """
+    Run the agent for the current action.
     """
     logging.debug(
         f"Transitioning from {previous_action} to {action} with state: {state}"
@@ -22,50 +170,101 @@ def transition(
 
     match (previous_action, action):
         case (transition_from, edu_model.StateAction.COORDINATE):
-            return coordination_agent(state, transition_from, send_state_to_user)
+            return await coordination_agent(state, transition_from, send_state_to_user)
         case (transition_from, edu_model.StateAction.SCORE_QUERY):
-            return score_query_agent(state, transition_from, send_state_to_user)
+            return await score_query_agent(state, transition_from, send_state_to_user)
         case (transition_from, edu_model.StateAction.CHALLENGE):
-            return challenge_agent(state, transition_from, send_state_to_user)
+            return await challenge_agent(state, transition_from, send_state_to_user)
         case (transition_from, edu_model.StateAction.QUERY_LLM):
-            return query_llm_agent(state, transition_from, send_state_to_user)
+            return await query_llm_agent(state, transition_from, send_state_to_user)
         case (transition_from, edu_model.StateAction.WEB_SEARCH):
-            return web_search_agent(state, transition_from, send_state_to_user)
+            return await web_search_agent(state, transition_from, send_state_to_user)
         case (transition_from, edu_model.StateAction.SOURCE_APPROVE):
-            return source_approve_agent(state, transition_from, send_state_to_user)
+            return await source_approve_agent(
+                state, transition_from, send_state_to_user
+            )
         case (transition_from, edu_model.StateAction.WEB_SCRAPE):
-            return web_scrape_sites(state, transition_from, send_state_to_user)
+            return await web_scrape_sites(state, transition_from, send_state_to_user)
         case (transition_from, edu_model.StateAction.ANSWER_QUESTION):
-            return answer_question(state, transition_from, send_state_to_user)
+            return await answer_question(
+                state, transition_from, send_state_to_user, send_fragment_to_user
+            )
         case _:
             logging.debug(
                 f"No matching transition found for {previous_action} and {action}"
             )
-            return state
+            return state, None
+
+
+def buffered_fragments(
+    send: Callable[[str], Awaitable[None]], min_chars: int
+) -> tuple[Callable[[str], Awaitable[None]], Callable[[], Awaitable[None]]]:
+    """
+    Collect streamed fragments and pass them on once at least min_chars have
+    been gathered, so that the user is not sent a message per token. Returns the
+    function to add a fragment with and the function that sends what is left.
+    """
+    buffer: list[str] = []
+
+    async def flush():
+        if buffer:
+            fragments = "".join(buffer)
+            buffer.clear()
+            await send(fragments)
+
+    async def add(fragment: str):
+        buffer.append(fragment)
+        if sum(len(buffered) for buffered in buffer) >= min_chars:
+            await flush()
+
+    return add, flush
 
 
-def answer_question(
+async def answer_question(
     state: edu_model.ConversationState,
     previous_action: edu_model.StateAction | None,
-    send_state_to_user: Callable[
-        [edu_model.ConversationState, edu_model.StateAction, str], None
-    ],
-) -> edu_model.ConversationState:
+    send_state_to_user: SendMessage,
+    send_fragment_to_user: SendMessage | None = None,
+) -> StepResult:
 
     if state.web_search_results and state.sources and state.questions:
-        send_state_to_user(
+        await send_state_to_user(
             state,
             edu_model.StateAction.ANSWER_QUESTION,
             "Answering the question .. ",
         )
-        answer = tools.answer_questions(
+        web_data_collection = await asyncio.to_thread(
+            blobs.resolve_web_data, state.web_data_collection
+        )
+        answer_context = await asyncio.to_thread(
+            context.build_context,
+            web_data_collection,
+            state.questions,
+            settings.context_token_budget,
+            settings.context_passage_words,
+        )
+        state = state.immutable_copy_context(answer_context)
+        add_fragment, flush_fragments = (
+            buffered_fragments(
+                lambda fragment: send_fragment_to_user(
+                    state, edu_model.StateAction.ANSWER_QUESTION, fragment
+                ),
+                settings.answer_fragment_min_chars,
+            )
+            if send_fragment_to_user
+            else (None, None)
+        )
+        answer = await tools.answer_questions(
             state.web_search_results,
             state.sources,
             state.questions,
-            state.web_data_collection,
+            answer_context,
+            on_fragment=add_fragment,
         )
+        if flush_fragments:
+            await flush_fragments()
         state = state.immutable_copy_answer(answer)
-        send_state_to_user(
+        await send_state_to_user(
             state,
             edu_model.StateAction.ANSWER_QUESTION,
             (
@@ -80,151 +279,201 @@ def answer_question(
             ),
         )
 
-    return state
+    return state, None
 
 
-def web_scrape_sites(
+async def web_scrape_sites(
     state: edu_model.ConversationState,
     previous_action: edu_model.StateAction | None,
-    send_state_to_user: Callable[
-        [edu_model.ConversationState, edu_model.StateAction, str], None
-    ],
-) -> edu_model.ConversationState:
+    send_state_to_user: SendMessage,
+) -> StepResult:
 
     if state.sources and len(state.sources.links) > 0:
         logging.debug(
             f"We will now retrieve and scrape data from the web for the follwing links: {state.sources.links}"
         )
-        send_state_to_user(
+        await send_state_to_user(
             state,
             edu_model.StateAction.WEB_SCRAPE,
             "Getting data from tha web....",
         )
 
-        scraped_data = tools.scrape_links(state.sources)
+        scraped_data = await tools.scrape_links(state.sources)
+        if settings.index_enabled:
+            try:
+                await asyncio.to_thread(index.add_web_data, scraped_data)
+            except Exception as e:
+                logging.error(f"Failed to add the scraped data to the local index: {e}")
+        try:
+            scraped_data = await asyncio.to_thread(blobs.offload_web_data, scraped_data)
+        except Exception as e:
+            logging.error(f"Failed to move the scraped text to the blob store: {e}")
         state = state.immutable_copy_web_data_collection(scraped_data)
-        return transition(
-            state,
-            previous_action,
-            edu_model.StateAction.ANSWER_QUESTION,
-            send_state_to_user,
-        )
+        return state, edu_model.StateAction.ANSWER_QUESTION
 
-    return state
+    return state, None
 
 
-def source_approve_agent(
+async def source_approve_agent(
     state: edu_model.ConversationState,
     previous_action: edu_model.StateAction | None,
-    send_state_to_user: Callable[
-        [edu_model.ConversationState, edu_model.StateAction, str], None
-    ],
-) -> edu_model.ConversationState:
+    send_state_to_user: SendMessage,
+) -> StepResult:
     logging.debug(
         f"Processing source approval with state: {state} and previous action: {previous_action}"
     )
 
     if state.web_search_results and state.query:
-        send_state_to_user(
+        await send_state_to_user(
             state,
             edu_model.StateAction.SOURCE_APPROVE,
             "Let me do a sanity check on the URLs you've found.",
         )
-        sources = tools.evaluate_the_sources(state.web_search_results, state.query)
+        sources = await tools.evaluate_the_sources(
+            state.web_search_results, state.query
+        )
         state = state.immutable_copy_sources(sources)
         logging.debug(f"Updated state with sources: {sources}")
 
         if sources and len(sources.links) < 2:
-            send_state_to_user(
+            await send_state_to_user(
                 state,
                 edu_model.StateAction.SOURCE_APPROVE,
                 "Too few results retrieved from the web. You really should improve the query.",
             )
-            return transition(
-                state,
-                edu_model.StateAction.SOURCE_APPROVE,
-                edu_model.StateAction.QUERY_LLM,
-                send_state_to_user,
-            )
+            return state, edu_model.StateAction.QUERY_LLM
         elif sources and len(sources.links):
             explaination_of_removed_links = (
                 sources.removed_links_explaination
                 if sources.removed_links_explaination
                 else ""
             )
-            send_state_to_user(
+            await send_state_to_user(
                 state,
                 edu_model.StateAction.SOURCE_APPROVE,
                 f"Okay, I guess we can use the links {sources.links} to generate a prompt and create an answer. "
                 + explaination_of_removed_links,
             )
-            return transition(
-                state,
-                edu_model.StateAction.SOURCE_APPROVE,
-                edu_model.StateAction.WEB_SCRAPE,
-                send_state_to_user,
-            )
+            return state, edu_model.StateAction.WEB_SCRAPE
         else:
-            send_state_to_user(
+            await send_state_to_user(
                 state,
                 edu_model.StateAction.SOURCE_APPROVE,
                 "The links are not good enough.",
             )
-            return state
+            return state, None
 
-    return state
+    return state, None
 
 
-def web_search_agent(
+async def web_search_agent(
     state: edu_model.ConversationState,
     previous_action: edu_model.StateAction | None,
-    send_state_to_user: Callable[
-        [edu_model.ConversationState, edu_model.StateAction, str], None
-    ],
-) -> edu_model.ConversationState:
+    send_state_to_user: SendMessage,
+) -> StepResult:
     logging.debug(
         f"Processing web search with state: {state} and previous action: {previous_action}"
     )
 
     match previous_action:
         case edu_model.StateAction.QUERY_LLM:
+            indexed_state = await answer_from_local_index(state)
+            if indexed_state:
+                await send_state_to_user(
+                    indexed_state,
+                    edu_model.StateAction.WEB_SEARCH,
+                    "I have read enough about this already. No need to bother the web again.",
+                )
+                return indexed_state, edu_model.StateAction.ANSWER_QUESTION
+
             if state.query:
-                search_results = tools.query_duckduckgo(state.query)
+                search_results = await tools.query_duckduckgo(state.query)
                 if isinstance(search_results, edu_model.WebSearchError):
-                    send_state_to_user(
+                    await send_state_to_user(
                         state,
                         edu_model.StateAction.WEB_SEARCH,
                         "Unfortunately, the web search failed.",
                     )
-                    return state
+                    return state, None
                 else:
                     state = state.immutable_copy_web_search_results(search_results)
                     logging.debug(
                         f"Updated state with search results: {search_results}"
                     )
 
-                    send_state_to_user(
+                    await send_state_to_user(
                         state,
                         edu_model.StateAction.WEB_SEARCH,
                         f"You only got {len(search_results.web_search_results)} search results.",
                     )
-                    return transition(
-                        state,
-                        edu_model.StateAction.WEB_SEARCH,
-                        edu_model.StateAction.SOURCE_APPROVE,
-                        send_state_to_user,
-                    )
+                    return state, edu_model.StateAction.SOURCE_APPROVE
 
-    return state
+    return state, None
 
 
-def coordination_agent(
+async def answer_from_local_index(
+    state: edu_model.ConversationState,
+) -> edu_model.ConversationState | None:
+    """
+    If the local index already has enough fresh passages matching the questions,
+    return the state with those passages as the sources and web data, so that
+    the search and scrape steps can be skipped.
+    """
+    if not settings.index_enabled or not state.questions:
+        return None
+    try:
+        passages = await asyncio.to_thread(
+            index.search, state.questions, settings.index_search_limit
+        )
+    except Exception as e:
+        logging.error(f"Failed to search the local index: {e}")
+        return None
+    if len(passages) < settings.index_min_passages:
+        return None
+
+    links = list(dict.fromkeys(passage.link for passage in passages))
+    logging.debug(f"Answering from {len(passages)} indexed passages from {links}")
+    return (
+        state.immutable_copy_web_search_results(
+            edu_model.WebSearchResults(
+                web_search_results=[
+                    edu_model.WebSearchResult(
+                        snippet=next(
+                            passage.text[:200]
+                            for passage in passages
+                            if passage.link == link
+                        ),
+                        title=link,
+                        link=link,
+                    )
+                    for link in links
+                ]
+            )
+        )
+        .immutable_copy_sources(
+            edu_model.Sources(
+                links=links,
+                query_tuning_suggestion=None,
+                removed_links_explaination=None,
+            )
+        )
+        .immutable_copy_web_data_collection(
+            edu_model.WebDataCollection(
+                web_data_collection=[
+                    edu_model.WebData(link=passage.link, data=passage.text)
+                    for passage in passages
+                ],
+                web_data_retrival_errors=[],
+            )
+        )
+    )
+
+
+async def coordination_agent(
     state: edu_model.ConversationState,
     previous_action: edu_model.StateAction | None,
-    send_state_to_user: Callable[
-        [edu_model.ConversationState, edu_model.StateAction, str], None
-    ],
-) -> edu_model.ConversationState:
+    send_state_to_user: SendMessage,
+) -> StepResult:
     """
     Coordinate the state based on the previous action.
     """
@@ -234,62 +483,47 @@ def coordination_agent(
 
     match previous_action:
         case None:
-            send_state_to_user(
+            await send_state_to_user(
                 state,
                 edu_model.StateAction.COORDINATE,
                 "Thanks ...",
             )
-            return transition(
-                state,
-                edu_model.StateAction.COORDINATE,
-                edu_model.StateAction.SCORE_QUERY,
-                send_state_to_user,
-            )
+            return state, edu_model.StateAction.SCORE_QUERY
         case edu_model.StateAction.SCORE_QUERY:
             if not state.questions:
-                send_state_to_user(
+                await send_state_to_user(
                     state, edu_model.StateAction.COORDINATE, "Error state"
                 )
-                return state
+                return state, None
 
             quality_score = state.questions.questions_score
             logging.debug(f"Quality score: {quality_score}")
 
             if quality_score and quality_score.score < 80:
-                send_state_to_user(
+                await send_state_to_user(
                     state,
                     edu_model.StateAction.COORDINATE,
                     quality_score.score_comment
                     + f", I scored it {quality_score.score}",
                 )
-                return transition(
-                    state,
-                    edu_model.StateAction.COORDINATE,
-                    edu_model.StateAction.CHALLENGE,
-                    send_state_to_user,
-                )
+                return state, edu_model.StateAction.CHALLENGE
             elif quality_score:
-                send_state_to_user(
+                await send_state_to_user(
                     state,
                     edu_model.StateAction.COORDINATE,
                     f"The quality is fine. {quality_score.score}/100. The comment is {quality_score.score_comment}. We will continue creating prompts.",
                 )
-                return transition(
-                    state,
-                    edu_model.StateAction.COORDINATE,
-                    edu_model.StateAction.QUERY_LLM,
-                    send_state_to_user,
-                )
+                return state, edu_model.StateAction.QUERY_LLM
             else:
-                send_state_to_user(
+                await send_state_to_user(
                     state,
                     edu_model.StateAction.COORDINATE,
                     "Failed to score the query. Please retry...",
                 )
-                return state
+                return state, None
         case edu_model.StateAction.CHALLENGE:
             if state.refined_questions:
-                send_state_to_user(
+                await send_state_to_user(
                     state,
                     edu_model.StateAction.COORDINATE,
                     state.refined_questions.comment_to_the_original_question
@@ -297,23 +531,21 @@ def coordination_agent(
                     + ", ".join(state.refined_questions.refined_questions),
                 )
             else:
-                send_state_to_user(
+                await send_state_to_user(
                     state,
                     edu_model.StateAction.COORDINATE,
                     "Failed to refine questions, please retry",
                 )
-            return state
+            return state, None
 
-    return state
+    return state, None
 
 
-def score_query_agent(
+async def score_query_agent(
     state: edu_model.ConversationState,
     previous_action: edu_model.StateAction | None,
-    send_state_to_user: Callable[
-        [edu_model.ConversationState, edu_model.StateAction, str], None
-    ],
-) -> edu_model.ConversationState:
+    send_state_to_user: SendMessage,
+) -> StepResult:
     """
     Score the query based on the state and previous action.
     """
@@ -322,15 +554,17 @@ def score_query_agent(
     )
 
     if not state.questions:
-        send_state_to_user(state, edu_model.StateAction.SCORE_QUERY, "Error state")
-        return state
+        await send_state_to_user(
+            state, edu_model.StateAction.SCORE_QUERY, "Error state"
+        )
+        return state, None
 
-    send_state_to_user(
+    await send_state_to_user(
         state,
         edu_model.StateAction.SCORE_QUERY,
         "Let me assess the quality of your questions.",
     )
-    quality_score = tools.quality_check_your_questions(state.questions)
+    quality_score = await tools.quality_check_your_questions(state.questions)
     state = state.immutable_copy_questions(
         questions=state.questions.immutable_copy_questions_score(
             questions_score=quality_score
@@ -338,21 +572,14 @@ def score_query_agent(
     )
     logging.debug(f"Updated state with quality score: {quality_score}")
 
-    return transition(
-        state,
-        edu_model.StateAction.SCORE_QUERY,
-        edu_model.StateAction.COORDINATE,
-        send_state_to_user,
-    )
+    return state, edu_model.StateAction.COORDINATE
 
 
-def challenge_agent(
+async def challenge_agent(
     state: edu_model.ConversationState,
     previous_action: edu_model.StateAction | None,
-    send_state_to_user: Callable[
-        [edu_model.ConversationState, edu_model.StateAction, str], None
-    ],
-) -> edu_model.ConversationState:
+    send_state_to_user: SendMessage,
+) -> StepResult:
     """
     Challenge the current state based on the previous action.
     """
@@ -360,32 +587,25 @@ def challenge_agent(
         f"Challenging with state: {state} and previous action: {previous_action}"
     )
 
-    send_state_to_user(
+    await send_state_to_user(
         state, edu_model.StateAction.CHALLENGE, "I'm going to challenge you.."
     )
     if not state.questions:
         logging.error("No questions added")
-        return state
+        return state, None
     else:
-        refined_questions = tools.challenge_llm(state.questions)
+        refined_questions = await tools.challenge_llm(state.questions)
         state = state.immutable_copy_refined_questions(refined_questions)
         logging.debug(f"Updated state with refined questions: {refined_questions}")
 
-        return transition(
-            state,
-            edu_model.StateAction.CHALLENGE,
-            edu_model.StateAction.COORDINATE,
-            send_state_to_user,
-        )
+        return state, edu_model.StateAction.COORDINATE
 
 
-def query_llm_agent(
+async def query_llm_agent(
     state: edu_model.ConversationState,
     previous_action: edu_model.StateAction | None,
-    send_state_to_user: Callable[
-        [edu_model.ConversationState, edu_model.StateAction, str], None
-    ],
-) -> edu_model.ConversationState:
+    send_state_to_user: SendMessage,
+) -> StepResult:
     """
     Query the language model based on the current and previous action.
     """
@@ -394,20 +614,17 @@ def query_llm_agent(
     )
 
     if state.questions:
-        query = tools.extract_search_query(state.questions, state.query, state.sources)
+        query = await tools.extract_search_query(
+            state.questions, state.query, state.sources
+        )
         state = state.immutable_copy_query(query)
         logging.debug(f"Updated state with query: {query}")
 
-        return transition(
-            state,
-            edu_model.StateAction.QUERY_LLM,
-            edu_model.StateAction.WEB_SEARCH,
-            send_state_to_user,
-        )
+        return state, edu_model.StateAction.WEB_SEARCH
 
-    send_state_to_user(
+    await send_state_to_user(
         state,
         edu_model.StateAction.QUERY_LLM,
         "There are no questions to analyze. Please try asking some first.",
     )
-    return state
+    return state, None
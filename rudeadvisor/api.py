@@ -1,42 +1,47 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query
 from fastapi.requests import Request
+from fastapi.responses import PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from sse_starlette.sse import EventSourceResponse
 from uuid import uuid4
-import redis
 import asyncio
-import inspect
+import logging
+import redis
+import redis.asyncio
 from rudeadvisor import model as edu_model
-from rudeadvisor import worker as edu_worker
+from rudeadvisor import broadcast
+from rudeadvisor import conversations
+from rudeadvisor import history
+from rudeadvisor import jobs
+from rudeadvisor import metrics
+from rudeadvisor.config import settings
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await broadcaster.close()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
 
+# Responses are not decoded, states are stored as binary frames (see codec)
 redis_client = redis.StrictRedis(
-    decode_responses=True, host="localhost", port=6379, db=0
+    host=settings.redis_host,
+    port=settings.redis_port,
+    db=settings.redis_db,
 )
+async_redis_client = redis.asyncio.StrictRedis(
+    host=settings.redis_host,
+    port=settings.redis_port,
+    db=settings.redis_db,
+)
+broadcaster = broadcast.ConversationBroadcaster(async_redis_client)
 
 
 # Helper functions
-def set_state_in_cache(conversation_id: str, state: edu_model.ConversationState):
-    redis_client.set(conversation_id, state.model_dump_json())
-
-
-async def get_state_json(conversation_id: str) -> None | edu_model.ConversationState:
-    state_json = redis_client.get(conversation_id)
-    if inspect.isawaitable(state_json):
-        state_json = await state_json
-
-    if state_json:
-        return edu_model.ConversationState.model_validate_json(state_json)
-    return None
-
-
-def delete_state_from_cache(conversation_id):
-    redis_client.delete(conversation_id)
-
-
 def template_based_on_message(
     message: edu_model.Message, jinja2_env: Jinja2Templates
 ) -> str:
@@ -53,6 +58,49 @@ def template_based_on_message(
                 content=message.content, time=message.timestamp.isoformat()
             )
             return template_str
+        case edu_model.MessageType.ANSWER_FRAGMENT:
+            tmpl = jinja2_env.get_template("answer_fragment.html")
+            return tmpl.render(content=message.content)
+
+
+def event_name_for_message(message: edu_model.Message) -> str:
+    """
+    Answer fragments are swapped into the answer element of the conversation page,
+    all other messages are appended to the message list.
+    """
+    match message.message_type:
+        case edu_model.MessageType.ANSWER_FRAGMENT:
+            return "answer"
+        case _:
+            return "message"
+
+
+def server_sent_event(event: edu_model.ConversationEvent) -> dict:
+    message_template = template_based_on_message(event.message, templates)
+    event_name = event_name_for_message(event.message)
+    return {
+        "event": event_name,
+        "id": event.event_id,
+        # Fragments keep their line breaks, the answer is shown as
+        # preformatted text
+        "data": (
+            message_template
+            if event_name == "answer"
+            else message_template.replace("\n", "")
+        ),
+    }
+
+
+def valid_event_id(event_id: str) -> bool:
+    """
+    Both parts of a stream entry id are unsigned 64 bit numbers, Redis rejects
+    anything larger.
+    """
+    try:
+        milliseconds, sequence = history.event_id_order(event_id)
+    except ValueError:
+        return False
+    return 0 <= milliseconds < 2**64 and 0 <= sequence < 2**64
 
 
 @app.get("/")
@@ -60,51 +108,112 @@ def root(request: Request):
     return templates.TemplateResponse("index.html", context={"request": request})
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Metrics of every worker in the Prometheus text format.
+    """
+    pipeline = async_redis_client.pipeline(transaction=False)
+    for name in metrics.METRICS:
+        pipeline.hgetall(metrics.metric_key(name))
+    totals = [
+        {field.decode(): value.decode() for field, value in fields.items()}
+        for fields in await pipeline.execute()
+    ]
+    return PlainTextResponse(
+        metrics.render(dict(zip(metrics.METRICS, totals))),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
 @app.get("/conversation")
 def create_conversation(request: Request):
     conversation_id = str(uuid4())
     state = edu_model.create_initial_state(conversation_id)
-    set_state_in_cache(conversation_id, state)
+    conversations.save_conversation(redis_client, state)
     return templates.TemplateResponse(
         "conversation.html",
         context={"request": request, "conversation_id": conversation_id},
     )
 
 
+@app.get("/conversation/{conversation_id}/history")
+async def get_history(
+    conversation_id: str,
+    before: str | None = None,
+    limit: int = Query(
+        settings.history_page_size, ge=1, le=settings.history_max_events
+    ),
+) -> edu_model.MessageHistory:
+    """
+    The messages of a conversation, newest first, for a page that is reloaded.
+    Pass `next_before` of a page as `before` to get the page after it.
+    """
+    if before is not None and not valid_event_id(before):
+        raise HTTPException(status_code=400, detail=f"Invalid message id {before}")
+    return await history.read_history(
+        async_redis_client, conversation_id, before, limit
+    )
+
+
 @app.get("/conversation/{conversation_id}")
-async def stream_conversation(conversation_id: str):
+async def stream_conversation(
+    conversation_id: str, last_event_id: str | None = Header(None)
+):
+    """
+    Stream the events of a conversation. A client that reconnects with the
+    Last-Event-ID header first gets the events it missed from the history.
+    """
+    await asyncio.to_thread(
+        conversations.touch_conversation, redis_client, conversation_id
+    )
+    if last_event_id is not None and not valid_event_id(last_event_id):
+        last_event_id = None
+
     async def event_generator():
-        pubsub = redis_client.pubsub()
-        pubsub.subscribe(f"conversation:{conversation_id}")
-        try:
-            while True:
-                message = pubsub.get_message()
-                if message and message["type"] == "message":
-                    message_data = message["data"]
-                    state = edu_model.ConversationState.model_validate_json(
-                        message_data
+        # Listening starts before the replay, so that no event falls between
+        # the two. Events that are both replayed and received are sent once.
+        async with broadcaster.listen(conversation_id) as queue:
+            last_sent = last_event_id
+            missed_events = []
+            if last_event_id:
+                try:
+                    missed_events = await history.read_events_after(
+                        async_redis_client, conversation_id, last_event_id
                     )
-                    message_template = template_based_on_message(
-                        state.messages[-1], templates
+                except redis.ResponseError as e:
+                    # Only the live events are sent
+                    logging.warning(
+                        f"Failed to replay the events after {last_event_id}: {e}"
                     )
-                    yield {
-                        "event": "message",
-                        "data": message_template.replace("\n", ""),
-                    }
-                await asyncio.sleep(0.1)
-        finally:
-            pubsub.unsubscribe()
+                    last_sent = None
+            for event in missed_events:
+                last_sent = event.event_id
+                yield server_sent_event(event)
+            while True:
+                message_data = await queue.get()
+                event = edu_model.ConversationEvent.model_validate_json(message_data)
+                if (
+                    last_sent
+                    and event.event_id
+                    and history.event_id_order(event.event_id)
+                    <= history.event_id_order(last_sent)
+                ):
+                    continue
+                last_sent = event.event_id or last_sent
+                yield server_sent_event(event)
 
-    return EventSourceResponse(event_generator())
+    return EventSourceResponse(event_generator(), ping=settings.sse_ping_seconds)
 
 
 @app.post("/conversation/{conversation_id}", status_code=201)
 async def handle_action(
     conversation_id: str,
     questions_request: edu_model.QuestionsRequest,
-    background_task: BackgroundTasks,
 ):
-    state = await get_state_json(conversation_id)
+    state = await asyncio.to_thread(
+        conversations.load_conversation, redis_client, conversation_id
+    )
     if state is None:
         raise HTTPException(
             status_code=404, detail=f"Conversaton with {conversation_id} does not exist"
@@ -124,10 +233,14 @@ async def handle_action(
         questions_score=None,
     )
 
-    state = state.model_copy(update={"questions": questions}, deep=True)
-    model_json = state.model_dump_json()
-    background_task.add_task(
-        edu_worker.process_action, model_json, None, edu_model.StateAction.COORDINATE
+    # Every question starts from a clean state, the query, sources and answer
+    # of the previous question would otherwise steer the new search
+    state = edu_model.create_initial_state(conversation_id).immutable_copy_questions(
+        questions
+    )
+    job = edu_model.Job(
+        state=state, previous_action=None, action=edu_model.StateAction.COORDINATE
     )
+    await jobs.enqueue_job_async(async_redis_client, job)
 
     return {"status": "Action is being processed"}
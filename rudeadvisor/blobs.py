@@ -0,0 +1,81 @@
+from hashlib import sha256
+from rudeadvisor import cache
+from rudeadvisor import model as edu_model
+from rudeadvisor.config import settings
+import logging
+import zlib
+
+
+# Page text is stored once, compressed, under the hash of the text. The same
+# page scraped by many conversations shares one blob, and the states only
+# carry the key.
+blob_stats = cache.CacheStats("blobs")
+blob_store = cache.create_backend(
+    settings.blob_backend, "blobs", settings.blob_max_bytes, blob_stats
+)
+
+
+def blob_key(text: str) -> str:
+    return sha256(text.encode()).hexdigest()
+
+
+def put_text(text: str) -> str:
+    key = blob_key(text)
+    # A blob that is already stored only has its TTL renewed, the text is not
+    # compressed and sent again
+    if not blob_store.touch(key, settings.blob_ttl_seconds):
+        blob_store.set(key, zlib.compress(text.encode(), 1), settings.blob_ttl_seconds)
+    return key
+
+
+def get_text(key: str) -> str | None:
+    data = blob_store.get(key)
+    if data is None:
+        blob_stats.record_miss()
+        return None
+    blob_stats.record_hit()
+    return zlib.decompress(data).decode()
+
+
+def offload_web_data(
+    web_data_collection: edu_model.WebDataCollection,
+) -> edu_model.WebDataCollection:
+    """
+    Move the text of pages of at least blob_min_bytes to the blob store,
+    leaving references in the collection. Without a blob store the text
+    stays in the collection.
+    """
+    if blob_store is None:
+        return web_data_collection
+    return web_data_collection.immutable_update(
+        web_data_collection=[
+            (
+                web_data.immutable_update(data="", blob_key=put_text(web_data.data))
+                if len(web_data.data) >= settings.blob_min_bytes
+                else web_data
+            )
+            for web_data in web_data_collection.web_data_collection
+        ]
+    )
+
+
+def resolve_web_data(
+    web_data_collection: edu_model.WebDataCollection | None,
+) -> edu_model.WebDataCollection | None:
+    """
+    Put the text of referenced pages back into the collection, for the steps
+    that read it. A blob that was evicted leaves its page empty.
+    """
+    if web_data_collection is None or blob_store is None:
+        return web_data_collection
+
+    resolved = []
+    for web_data in web_data_collection.web_data_collection:
+        if web_data.blob_key is None:
+            resolved.append(web_data)
+            continue
+        text = get_text(web_data.blob_key)
+        if text is None:
+            logging.warning(f"The text of {web_data.link} is no longer stored")
+        resolved.append(web_data.immutable_update(data=text or "", blob_key=None))
+    return web_data_collection.immutable_update(web_data_collection=resolved)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+import redis.asyncio
+
+
+CHANNEL_PREFIX = "conversation:"
+
+
+def channel_name(conversation_id: str) -> str:
+    return f"{CHANNEL_PREFIX}{conversation_id}"
+
+
+class ConversationBroadcaster:
+    """
+    One Redis pubsub connection per process, shared by every SSE client.
+
+    Channels are subscribed dynamically and reference counted: the first
+    listener of a conversation subscribes to its channel and the last one to
+    leave unsubscribes. A single reader task fans incoming messages out to a
+    bounded queue per listener. A listener that falls behind loses its oldest
+    messages rather than growing without limit. A listener is only registered
+    once its channel is subscribed, so a failed subscription leaves nothing
+    behind.
+    """
+
+    def __init__(self, redis_client: redis.asyncio.Redis, queue_size: int = 100):
+        self._redis_client = redis_client
+        self._queue_size = queue_size
+        self._pubsub = None
+        self._reader: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self._listeners: dict[str, set[asyncio.Queue]] = {}
+        self._subscribed: set[str] = set()
+
+    async def subscribe(self, conversation_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._queue_size)
+        async with self._lock:
+            if conversation_id not in self._subscribed:
+                if self._pubsub is None:
+                    self._pubsub = self._redis_client.pubsub()
+                await self._pubsub.subscribe(channel_name(conversation_id))
+                self._subscribed.add(conversation_id)
+                logging.debug(f"Subscribed to {channel_name(conversation_id)}")
+            self._listeners.setdefault(conversation_id, set()).add(queue)
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.create_task(self._read_messages())
+        return queue
+
+    async def unsubscribe(self, conversation_id: str, queue: asyncio.Queue):
+        async with self._lock:
+            listeners = self._listeners.get(conversation_id)
+            if listeners is None:
+                return
+            listeners.discard(queue)
+            if listeners:
+                return
+            del self._listeners[conversation_id]
+            if conversation_id in self._subscribed and self._pubsub is not None:
+                self._subscribed.discard(conversation_id)
+                await self._pubsub.unsubscribe(channel_name(conversation_id))
+                logging.debug(f"Unsubscribed from {channel_name(conversation_id)}")
+
+    @asynccontextmanager
+    async def listen(self, conversation_id: str) -> AsyncIterator[asyncio.Queue]:
+        queue = await self.subscribe(conversation_id)
+        try:
+            yield queue
+        finally:
+            await self.unsubscribe(conversation_id, queue)
+
+    def listener_count(self, conversation_id: str) -> int:
+        return len(self._listeners.get(conversation_id, ()))
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        self._listeners.clear()
+        self._subscribed.clear()
+
+    async def _read_messages(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=None
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Reading from the conversation pubsub failed: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            if message is None or message["type"] != "message":
+                continue
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            self._dispatch(channel.removeprefix(CHANNEL_PREFIX), message["data"])
+
+    def _dispatch(self, conversation_id: str, data):
+        for queue in self._listeners.get(conversation_id, ()):
+            if queue.full():
+                logging.warning(
+                    f"Listener queue for conversation {conversation_id} is full, dropping the oldest message"
+                )
+                queue.get_nowait()
+            queue.put_nowait(data)
@@ -0,0 +1,437 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Protocol, TypeVar
+from uuid import uuid4
+import logging
+import os
+import struct
+import time
+import redis
+from rudeadvisor import metrics
+from rudeadvisor.config import settings
+
+
+T = TypeVar("T")
+
+redis_client = redis.Redis(
+    host=settings.redis_host, port=settings.redis_port, db=settings.redis_db
+)
+
+
+class CacheStats:
+    """
+    Counters for one cache. They are per process and only ever increase. The
+    counters of a named cache are also recorded as metrics.
+    """
+
+    def __init__(self, name: str | None = None):
+        self._name = name
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+
+    def record_hit(self, bytes_saved: int = 0, revalidated: bool = False):
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += bytes_saved
+            if revalidated:
+                self.revalidations += 1
+        if self._name:
+            metrics.increment(
+                "rudeadvisor_cache_requests_total", cache=self._name, result="hit"
+            )
+            if bytes_saved:
+                metrics.increment(
+                    "rudeadvisor_cache_bytes_saved_total", bytes_saved, cache=self._name
+                )
+            if revalidated:
+                metrics.increment(
+                    "rudeadvisor_cache_revalidations_total", cache=self._name
+                )
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+        if self._name:
+            metrics.increment(
+                "rudeadvisor_cache_requests_total", cache=self._name, result="miss"
+            )
+
+    def record_evictions(self, count: int):
+        with self._lock:
+            self.evictions += count
+        if self._name and count:
+            metrics.increment(
+                "rudeadvisor_cache_evictions_total", count, cache=self._name
+            )
+
+
+class CacheBackend(Protocol):
+    def get(self, key: str) -> bytes | None: ...
+
+    def set(self, key: str, value: bytes, ttl: float | None = None): ...
+
+    def touch(self, key: str, ttl: float | None = None) -> bool: ...
+
+    def delete(self, key: str): ...
+
+
+class MemoryCacheBackend:
+    """
+    In-process LRU cache bounded by the total size of its values.
+    """
+
+    def __init__(self, max_bytes: int, stats: CacheStats):
+        self._max_bytes = max_bytes
+        self._stats = stats
+        self._lock = Lock()
+        self._entries: OrderedDict[str, tuple[float | None, bytes]] = OrderedDict()
+        self._total_bytes = 0
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.time() + ttl if ttl else None, value)
+            self._total_bytes += len(value)
+            evicted = 0
+            while self._total_bytes > self._max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+                evicted += 1
+        if evicted:
+            self._stats.record_evictions(evicted)
+
+    def touch(self, key: str, ttl: float | None = None) -> bool:
+        """
+        Renew the expiry of an entry. Returns False if there is none.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[0] is not None and entry[0] < time.time()):
+                return False
+            self._entries[key] = (time.time() + ttl if ttl else None, entry[1])
+            self._entries.move_to_end(key)
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= len(entry[1])
+
+
+class DiskCacheBackend:
+    """
+    One file per entry, named by the hash of the key. The modification time of
+    a file is its last use, and the least recently used files are removed when
+    the directory grows past max_bytes. Each file starts with its expiry time.
+    The directory is created by the first write.
+    """
+
+    HEADER = struct.Struct(">d")
+
+    def __init__(self, directory: str | Path, max_bytes: int, stats: CacheStats):
+        self._directory = Path(directory)
+        self._max_bytes = max_bytes
+        self._stats = stats
+        self._lock = Lock()
+        self._total_bytes = sum(path.stat().st_size for path in self._files())
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        (expires_at,) = self.HEADER.unpack_from(data)
+        if expires_at and expires_at < time.time():
+            self.delete(key)
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data[self.HEADER.size :]
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        path = self._path(key)
+        data = self.HEADER.pack(time.time() + ttl if ttl else 0) + value
+        temporary_path = path.with_suffix(f".{os.getpid()}.tmp")
+        self._directory.mkdir(parents=True, exist_ok=True)
+        temporary_path.write_bytes(data)
+        with self._lock:
+            self._total_bytes -= self._size(path)
+            os.replace(temporary_path, path)
+            self._total_bytes += len(data)
+            if self._total_bytes > self._max_bytes:
+                self._evict()
+
+    def touch(self, key: str, ttl: float | None = None) -> bool:
+        """
+        Renew the expiry of an entry by rewriting the header of its file.
+        Returns False if there is none.
+        """
+        path = self._path(key)
+        try:
+            with path.open("r+b") as file:
+                (expires_at,) = self.HEADER.unpack(file.read(self.HEADER.size))
+                if expires_at and expires_at < time.time():
+                    return False
+                file.seek(0)
+                file.write(self.HEADER.pack(time.time() + ttl if ttl else 0))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, key: str):
+        path = self._path(key)
+        with self._lock:
+            self._total_bytes -= self._size(path)
+            path.unlink(missing_ok=True)
+
+    def _evict(self):
+        evicted = 0
+        for path in sorted(self._files(), key=lambda path: path.stat().st_mtime):
+            if self._total_bytes <= self._max_bytes:
+                break
+            self._total_bytes -= self._size(path)
+            path.unlink(missing_ok=True)
+            evicted += 1
+        self._stats.record_evictions(evicted)
+
+    def _files(self) -> list[Path]:
+        return list(self._directory.glob("*.bin"))
+
+    def _path(self, key: str) -> Path:
+        return self._directory / f"{sha256(key.encode()).hexdigest()}.bin"
+
+    @staticmethod
+    def _size(path: Path) -> int:
+        try:
+            return path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+
+class RedisCacheBackend:
+    """
+    Cache shared by every process using the same Redis. Last use is tracked in
+    a sorted set and the least recently used entries are removed when the
+    namespace grows past max_bytes. The sizes of entries that Redis expired
+    are dropped when a get misses them or eviction reaches them.
+    """
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        namespace: str,
+        max_bytes: int,
+        stats: CacheStats,
+    ):
+        self._redis_client = redis_client
+        self._prefix = f"cache:{namespace}"
+        self._max_bytes = max_bytes
+        self._stats = stats
+
+    def get(self, key: str) -> bytes | None:
+        value = self._redis_client.get(self._key(key))
+        if value is not None:
+            self._redis_client.zadd(f"{self._prefix}:lru", {key: time.time()})
+        elif self._redis_client.hexists(f"{self._prefix}:sizes", key):
+            self._forget(key)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        previous_size = self._redis_client.hget(f"{self._prefix}:sizes", key)
+        pipeline = self._redis_client.pipeline()
+        pipeline.set(self._key(key), value, px=int(ttl * 1000) if ttl else None)
+        pipeline.hset(f"{self._prefix}:sizes", key, len(value))
+        pipeline.zadd(f"{self._prefix}:lru", {key: time.time()})
+        pipeline.incrby(f"{self._prefix}:bytes", len(value) - int(previous_size or 0))
+        total_bytes = pipeline.execute()[-1]
+        if total_bytes > self._max_bytes:
+            self._evict(total_bytes)
+
+    def touch(self, key: str, ttl: float | None = None) -> bool:
+        """
+        Renew the expiry of an entry. Returns False if there is none.
+        """
+        pipeline = self._redis_client.pipeline()
+        if ttl:
+            pipeline.pexpire(self._key(key), int(ttl * 1000))
+        else:
+            pipeline.persist(self._key(key))
+        pipeline.exists(self._key(key))
+        _, exists = pipeline.execute()
+        if exists:
+            self._redis_client.zadd(f"{self._prefix}:lru", {key: time.time()})
+        return bool(exists)
+
+    def delete(self, key: str):
+        self._forget(key)
+
+    def _evict(self, total_bytes: int):
+        evicted = 0
+        while total_bytes > self._max_bytes:
+            oldest = self._redis_client.zpopmin(f"{self._prefix}:lru")
+            if not oldest:
+                break
+            key = oldest[0][0]
+            key = key.decode() if isinstance(key, bytes) else key
+            existed, total_bytes = self._forget(key)
+            # An entry that already expired frees its size without counting
+            # as an eviction
+            evicted += existed
+        self._stats.record_evictions(evicted)
+
+    def _forget(self, key: str) -> tuple[bool, int]:
+        """
+        Remove an entry with its size and last use. Returns whether the entry
+        still existed and the new total size of the namespace.
+        """
+        size = self._redis_client.hget(f"{self._prefix}:sizes", key)
+        pipeline = self._redis_client.pipeline()
+        pipeline.delete(self._key(key))
+        pipeline.hdel(f"{self._prefix}:sizes", key)
+        pipeline.zrem(f"{self._prefix}:lru", key)
+        pipeline.decrby(f"{self._prefix}:bytes", int(size or 0))
+        deleted, _, _, total_bytes = pipeline.execute()
+        return deleted > 0, total_bytes
+
+    def _key(self, key: str) -> str:
+        return f"{self._prefix}:entry:{key}"
+
+
+def create_backend(
+    kind: str, namespace: str, max_bytes: int, stats: CacheStats
+) -> CacheBackend | None:
+    """
+    Create the backend named by a setting: "memory", "disk", "redis" or "none".
+    """
+    match kind:
+        case "memory":
+            return MemoryCacheBackend(max_bytes, stats)
+        case "disk":
+            return DiskCacheBackend(
+                Path(settings.cache_directory) / namespace, max_bytes, stats
+            )
+        case "redis":
+            return RedisCacheBackend(redis_client, namespace, max_bytes, stats)
+        case "none":
+            return None
+        case _:
+            logging.warning(f"Unknown cache backend {kind}, caching is disabled")
+            return None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one call whose result every
+    caller shares. Within a process later callers wait for the first one. Across
+    processes a Redis lock elects one caller, and the others poll `lookup` (the
+    cache the elected caller writes to) until the result shows up or the lock is
+    released.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        redis_client: redis.Redis | None,
+        lock_ttl_ms: int,
+        poll_interval_ms: int,
+    ):
+        self._namespace = namespace
+        self._redis_client = redis_client
+        self._lock_ttl_ms = lock_ttl_ms
+        self._poll_interval_ms = poll_interval_ms
+        self._lock = Lock()
+        self._calls: dict[str, Future] = {}
+
+    def run(self, key: str, call: Callable[[], T], lookup: Callable[[], T | None]) -> T:
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not is_leader:
+            logging.debug(
+                f"Waiting for the {self._namespace} call already running for {key}"
+            )
+            return future.result()
+
+        try:
+            result = self._run_once_across_processes(key, call, lookup)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def _run_once_across_processes(
+        self, key: str, call: Callable[[], T], lookup: Callable[[], T | None]
+    ) -> T:
+        if self._redis_client is None:
+            return call()
+
+        lock_key = f"singleflight:{self._namespace}:{sha256(key.encode()).hexdigest()}"
+        token = uuid4().hex
+        deadline = time.monotonic() + self._lock_ttl_ms / 1000
+        while True:
+            try:
+                acquired = self._redis_client.set(
+                    lock_key, token, nx=True, px=self._lock_ttl_ms
+                )
+            except Exception as e:
+                logging.error(f"Failed to take the {self._namespace} lock: {e}")
+                return call()
+
+            if acquired:
+                try:
+                    # The previous holder may have stored the result just before
+                    # it released the lock
+                    result = lookup()
+                    return result if result is not None else call()
+                finally:
+                    self._release(lock_key, token)
+
+            result = lookup()
+            if result is not None:
+                logging.debug(f"Shared the {self._namespace} result of another worker")
+                return result
+            if time.monotonic() > deadline:
+                return call()
+            time.sleep(self._poll_interval_ms / 1000)
+
+    def _release(self, lock_key: str, token: str):
+        try:
+            owner = self._redis_client.get(lock_key)
+            if owner is not None and owner.decode() == token:
+                self._redis_client.delete(lock_key)
+        except Exception as e:
+            logging.error(f"Failed to release the {self._namespace} lock: {e}")
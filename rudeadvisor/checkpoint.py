@@ -0,0 +1,83 @@
+import logging
+import time
+import redis
+from rudeadvisor import codec
+from rudeadvisor import model as edu_model
+from rudeadvisor.config import settings
+
+
+ACTIVE_CHECKPOINTS_KEY = "checkpoints:active"
+RECOVERY_LOCK_KEY = "checkpoints:recovery-lock"
+
+
+def checkpoint_key(conversation_id: str) -> str:
+    return f"checkpoint:{conversation_id}"
+
+
+def save_checkpoint(redis_client: redis.Redis, checkpoint: edu_model.Checkpoint):
+    """
+    Store the state of a running pipeline after a step. The conversation is
+    tracked as active, scored by the time of its last step, until it is cleared.
+    A checkpoint that is never cleared expires after checkpoint_ttl_seconds.
+    """
+    pipeline = redis_client.pipeline()
+    pipeline.set(
+        checkpoint_key(checkpoint.conversation_id),
+        codec.encode(checkpoint),
+        ex=settings.checkpoint_ttl_seconds,
+    )
+    pipeline.zadd(ACTIVE_CHECKPOINTS_KEY, {checkpoint.conversation_id: time.time()})
+    pipeline.execute()
+    logging.debug(
+        f"Checkpointed {checkpoint.conversation_id} before {checkpoint.next_action}"
+    )
+
+
+def load_checkpoint(
+    redis_client: redis.Redis, conversation_id: str
+) -> edu_model.Checkpoint | None:
+    checkpoint_data = redis_client.get(checkpoint_key(conversation_id))
+    if checkpoint_data:
+        return codec.decode(checkpoint_data, edu_model.Checkpoint)
+    return None
+
+
+def clear_checkpoint(redis_client: redis.Redis, conversation_id: str):
+    pipeline = redis_client.pipeline()
+    pipeline.delete(checkpoint_key(conversation_id))
+    pipeline.zrem(ACTIVE_CHECKPOINTS_KEY, conversation_id)
+    pipeline.execute()
+
+
+def find_stalled_conversations(
+    redis_client: redis.Redis, stalled_after_seconds: float
+) -> list[str]:
+    """
+    Conversations with a pipeline in flight that has not completed a step for
+    stalled_after_seconds. Their worker is most likely gone.
+    """
+    conversation_ids = redis_client.zrangebyscore(
+        ACTIVE_CHECKPOINTS_KEY, "-inf", time.time() - stalled_after_seconds
+    )
+    return [
+        (
+            conversation_id.decode()
+            if isinstance(conversation_id, bytes)
+            else conversation_id
+        )
+        for conversation_id in conversation_ids
+    ]
+
+
+def claim_recovery_scan(redis_client: redis.Redis) -> bool:
+    """
+    Only one worker at a time should requeue stalled conversations.
+    """
+    return bool(
+        redis_client.set(
+            RECOVERY_LOCK_KEY,
+            "1",
+            nx=True,
+            ex=settings.checkpoint_scan_interval_seconds,
+        )
+    )
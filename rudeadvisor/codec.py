@@ -0,0 +1,116 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Callable, TypeVar
+from rudeadvisor.config import settings
+import struct
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+T = TypeVar("T", bound=BaseModel)
+
+# A binary frame starts with a header: the magic bytes, the frame version, the
+# encoding of the body and its compression. Plain JSON written by older
+# versions starts with "{" and is read without a header.
+FRAME_MAGIC = b"\xa9RA"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("!3sBBB")
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+ZLIB_LEVEL = 1
+
+
+class Encoding(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    name: str
+    tag: int
+    dump: Callable[[BaseModel], bytes]
+    load: Callable[[bytes, type[BaseModel]], BaseModel]
+
+
+def dump_json(model: BaseModel) -> bytes:
+    return model.model_dump_json().encode()
+
+
+def load_json(body: bytes, model_type: type[T]) -> T:
+    return model_type.model_validate_json(body)
+
+
+def dump_msgpack(model: BaseModel) -> bytes:
+    return msgpack.packb(model.model_dump(mode="json"))
+
+
+def load_msgpack(body: bytes, model_type: type[T]) -> T:
+    return model_type.model_validate(msgpack.unpackb(body))
+
+
+ENCODINGS = {
+    encoding.name: encoding
+    for encoding in [
+        Encoding(name="json", tag=1, dump=dump_json, load=load_json),
+        Encoding(name="msgpack", tag=2, dump=dump_msgpack, load=load_msgpack),
+    ]
+}
+ENCODINGS_BY_TAG = {encoding.tag: encoding for encoding in ENCODINGS.values()}
+
+
+def encoding_named(name: str) -> Encoding:
+    if name not in ENCODINGS:
+        raise ValueError(f"Unknown state encoding {name}")
+    if name == "msgpack" and msgpack is None:
+        raise ValueError("The msgpack state encoding needs `pip install msgpack`")
+    return ENCODINGS[name]
+
+
+def encode(
+    model: BaseModel,
+    codec: str | None = None,
+    encoding: str | None = None,
+    compress_min_bytes: int | None = None,
+) -> bytes:
+    """
+    Serialize a model for Redis. The "binary" codec writes a tagged frame whose
+    body is compressed once it is at least compress_min_bytes long, which is
+    where the scraped text makes up most of a state. The "json" codec writes
+    the plain JSON that versions without this module read.
+    """
+    codec = codec or settings.state_codec
+    if codec == "json":
+        return dump_json(model)
+    if codec != "binary":
+        raise ValueError(f"Unknown state codec {codec}")
+
+    chosen = encoding_named(encoding or settings.state_encoding)
+    if compress_min_bytes is None:
+        compress_min_bytes = settings.state_compress_min_bytes
+    body = chosen.dump(model)
+    compression = COMPRESSION_NONE
+    if 0 <= compress_min_bytes <= len(body):
+        body = zlib.compress(body, ZLIB_LEVEL)
+        compression = COMPRESSION_ZLIB
+    return FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, chosen.tag, compression) + body
+
+
+def decode(data: bytes | str, model_type: type[T]) -> T:
+    """
+    Read a model written by encode with any codec, or by an older version as
+    plain JSON.
+    """
+    if isinstance(data, str) or not data.startswith(FRAME_MAGIC):
+        return model_type.model_validate_json(data)
+
+    _, version, tag, compression = FRAME_HEADER.unpack_from(data)
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported state frame version {version}")
+    if tag not in ENCODINGS_BY_TAG:
+        raise ValueError(f"Unknown state encoding tag {tag}")
+    body = data[FRAME_HEADER.size :]
+    if compression == COMPRESSION_ZLIB:
+        body = zlib.decompress(body)
+    elif compression != COMPRESSION_NONE:
+        raise ValueError(f"Unknown state compression {compression}")
+    return encoding_named(ENCODINGS_BY_TAG[tag].name).load(body, model_type)
@@ -0,0 +1,120 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Mapping
+import os
+
+
+ENV_PREFIX = "RUDEADVISOR_"
+
+
+class Settings(BaseModel):
+    """
+    Runtime settings. Every field can be overridden with an environment
+    variable named RUDEADVISOR_<FIELD NAME IN UPPER CASE>.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    redis_host: str = "localhost"
+    redis_port: int = 6379
+    redis_db: int = 0
+    # "binary" writes tagged, compressed frames, "json" the plain JSON of older
+    # versions. Both are always read.
+    state_codec: str = "binary"
+    state_encoding: str = "json"
+    state_compress_min_bytes: int = 1_024
+    conversation_idle_ttl_seconds: int = 86_400
+    conversation_max_age_seconds: int = 604_800
+    conversation_max_bytes: int = 1_000_000
+    history_max_events: int = 1_000
+    history_page_size: int = 50
+    sse_ping_seconds: int = 15
+
+    job_stream: str = "rudeadvisor:jobs"
+    job_group: str = "rudeadvisor-workers"
+    job_block_ms: int = 5_000
+    job_claim_idle_ms: int = 120_000
+    job_max_deliveries: int = 3
+    worker_concurrency: int = 64
+
+    pipeline_max_steps: int = 25
+    pipeline_max_action_retries: int = 2
+    checkpoint_stall_seconds: int = 600
+    checkpoint_scan_interval_seconds: int = 60
+    checkpoint_ttl_seconds: int = 86_400
+    metrics_flush_interval_seconds: int = 10
+
+    scrape_concurrency: int = 32
+    scrape_per_host_concurrency: int = 2
+    scrape_connect_timeout: float = 5.0
+    scrape_read_timeout: float = 15.0
+    scrape_max_bytes: int = 10_000_000
+    pdf_max_pages: int = 50
+    pdf_max_chars: int = 200_000
+    pdf_sample_pages: int = 3
+    html_extractor: str = "stream"
+    extract_processes: int = 2
+
+    cache_directory: str = ".cache/rudeadvisor"
+    content_cache_backend: str = "disk"
+    content_cache_max_bytes: int = 256_000_000
+    content_cache_fresh_seconds: int = 86_400
+    blob_backend: str = "redis"
+    blob_max_bytes: int = 512_000_000
+    blob_ttl_seconds: int = 604_800
+    blob_min_bytes: int = 1_024
+
+    llm_provider: str = "openai"
+    llm_model: str = "gpt-4o-mini"
+    llm_concurrency: int = 16
+    # Per tool overrides of the provider and model, empty means the default
+    llm_provider_score: str = ""
+    llm_provider_challenge: str = ""
+    llm_provider_query: str = ""
+    llm_provider_sources: str = ""
+    llm_provider_answer: str = ""
+    llm_model_score: str = ""
+    llm_model_challenge: str = ""
+    llm_model_query: str = ""
+    llm_model_sources: str = ""
+    llm_model_answer: str = ""
+    ollama_host: str = "http://localhost:11434"
+    ollama_model: str = "llama3.1"
+    ollama_concurrency: int = 2
+    search_concurrency: int = 4
+    llm_cache_enabled: bool = True
+    llm_cache_backend: str = "memory"
+    llm_cache_max_bytes: int = 64_000_000
+    llm_cache_ttl_score: int = 86_400
+    llm_cache_ttl_challenge: int = 3_600
+    llm_cache_ttl_query: int = 86_400
+    llm_cache_ttl_sources: int = 86_400
+    llm_cache_ttl_answer: int = 3_600
+    answer_fragment_min_chars: int = 40
+
+    context_token_budget: int = 6_000
+    context_passage_words: int = 150
+
+    index_enabled: bool = True
+    index_path: str = ".cache/rudeadvisor/index.sqlite3"
+    index_max_age_seconds: int = 604_800
+    index_min_passages: int = 5
+    index_min_term_coverage: float = 0.5
+    index_search_limit: int = 50
+
+    search_cache_backend: str = "redis"
+    search_cache_max_bytes: int = 16_000_000
+    search_cache_ttl: int = 3_600
+    search_lock_ttl_ms: int = 30_000
+    search_lock_poll_ms: int = 100
+
+
+def load_settings(environ: Mapping[str, str] = os.environ) -> Settings:
+    overrides = {
+        name: environ[ENV_PREFIX + name.upper()]
+        for name in Settings.model_fields
+        if ENV_PREFIX + name.upper() in environ
+    }
+    return Settings.model_validate(overrides)
+
+
+settings = load_settings()
@@ -0,0 +1,122 @@
+from collections import Counter
+from rudeadvisor import model as edu_model
+import logging
+import math
+import re
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOP_WORDS = frozenset(
+    """
+    a about all also an and any are as at be been but by can could did do does for
+    from had has have he her his how i if in into is it its me my not of on or our
+    she should so some than that the their them then there these they this those to
+    us was we were what when where which who why will with would you your
+    """.split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOP_WORDS
+    ]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count for budgeting, about four characters per token for English.
+    """
+    return len(text) // 4 + 1
+
+
+def split_passages(
+    web_data: edu_model.WebData, passage_words: int
+) -> list[edu_model.Passage]:
+    words = web_data.data.split()
+    return [
+        edu_model.Passage(
+            link=web_data.link,
+            index=index,
+            text=" ".join(words[start : start + passage_words]),
+        )
+        for index, start in enumerate(range(0, len(words), passage_words))
+    ]
+
+
+def bm25_scores(
+    documents: list[list[str]], query: list[str], k1: float = 1.5, b: float = 0.75
+) -> list[float]:
+    if not documents:
+        return []
+    average_length = sum(len(document) for document in documents) / len(documents)
+    document_frequency = Counter(
+        term for document in documents for term in set(document)
+    )
+    query_terms = set(query)
+
+    def idf(term: str) -> float:
+        frequency = document_frequency[term]
+        return math.log((len(documents) - frequency + 0.5) / (frequency + 0.5) + 1)
+
+    scores = []
+    for document in documents:
+        term_counts = Counter(document)
+        length_norm = k1 * (1 - b + b * len(document) / (average_length or 1))
+        scores.append(
+            sum(
+                idf(term)
+                * term_counts[term]
+                * (k1 + 1)
+                / (term_counts[term] + length_norm)
+                for term in query_terms
+                if term in term_counts
+            )
+        )
+    return scores
+
+
+def build_context(
+    web_data_collection: edu_model.WebDataCollection | None,
+    questions: edu_model.Questions,
+    token_budget: int,
+    passage_words: int,
+) -> edu_model.ContextSelection:
+    """
+    Split the scraped pages into passages, rank them against the questions with
+    BM25 and keep the best ones that fit in the token budget. The selected
+    passages are returned in page order so that the prompt reads naturally.
+    """
+    passages = [
+        passage
+        for web_data in (
+            web_data_collection.web_data_collection if web_data_collection else []
+        )
+        for passage in split_passages(web_data, passage_words)
+    ]
+    query = tokenize(" ".join(q.question_text for q in questions.questions))
+    scores = bm25_scores([tokenize(passage.text) for passage in passages], query)
+
+    ranked = sorted(
+        range(len(passages)), key=lambda position: scores[position], reverse=True
+    )
+    selected = []
+    remaining_budget = token_budget
+    for position in ranked:
+        tokens = estimate_tokens(passages[position].text)
+        if tokens <= remaining_budget:
+            selected.append(position)
+            remaining_budget -= tokens
+
+    logging.debug(
+        f"Selected {len(selected)} of {len(passages)} passages using {token_budget - remaining_budget} of {token_budget} tokens"
+    )
+    return edu_model.ContextSelection(
+        passages=[
+            passages[position].immutable_update(score=scores[position])
+            for position in sorted(selected)
+        ],
+        token_estimate=token_budget - remaining_budget,
+        candidate_count=len(passages),
+    )
@@ -0,0 +1,158 @@
+import logging
+import time
+import redis
+from rudeadvisor import codec
+from rudeadvisor import model as edu_model
+from rudeadvisor.config import settings
+
+
+# Every conversation is a hash with its encoded state and creation time, which
+# expires when the conversation has been idle for too long or is too old. The
+# expiry index and the sizes are kept next to it, so that conversations that
+# Redis expired can still be counted.
+EXPIRY_INDEX_KEY = "conversations:expiry"
+SIZES_KEY = "conversations:bytes"
+STATS_KEY = "conversations:stats"
+STATE_FIELD = "state"
+CREATED_AT_FIELD = "created_at"
+
+
+class ConversationTooLarge(ValueError):
+    pass
+
+
+def conversation_key(conversation_id: str) -> str:
+    return f"conversation-state:{conversation_id}"
+
+
+def time_to_live(created_at: float, now: float) -> int:
+    """
+    Seconds until a conversation that is active now expires: after the idle
+    TTL, but never later than the maximum age.
+    """
+    return int(
+        min(
+            settings.conversation_idle_ttl_seconds,
+            created_at + settings.conversation_max_age_seconds - now,
+        )
+    )
+
+
+def refresh(
+    pipeline: redis.client.Pipeline, conversation_id: str, created_at: float
+) -> int:
+    now = time.time()
+    ttl = time_to_live(created_at, now)
+    if ttl > 0:
+        pipeline.expire(conversation_key(conversation_id), ttl)
+        pipeline.zadd(EXPIRY_INDEX_KEY, {conversation_id: now + ttl})
+    else:
+        pipeline.delete(conversation_key(conversation_id))
+    return ttl
+
+
+def save_conversation(redis_client: redis.Redis, state: edu_model.ConversationState):
+    """
+    Store a conversation and refresh its TTL. A state larger than
+    conversation_max_bytes once encoded is refused.
+    """
+    data = codec.encode(state)
+    if len(data) > settings.conversation_max_bytes:
+        redis_client.hincrby(STATS_KEY, "rejected", 1)
+        raise ConversationTooLarge(
+            f"Conversation {state.conversation_id} is {len(data)} bytes, the limit is {settings.conversation_max_bytes}"
+        )
+
+    key = conversation_key(state.conversation_id)
+    created_at = redis_client.hget(key, CREATED_AT_FIELD)
+    pipeline = redis_client.pipeline()
+    if created_at is None:
+        created_at = time.time()
+        pipeline.hincrby(STATS_KEY, "created", 1)
+    pipeline.hset(key, mapping={STATE_FIELD: data, CREATED_AT_FIELD: created_at})
+    pipeline.hset(SIZES_KEY, state.conversation_id, len(data))
+    refresh(pipeline, state.conversation_id, float(created_at))
+    pipeline.execute()
+
+
+def load_conversation(
+    redis_client: redis.Redis, conversation_id: str
+) -> edu_model.ConversationState | None:
+    """
+    The state of a conversation, or None if it does not exist or expired.
+    Loading a conversation counts as activity and refreshes its TTL.
+    """
+    data, created_at = redis_client.hmget(
+        conversation_key(conversation_id), [STATE_FIELD, CREATED_AT_FIELD]
+    )
+    if data is None or created_at is None:
+        return None
+    pipeline = redis_client.pipeline()
+    ttl = refresh(pipeline, conversation_id, float(created_at))
+    pipeline.execute()
+    if ttl <= 0:
+        return None
+    return codec.decode(data, edu_model.ConversationState)
+
+
+def touch_conversation(redis_client: redis.Redis, conversation_id: str) -> bool:
+    created_at = redis_client.hget(conversation_key(conversation_id), CREATED_AT_FIELD)
+    if created_at is None:
+        return False
+    pipeline = redis_client.pipeline()
+    ttl = refresh(pipeline, conversation_id, float(created_at))
+    pipeline.execute()
+    return ttl > 0
+
+
+def delete_conversation(redis_client: redis.Redis, conversation_id: str):
+    pipeline = redis_client.pipeline()
+    pipeline.delete(conversation_key(conversation_id))
+    pipeline.zrem(EXPIRY_INDEX_KEY, conversation_id)
+    pipeline.hdel(SIZES_KEY, conversation_id)
+    pipeline.hincrby(STATS_KEY, "deleted", 1)
+    pipeline.execute()
+
+
+def prune_expired_conversations(redis_client: redis.Redis) -> int:
+    """
+    Remove the conversations that Redis expired from the index and count them
+    with their size as expired.
+    """
+    expired = redis_client.zrangebyscore(EXPIRY_INDEX_KEY, "-inf", time.time())
+    if not expired:
+        return 0
+    sizes = redis_client.hmget(SIZES_KEY, expired)
+
+    pipeline = redis_client.pipeline()
+    pipeline.zrem(EXPIRY_INDEX_KEY, *expired)
+    pipeline.hdel(SIZES_KEY, *expired)
+    pipeline.hincrby(STATS_KEY, "expired", len(expired))
+    pipeline.hincrby(
+        STATS_KEY, "expired_bytes", sum(int(size) for size in sizes if size)
+    )
+    pipeline.execute()
+    logging.debug(f"Pruned {len(expired)} expired conversations")
+    return len(expired)
+
+
+def conversation_stats(redis_client: redis.Redis) -> edu_model.ConversationStats:
+    prune_expired_conversations(redis_client)
+    pipeline = redis_client.pipeline()
+    pipeline.zcard(EXPIRY_INDEX_KEY)
+    pipeline.hvals(SIZES_KEY)
+    pipeline.hgetall(STATS_KEY)
+    live_count, sizes, counters = pipeline.execute()
+    counters = {
+        (name.decode() if isinstance(name, bytes) else name): int(value)
+        for name, value in counters.items()
+    }
+    return edu_model.ConversationStats(
+        live_count=live_count,
+        live_bytes=sum(int(size) for size in sizes),
+        created_count=counters.get("created", 0),
+        expired_count=counters.get("expired", 0),
+        expired_bytes=counters.get("expired_bytes", 0),
+        deleted_count=counters.get("deleted", 0),
+        rejected_count=counters.get("rejected", 0),
+    )
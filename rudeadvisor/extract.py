@@ -0,0 +1,164 @@
+from bs4 import BeautifulSoup
+from codecs import getincrementaldecoder
+from contextlib import closing
+from functools import cache
+from html.parser import HTMLParser
+from io import BytesIO
+from typing import Callable, Iterator
+from rudeadvisor import model as edu_model
+from rudeadvisor.config import settings
+import logging
+import re
+import pypdf
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+
+SKIPPED_TAGS = frozenset(["script", "style", "header", "footer", "nav", "aside"])
+BLOCK_TAGS = frozenset(
+    """
+    address article blockquote br dd div dl dt figcaption h1 h2 h3 h4 h5 h6 hr li
+    main ol p pre section table td th title tr ul
+    """.split()
+)
+DECODE_CHUNK_BYTES = 65_536
+
+
+def is_text_content(content: str) -> bool:
+    """
+    Checks if the content is primarily textual. Returns True if it is, False otherwise.
+    """
+    if not content:
+        return False
+    non_printable_chars = sum(1 for char in content if not char.isprintable())
+    if non_printable_chars / len(content) > 0.1:
+        return False
+    return True
+
+
+def iter_pdf_pages(content: bytes) -> Iterator[str]:
+    """
+    The text of a PDF page by page. Pages are only parsed when they are reached.
+    """
+    with BytesIO(content) as pdf_file:
+        reader = pypdf.PdfReader(pdf_file)
+        for page in reader.pages:
+            yield page.extract_text() or ""
+
+
+def extract_pdf_text(
+    content: bytes, max_pages: int, max_chars: int, sample_pages: int
+) -> str:
+    """
+    Extract the text of at most max_pages pages and max_chars characters. If
+    the first sample_pages pages are not text, reading stops there and the
+    caller rejects the document without parsing the rest of it.
+    """
+    pages: list[str] = []
+    chars = 0
+    with closing(iter_pdf_pages(content)) as page_texts:
+        for page_text in page_texts:
+            if len(pages) == sample_pages and not is_text_content("\n".join(pages)):
+                break
+            if len(pages) >= max_pages or chars >= max_chars:
+                logging.debug(f"Stopped reading the PDF after {len(pages)} pages")
+                break
+            pages.append(page_text[: max_chars - chars])
+            chars += len(pages[-1]) + 1
+    return "\n".join(pages)
+
+
+class StreamingTextParser(HTMLParser):
+    """
+    Collects the text of a page as it is parsed, leaving out everything inside
+    the skipped tags. Block tags separate words, so that paragraphs do not run
+    into each other.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._skip_depth = 0
+        self._parts: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._parts.append(" ")
+
+    def handle_endtag(self, tag: str):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self._parts.append(" ")
+
+    def handle_data(self, data: str):
+        if not self._skip_depth:
+            self._parts.append(data)
+
+    def text(self) -> str:
+        return " ".join("".join(self._parts).split())
+
+
+def extract_html_text_streaming(content: bytes, encoding: str) -> str:
+    parser = StreamingTextParser()
+    decoder = getincrementaldecoder(encoding)(errors="replace")
+    for start in range(0, len(content), DECODE_CHUNK_BYTES):
+        parser.feed(decoder.decode(content[start : start + DECODE_CHUNK_BYTES]))
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    return parser.text()
+
+
+def extract_html_text_lxml(content: bytes, encoding: str) -> str:
+    root = etree.fromstring(
+        content, etree.HTMLParser(encoding=encoding, remove_comments=True)
+    )
+    if root is None:
+        return ""
+    etree.strip_elements(root, *SKIPPED_TAGS, with_tail=False)
+    return " ".join(" ".join(root.itertext()).split())
+
+
+def extract_html_text_beautifulsoup(content: bytes, encoding: str) -> str:
+    soup = BeautifulSoup(content.decode(encoding, errors="replace"), "html.parser")
+
+    for script in soup(list(SKIPPED_TAGS)):
+        script.decompose()
+
+    return " ".join(re.split(r"[\n\t]+", soup.get_text()))
+
+
+HTML_EXTRACTORS: dict[str, Callable[[bytes, str], str]] = {
+    "stream": extract_html_text_streaming,
+    "lxml": extract_html_text_lxml,
+    "beautifulsoup": extract_html_text_beautifulsoup,
+}
+
+
+@cache
+def html_extractor(name: str) -> Callable[[bytes, str], str]:
+    """
+    The extractor named by a setting: "stream", "lxml" or "beautifulsoup".
+    lxml is optional and the streaming extractor is used when it is missing.
+    """
+    if name == "lxml" and etree is None:
+        logging.warning("lxml is not installed, using the stream HTML extractor")
+        return extract_html_text_streaming
+    if name not in HTML_EXTRACTORS:
+        raise ValueError(f"Unknown HTML extractor {name}")
+    return HTML_EXTRACTORS[name]
+
+
+def extract_text(link: str, page: edu_model.WebPage) -> str:
+    if link.endswith(".pdf") or page.content_type.startswith("application/pdf"):
+        return extract_pdf_text(
+            page.content,
+            settings.pdf_max_pages,
+            settings.pdf_max_chars,
+            settings.pdf_sample_pages,
+        )
+    return html_extractor(settings.html_extractor)(page.content, page.encoding)
@@ -0,0 +1,97 @@
+import redis.asyncio
+from rudeadvisor import model as edu_model
+from rudeadvisor.config import settings
+
+
+# The events of a conversation are appended to a Redis stream of their own,
+# capped at history_max_events, instead of growing the conversation state. The
+# stream entry ids are increasing and double as the SSE event ids.
+EVENT_FIELD = "event"
+
+
+def history_key(conversation_id: str) -> str:
+    return f"history:{conversation_id}"
+
+
+def event_id_order(event_id: str) -> tuple[int, int]:
+    """
+    Stream entry ids are "<milliseconds>-<sequence>" and are compared as
+    numbers. Raises ValueError for anything else, such as a forged
+    Last-Event-ID.
+    """
+    milliseconds, sequence = event_id.split("-")
+    return int(milliseconds), int(sequence)
+
+
+async def append_event(
+    redis_client: redis.asyncio.Redis,
+    event: edu_model.ConversationEvent,
+    event_json: str,
+) -> str:
+    key = history_key(event.conversation_id)
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.xadd(
+        key,
+        {EVENT_FIELD: event_json},
+        maxlen=settings.history_max_events,
+        approximate=False,
+    )
+    pipeline.expire(key, settings.conversation_max_age_seconds)
+    entry_id, _ = await pipeline.execute()
+    return entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+
+
+def parse_entry(entry_id: bytes | str, fields: dict) -> edu_model.ConversationEvent:
+    event_json = fields.get(EVENT_FIELD) or fields.get(EVENT_FIELD.encode())
+    return edu_model.ConversationEvent.model_validate_json(event_json).immutable_update(
+        event_id=entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+    )
+
+
+async def read_events_after(
+    redis_client: redis.asyncio.Redis, conversation_id: str, last_event_id: str
+) -> list[edu_model.ConversationEvent]:
+    """
+    The events a client that saw last_event_id has missed, oldest first.
+    """
+    entries = await redis_client.xrange(
+        history_key(conversation_id), min=f"({last_event_id}", max="+"
+    )
+    return [parse_entry(entry_id, fields) for entry_id, fields in entries]
+
+
+async def read_history(
+    redis_client: redis.asyncio.Redis,
+    conversation_id: str,
+    before: str | None,
+    limit: int,
+) -> edu_model.MessageHistory:
+    """
+    One page of the messages of a conversation, newest first, without the
+    answer fragments. The next page starts before the oldest message of this
+    one.
+    """
+    messages: list[edu_model.HistoryEntry] = []
+    has_more = False
+    upper = f"({before}" if before else "+"
+    while not has_more:
+        entries = await redis_client.xrevrange(
+            history_key(conversation_id), max=upper, min="-", count=limit + 1
+        )
+        for entry_id, fields in entries:
+            event = parse_entry(entry_id, fields)
+            if event.message.message_type == edu_model.MessageType.ANSWER_FRAGMENT:
+                continue
+            if len(messages) == limit:
+                has_more = True
+                break
+            messages.append(
+                edu_model.HistoryEntry(entry_id=event.event_id, message=event.message)
+            )
+        if len(entries) <= limit:
+            break
+        upper = f"({event.event_id}"
+    return edu_model.MessageHistory(
+        entries=messages,
+        next_before=messages[-1].entry_id if has_more else None,
+    )
@@ -0,0 +1,118 @@
+from pathlib import Path
+from threading import Lock
+from rudeadvisor import context
+from rudeadvisor import model as edu_model
+from rudeadvisor.config import settings
+import logging
+import sqlite3
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    link TEXT PRIMARY KEY,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_indexed_at ON documents (indexed_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5(
+    link UNINDEXED,
+    passage_index UNINDEXED,
+    text
+);
+"""
+
+connection: sqlite3.Connection | None = None
+connection_lock = Lock()
+
+
+def get_connection() -> sqlite3.Connection:
+    global connection
+    if connection is None:
+        Path(settings.index_path).parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(settings.index_path, check_same_thread=False)
+        connection.executescript(SCHEMA)
+    return connection
+
+
+def add_web_data(web_data_collection: edu_model.WebDataCollection):
+    """
+    Index the passages of scraped pages. A page that is indexed again replaces
+    its old passages, and pages older than index_max_age_seconds are dropped.
+    """
+    with connection_lock:
+        database = get_connection()
+        with database:
+            for web_data in web_data_collection.web_data_collection:
+                database.execute(
+                    "DELETE FROM passages WHERE link = ?", (web_data.link,)
+                )
+                database.executemany(
+                    "INSERT INTO passages (link, passage_index, text) VALUES (?, ?, ?)",
+                    [
+                        (passage.link, passage.index, passage.text)
+                        for passage in context.split_passages(
+                            web_data, settings.context_passage_words
+                        )
+                    ],
+                )
+                database.execute(
+                    "INSERT OR REPLACE INTO documents (link, indexed_at) VALUES (?, ?)",
+                    (web_data.link, time.time()),
+                )
+            expire(database, settings.index_max_age_seconds)
+    logging.debug(
+        f"Indexed {len(web_data_collection.web_data_collection)} pages in the local index"
+    )
+
+
+def expire(database: sqlite3.Connection, max_age_seconds: float):
+    cutoff = time.time() - max_age_seconds
+    database.execute(
+        "DELETE FROM passages WHERE link IN (SELECT link FROM documents WHERE indexed_at < ?)",
+        (cutoff,),
+    )
+    database.execute("DELETE FROM documents WHERE indexed_at < ?", (cutoff,))
+
+
+def term_coverage(passage_text: str, terms: set[str]) -> float:
+    if not terms:
+        return 0.0
+    return len(terms & set(context.tokenize(passage_text))) / len(terms)
+
+
+def search(questions: edu_model.Questions, limit: int) -> list[edu_model.Passage]:
+    """
+    Find the indexed passages that cover enough of the question terms, best
+    BM25 match first. Only pages indexed within index_max_age_seconds are used.
+    """
+    terms = set(
+        context.tokenize(" ".join(q.question_text for q in questions.questions))
+    )
+    if not terms:
+        return []
+
+    with connection_lock:
+        rows = (
+            get_connection()
+            .execute(
+                """
+                SELECT passages.link, passages.passage_index, passages.text, bm25(passages)
+                FROM passages JOIN documents ON documents.link = passages.link
+                WHERE passages MATCH ? AND documents.indexed_at >= ?
+                ORDER BY bm25(passages)
+                LIMIT ?
+                """,
+                (
+                    " OR ".join(f'"{term}"' for term in sorted(terms)),
+                    time.time() - settings.index_max_age_seconds,
+                    limit,
+                ),
+            )
+            .fetchall()
+        )
+
+    return [
+        edu_model.Passage(link=link, index=index, text=text, score=-rank)
+        for link, index, text, rank in rows
+        if term_coverage(text, terms) >= settings.index_min_term_coverage
+    ]
@@ -0,0 +1,165 @@
+import logging
+import redis
+import redis.asyncio
+from rudeadvisor import checkpoint
+from rudeadvisor import codec
+from rudeadvisor import model as edu_model
+from rudeadvisor.config import settings
+
+
+JOB_FIELD = "job"
+DEAD_LETTER_SUFFIX = ":dead"
+
+
+def job_fields(job: edu_model.Job) -> dict[str, bytes]:
+    return {JOB_FIELD: codec.encode(job)}
+
+
+def parse_job(fields: dict) -> edu_model.Job:
+    job_data = fields.get(JOB_FIELD) or fields.get(JOB_FIELD.encode())
+    return codec.decode(job_data, edu_model.Job)
+
+
+def ensure_consumer_group(redis_client: redis.Redis):
+    try:
+        redis_client.xgroup_create(
+            settings.job_stream, settings.job_group, id="0", mkstream=True
+        )
+        logging.info(f"Created consumer group {settings.job_group}")
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def enqueue_job(redis_client: redis.Redis, job: edu_model.Job) -> str:
+    entry_id = redis_client.xadd(settings.job_stream, job_fields(job))
+    logging.debug(f"Enqueued job {job.job_id} as stream entry {entry_id}")
+    return entry_id
+
+
+async def enqueue_job_async(
+    redis_client: redis.asyncio.Redis, job: edu_model.Job
+) -> str:
+    entry_id = await redis_client.xadd(settings.job_stream, job_fields(job))
+    logging.debug(f"Enqueued job {job.job_id} as stream entry {entry_id}")
+    return entry_id
+
+
+def read_new_jobs(
+    redis_client: redis.Redis, consumer_name: str, count: int
+) -> list[tuple[str, dict]]:
+    response = redis_client.xreadgroup(
+        settings.job_group,
+        consumer_name,
+        {settings.job_stream: ">"},
+        count=count,
+        block=settings.job_block_ms,
+    )
+    return [entry for _, entries in response or [] for entry in entries]
+
+
+def claim_stale_jobs(
+    redis_client: redis.Redis, consumer_name: str, count: int
+) -> list[tuple[str, dict]]:
+    """
+    Take over jobs that another consumer received but has not acknowledged for
+    job_claim_idle_ms, which means it crashed or was stopped. Jobs that have
+    already been delivered job_max_deliveries times are moved to the dead letter
+    stream instead of being retried again.
+    """
+    pending = redis_client.xpending_range(
+        settings.job_stream,
+        settings.job_group,
+        min="-",
+        max="+",
+        count=count,
+        idle=settings.job_claim_idle_ms,
+    )
+    if not pending:
+        return []
+
+    exhausted = [
+        entry["message_id"]
+        for entry in pending
+        if entry["times_delivered"] >= settings.job_max_deliveries
+    ]
+    retryable = [
+        entry["message_id"]
+        for entry in pending
+        if entry["times_delivered"] < settings.job_max_deliveries
+    ]
+
+    for entry_id in exhausted:
+        dead_letter_job(redis_client, entry_id)
+
+    if not retryable:
+        return []
+    claimed = redis_client.xclaim(
+        settings.job_stream,
+        settings.job_group,
+        consumer_name,
+        settings.job_claim_idle_ms,
+        retryable,
+    )
+    logging.info(f"Claimed {len(claimed)} stale jobs for {consumer_name}")
+    # Entries deleted from the stream while pending are returned without fields
+    return [(entry_id, fields) for entry_id, fields in claimed if fields]
+
+
+def keep_jobs_alive(redis_client: redis.Redis, consumer_name: str, entry_ids: list):
+    """
+    Reset the idle time of jobs that are still running, so that a long pipeline
+    is not mistaken for a crashed one and claimed by another consumer.
+    """
+    if entry_ids:
+        redis_client.xclaim(
+            settings.job_stream,
+            settings.job_group,
+            consumer_name,
+            0,
+            entry_ids,
+            justid=True,
+        )
+
+
+def ack_job(redis_client: redis.Redis, entry_id):
+    pipeline = redis_client.pipeline()
+    pipeline.xack(settings.job_stream, settings.job_group, entry_id)
+    pipeline.xdel(settings.job_stream, entry_id)
+    pipeline.execute()
+
+
+def is_queued(redis_client: redis.Redis, entry_id: str) -> bool:
+    """
+    Whether a job is still on the stream, waiting for a consumer or pending.
+    Jobs are deleted from the stream when they are acknowledged.
+    """
+    return bool(redis_client.xrange(settings.job_stream, entry_id, entry_id, count=1))
+
+
+def dead_letter_job(redis_client: redis.Redis, entry_id):
+    """
+    Move a job to the dead letter stream. Its checkpoint is cleared as well, so
+    that the recovery scan does not requeue the pipeline that kept failing. The
+    copy and the acknowledgement are one transaction, and a job that cannot be
+    read still leaves the stream.
+    """
+    entries = redis_client.xrange(settings.job_stream, entry_id, entry_id)
+    logging.error(f"Job {entry_id} failed too many times, moving it to dead letters")
+    pipeline = redis_client.pipeline()
+    for _, fields in entries:
+        pipeline.xadd(settings.job_stream + DEAD_LETTER_SUFFIX, fields)
+    pipeline.xack(settings.job_stream, settings.job_group, entry_id)
+    pipeline.xdel(settings.job_stream, entry_id)
+    pipeline.execute()
+
+    for _, fields in entries:
+        try:
+            job = parse_job(fields)
+            saved = checkpoint.load_checkpoint(redis_client, job.state.conversation_id)
+            if saved and saved.job_id == job.job_id:
+                checkpoint.clear_checkpoint(redis_client, job.state.conversation_id)
+        except Exception as e:
+            logging.error(
+                f"Failed to clear the checkpoint of dead letter {entry_id}: {e}"
+            )
@@ -0,0 +1,202 @@
+from typing import AsyncIterator, Protocol, TypeVar
+from pydantic import BaseModel, ValidationError
+from rudeadvisor import metrics
+from rudeadvisor.config import settings
+import asyncio
+import httpx
+import json
+import logging
+import ollama
+import openai
+
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class LLMBackend(Protocol):
+    async def complete_structured(
+        self,
+        model: str,
+        messages: list[dict],
+        response_format: type[T],
+        max_tokens: int | None,
+    ) -> T | None: ...
+
+    def complete_stream(
+        self, model: str, messages: list[dict], max_tokens: int | None
+    ) -> AsyncIterator[str]: ...
+
+    async def close(self): ...
+
+
+class OpenAIBackend:
+    """
+    OpenAI chat completions. Structured output uses the response_format support
+    of the API, which parses the answer into the pydantic model.
+    """
+
+    def __init__(self, concurrency: int):
+        self._client = openai.AsyncOpenAI()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def complete_structured(
+        self,
+        model: str,
+        messages: list[dict],
+        response_format: type[T],
+        max_tokens: int | None,
+    ) -> T | None:
+        async with self._semaphore:
+            completions = await self._client.beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens if max_tokens is not None else openai.NOT_GIVEN,
+                response_format=response_format,
+            )
+        if completions.usage:
+            record_tokens(
+                "openai",
+                model,
+                completions.usage.prompt_tokens,
+                completions.usage.completion_tokens,
+            )
+        if len(completions.choices) == 0:
+            return None
+        return completions.choices[0].message.parsed
+
+    async def complete_stream(
+        self, model: str, messages: list[dict], max_tokens: int | None
+    ) -> AsyncIterator[str]:
+        async with self._semaphore:
+            stream = await self._client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens if max_tokens is not None else openai.NOT_GIVEN,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if chunk.usage:
+                    record_tokens(
+                        "openai",
+                        model,
+                        chunk.usage.prompt_tokens,
+                        chunk.usage.completion_tokens,
+                    )
+
+    async def close(self):
+        await self._client.close()
+
+
+class OllamaBackend:
+    """
+    A local model served by Ollama. Ollama can only be asked for JSON, not for a
+    schema, so the schema is added to the prompt and the answer is validated
+    against the pydantic model. An answer that does not validate counts as no
+    answer.
+    """
+
+    def __init__(self, host: str, concurrency: int):
+        # The ollama client cannot be closed, its connections are closed through
+        # the transport it is given
+        self._transport = httpx.AsyncHTTPTransport()
+        self._client = ollama.AsyncClient(host=host, transport=self._transport)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def complete_structured(
+        self,
+        model: str,
+        messages: list[dict],
+        response_format: type[T],
+        max_tokens: int | None,
+    ) -> T | None:
+        async with self._semaphore:
+            response = await self._client.chat(
+                model=model,
+                messages=messages + [schema_instructions(response_format)],
+                format="json",
+                options=ollama_options(max_tokens),
+            )
+        record_tokens(
+            "ollama",
+            model,
+            response.get("prompt_eval_count", 0),
+            response.get("eval_count", 0),
+        )
+        try:
+            return response_format.model_validate_json(response["message"]["content"])
+        except ValidationError as e:
+            logging.warning(
+                f"{model} answered with invalid {response_format.__name__}: {e}"
+            )
+            return None
+
+    async def complete_stream(
+        self, model: str, messages: list[dict], max_tokens: int | None
+    ) -> AsyncIterator[str]:
+        async with self._semaphore:
+            stream = await self._client.chat(
+                model=model,
+                messages=messages,
+                stream=True,
+                options=ollama_options(max_tokens),
+            )
+            async for part in stream:
+                if part["message"]["content"]:
+                    yield part["message"]["content"]
+                if part.get("done"):
+                    record_tokens(
+                        "ollama",
+                        model,
+                        part.get("prompt_eval_count", 0),
+                        part.get("eval_count", 0),
+                    )
+
+    async def close(self):
+        await self._transport.aclose()
+
+
+def record_tokens(
+    provider: str, model: str, prompt_tokens: int, completion_tokens: int
+):
+    metrics.observe(
+        "rudeadvisor_llm_tokens",
+        prompt_tokens,
+        provider=provider,
+        model=model,
+        kind="prompt",
+    )
+    metrics.observe(
+        "rudeadvisor_llm_tokens",
+        completion_tokens,
+        provider=provider,
+        model=model,
+        kind="completion",
+    )
+
+
+def schema_instructions(response_format: type[BaseModel]) -> dict:
+    return {
+        "role": "system",
+        "content": "Answer with a single JSON object that matches this JSON schema: "
+        + json.dumps(response_format.model_json_schema()),
+    }
+
+
+def ollama_options(max_tokens: int | None) -> dict:
+    return {"num_predict": max_tokens} if max_tokens is not None else {}
+
+
+def create_backend(provider: str) -> LLMBackend:
+    """
+    Create the backend named by a setting: "openai" or "ollama".
+    """
+    match provider:
+        case "openai":
+            return OpenAIBackend(settings.llm_concurrency)
+        case "ollama":
+            return OllamaBackend(settings.ollama_host, settings.ollama_concurrency)
+        case _:
+            raise ValueError(f"Unknown LLM provider {provider}")
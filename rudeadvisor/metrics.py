@@ -0,0 +1,246 @@
+from functools import wraps
+from threading import Lock
+from typing import Awaitable, Callable, Literal, ParamSpec, TypeVar
+from pydantic import BaseModel, ConfigDict
+import logging
+import time
+import redis
+
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+TOKEN_BUCKETS = (100, 250, 500, 1_000, 2_000, 4_000, 8_000, 16_000)
+
+
+class Metric(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    name: str
+    kind: Literal["counter", "histogram"]
+    help: str
+    buckets: tuple[float, ...] = ()
+
+
+METRICS = {
+    metric.name: metric
+    for metric in [
+        Metric(
+            name="rudeadvisor_step_duration_seconds",
+            kind="histogram",
+            help="Duration of a pipeline step by StateAction",
+            buckets=DURATION_BUCKETS,
+        ),
+        Metric(
+            name="rudeadvisor_step_retries_total",
+            kind="counter",
+            help="Pipeline transitions that repeated an earlier transition",
+        ),
+        Metric(
+            name="rudeadvisor_tool_duration_seconds",
+            kind="histogram",
+            help="Duration of a call to a tool",
+            buckets=DURATION_BUCKETS,
+        ),
+        Metric(
+            name="rudeadvisor_llm_calls_total",
+            kind="counter",
+            help="LLM completions by tool, provider and model",
+        ),
+        Metric(
+            name="rudeadvisor_llm_tokens",
+            kind="histogram",
+            help="Tokens used by one LLM completion, by kind (prompt or completion)",
+            buckets=TOKEN_BUCKETS,
+        ),
+        Metric(
+            name="rudeadvisor_scrape_fetched_bytes",
+            kind="histogram",
+            help="Bytes downloaded for one scraped page",
+            buckets=BYTES_BUCKETS,
+        ),
+        Metric(
+            name="rudeadvisor_scrape_text_bytes",
+            kind="histogram",
+            help="Bytes of text extracted from one scraped page",
+            buckets=BYTES_BUCKETS,
+        ),
+        Metric(
+            name="rudeadvisor_scrapes_total",
+            kind="counter",
+            help="Scraped links by outcome",
+        ),
+        Metric(
+            name="rudeadvisor_searches_total",
+            kind="counter",
+            help="Web searches by outcome",
+        ),
+        Metric(
+            name="rudeadvisor_cache_requests_total",
+            kind="counter",
+            help="Cache lookups by cache and result",
+        ),
+        Metric(
+            name="rudeadvisor_cache_bytes_saved_total",
+            kind="counter",
+            help="Bytes that cache hits did not have to download or generate, by cache",
+        ),
+        Metric(
+            name="rudeadvisor_cache_revalidations_total",
+            kind="counter",
+            help="Cache hits that the origin confirmed were still fresh, by cache",
+        ),
+        Metric(
+            name="rudeadvisor_cache_evictions_total",
+            kind="counter",
+            help="Cache entries removed to stay within the size limit, by cache",
+        ),
+        Metric(
+            name="rudeadvisor_published_message_bytes",
+            kind="histogram",
+            help="Size of a message published to a conversation",
+            buckets=BYTES_BUCKETS,
+        ),
+    ]
+}
+
+# Observations are collected per process and added to the totals in Redis by
+# flush, so that /metrics shows the sum over every worker
+pending: dict[tuple[str, str], float] = {}
+pending_lock = Lock()
+
+
+def metric_key(name: str) -> str:
+    return f"metrics:{name}"
+
+
+def label_string(labels: dict[str, str]) -> str:
+    return ",".join(
+        f'{name}="{escape_label(str(value))}"' for name, value in sorted(labels.items())
+    )
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def add_pending(name: str, field: str, amount: float):
+    with pending_lock:
+        pending[(name, field)] = pending.get((name, field), 0) + amount
+
+
+def increment(name: str, amount: float = 1, **labels: str):
+    add_pending(name, label_string(labels), amount)
+
+
+def observe(name: str, value: float, **labels: str):
+    """
+    Add an observation to a histogram. Buckets are stored cumulatively, the
+    way Prometheus exposes them.
+    """
+    labels_text = label_string(labels)
+    for bucket in METRICS[name].buckets:
+        if value <= bucket:
+            add_pending(name, f"bucket|{bucket}|{labels_text}", 1)
+    add_pending(name, f"bucket|+Inf|{labels_text}", 1)
+    add_pending(name, f"sum|{labels_text}", value)
+    add_pending(name, f"count|{labels_text}", 1)
+
+
+def timed_tool(
+    function: Callable[P, Awaitable[R]],
+) -> Callable[P, Awaitable[R]]:
+    """
+    Record the duration of every call to an async tool, labelled with its name.
+    """
+
+    @wraps(function)
+    async def timed(*args: P.args, **kwargs: P.kwargs) -> R:
+        started = time.perf_counter()
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            observe(
+                "rudeadvisor_tool_duration_seconds",
+                time.perf_counter() - started,
+                tool=function.__name__,
+            )
+
+    return timed
+
+
+def flush(redis_client: redis.Redis) -> int:
+    """
+    Add the observations of this process to the totals in Redis.
+    """
+    with pending_lock:
+        flushed = dict(pending)
+        pending.clear()
+    if not flushed:
+        return 0
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for (name, field), amount in flushed.items():
+        pipeline.hincrbyfloat(metric_key(name), field, amount)
+    try:
+        pipeline.execute()
+    except Exception as e:
+        logging.error(f"Failed to flush metrics: {e}")
+        with pending_lock:
+            for key, amount in flushed.items():
+                pending[key] = pending.get(key, 0) + amount
+        return 0
+    return len(flushed)
+
+
+def format_sample(name: str, labels_text: str, value: float) -> str:
+    value_text = str(int(value)) if value.is_integer() else repr(value)
+    return (
+        f"{name}{{{labels_text}}} {value_text}"
+        if labels_text
+        else f"{name} {value_text}"
+    )
+
+
+def render(totals: dict[str, dict[str, str]]) -> str:
+    """
+    Format the totals read from Redis, one hash per metric, in the Prometheus
+    text format.
+    """
+    lines = []
+    for name, metric in METRICS.items():
+        fields = totals.get(name) or {}
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        if metric.kind == "counter":
+            for labels_text, value in sorted(fields.items()):
+                lines.append(format_sample(name, labels_text, float(value)))
+            continue
+
+        series: dict[str, dict[str, float]] = {}
+        for field, value in fields.items():
+            part, rest = field.split("|", 1)
+            if part == "bucket":
+                bucket, labels_text = rest.split("|", 1)
+                series.setdefault(labels_text, {})[bucket] = float(value)
+            else:
+                series.setdefault(rest, {})[part] = float(value)
+        for labels_text, values in sorted(series.items()):
+            for bucket in [*(f"{bucket}" for bucket in metric.buckets), "+Inf"]:
+                bucket_labels = ",".join(
+                    label for label in [labels_text, f'le="{bucket}"'] if label
+                )
+                lines.append(
+                    format_sample(
+                        f"{name}_bucket", bucket_labels, values.get(bucket, 0)
+                    )
+                )
+            lines.append(
+                format_sample(f"{name}_sum", labels_text, values.get("sum", 0))
+            )
+            lines.append(
+                format_sample(f"{name}_count", labels_text, values.get("count", 0))
+            )
+    return "\n".join(lines) + "\n"
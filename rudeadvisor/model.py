@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import List, Optional, Self
 from datetime import datetime
 from uuid import uuid4
 from enum import Enum
@@ -20,11 +20,30 @@ class StateAction(str, Enum):
 class MessageType(str, Enum):
     PROCESS = "process"
     REFINED_QUESTION = "refined queston"
+    ANSWER_FRAGMENT = "answer fragment"
+
+
+class LLMTool(str, Enum):
+    SCORE = "score"
+    CHALLENGE = "challenge"
+    QUERY = "query"
+    SOURCES = "sources"
+    ANSWER = "answer"
 
 
 class EduModel(BaseModel):
     model_config = ConfigDict(frozen=True)
 
+    def immutable_update(self, **changes) -> Self:
+        """
+        Return a copy with the given fields replaced. Every model is frozen, so
+        the fields that are not changed are shared with the original instead of
+        being deep-copied; the copy costs the same however large they are.
+        Lists held by the models are never mutated in place, which is what
+        makes the sharing safe.
+        """
+        return self.model_copy(update=changes)
+
 
 class Message(EduModel):
     message_type: MessageType
@@ -54,7 +73,7 @@ class Questions(EduModel):
     def immutable_copy_questions_score(
         self, questions_score: QuestionsScore | None
     ) -> "Questions":
-        return self.model_copy(update={"questions_score": questions_score}, deep=True)
+        return self.immutable_update(questions_score=questions_score)
 
 
 class RefinedQuestions(EduModel):
@@ -86,9 +105,30 @@ class WebSearchError(EduModel):
     message: str
 
 
+class WebPage(EduModel):
+    link: str
+    status_code: int
+    content: bytes
+    content_type: str
+    encoding: str
+    etag: str | None = None
+    last_modified: str | None = None
+
+
 class WebData(EduModel):
     link: str
     data: str
+    # Set when the text is kept in the blob store, see blobs.resolve_web_data
+    blob_key: str | None = None
+
+
+class CachedWebData(EduModel):
+    link: str
+    data: str
+    etag: str | None = None
+    last_modified: str | None = None
+    downloaded_bytes: int
+    stored_at: datetime = Field(default_factory=lambda: datetime.now())
 
 
 class WebDataCollection(EduModel):
@@ -96,6 +136,19 @@ class WebDataCollection(EduModel):
     web_data_retrival_errors: list[str]
 
 
+class Passage(EduModel):
+    link: str
+    index: int
+    text: str
+    score: float = 0.0
+
+
+class ContextSelection(EduModel):
+    passages: list[Passage]
+    token_estimate: int
+    candidate_count: int
+
+
 class Prompt(EduModel):
     prompt_text: str
 
@@ -111,66 +164,151 @@ class ConversationState(EduModel):
     query: Optional[Query] = None
     web_search_results: Optional[WebSearchResults] = None
     web_data_collection: Optional[WebDataCollection] = None
+    context: Optional[ContextSelection] = None
     sources: Optional[Sources] = None
     prompt: Optional[Prompt] = None
     answer: Optional[Answer] = None
-    messages: List[Message] = Field(default_factory=list)
     last_updated: datetime = Field(default_factory=lambda: datetime.now())
     last_action: StateAction
 
     def immutable_copy_conversation_id(
         self, conversation_id: str
     ) -> "ConversationState":
-        return self.model_copy(update={"conversation_id": conversation_id}, deep=True)
+        return self.immutable_update(conversation_id=conversation_id)
 
     def immutable_copy_questions(self, questions: Questions) -> "ConversationState":
-        return self.model_copy(update={"questions": questions}, deep=True)
+        return self.immutable_update(questions=questions)
 
     def immutable_copy_refined_questions(
         self, refined_questions: RefinedQuestions | None
     ) -> "ConversationState":
-        return self.model_copy(
-            update={"refined_questions": refined_questions}, deep=True
-        )
+        return self.immutable_update(refined_questions=refined_questions)
 
     def immutable_copy_query(self, query: Query | None) -> "ConversationState":
-        return self.model_copy(update={"query": query}, deep=True)
+        return self.immutable_update(query=query)
 
     def immutable_copy_web_search_results(
         self, web_search_results: WebSearchResults
     ) -> "ConversationState":
-        return self.model_copy(
-            update={"web_search_results": web_search_results}, deep=True
-        )
+        return self.immutable_update(web_search_results=web_search_results)
 
     def immutable_copy_web_data_collection(
         self, web_data_collection: WebDataCollection
     ) -> "ConversationState":
-        return self.model_copy(
-            update={"web_data_collection": web_data_collection}, deep=True
-        )
+        return self.immutable_update(web_data_collection=web_data_collection)
+
+    def immutable_copy_context(
+        self, context: ContextSelection | None
+    ) -> "ConversationState":
+        return self.immutable_update(context=context)
 
     def immutable_copy_sources(self, sources: Sources | None) -> "ConversationState":
-        return self.model_copy(update={"sources": sources}, deep=True)
+        return self.immutable_update(sources=sources)
 
     def immutable_copy_prompt(self, prompt: Prompt) -> "ConversationState":
-        return self.model_copy(update={"prompt": prompt}, deep=True)
+        return self.immutable_update(prompt=prompt)
 
     def immutable_copy_answer(self, answer: Answer | None) -> "ConversationState":
-        return self.model_copy(update={"answer": answer}, deep=True)
-
-    def immutable_copy_messages(self, messages: List[Message]) -> "ConversationState":
-        return self.model_copy(update={"messages": messages}, deep=True)
+        return self.immutable_update(answer=answer)
 
     def immutable_copy_last_updated(
         self, last_updated: datetime
     ) -> "ConversationState":
-        return self.model_copy(update={"last_updated": last_updated}, deep=True)
+        return self.immutable_update(last_updated=last_updated)
 
     def immutable_copy_last_action(
         self, last_action: StateAction
     ) -> "ConversationState":
-        return self.model_copy(update={"last_action": last_action}, deep=True)
+        return self.immutable_update(last_action=last_action)
+
+
+class ConversationSummary(EduModel):
+    state_action: StateAction
+    question_count: int = 0
+    source_count: int = 0
+    has_answer: bool = False
+
+
+class ConversationStats(EduModel):
+    """
+    Conversations in the store: the live ones and the totals of those created,
+    expired, deleted and refused for their size since the store was started.
+    """
+
+    live_count: int
+    live_bytes: int
+    created_count: int
+    expired_count: int
+    expired_bytes: int
+    deleted_count: int
+    rejected_count: int
+
+
+class ConversationEvent(EduModel):
+    """
+    What is published to the conversation channel: the new message and a slim
+    summary of the state, never the full state with scraped data.
+    """
+
+    conversation_id: str
+    message: Message
+    summary: ConversationSummary | None = None
+    # The id of the event in the history of the conversation, set when it is published
+    event_id: str | None = None
+
+
+class HistoryEntry(EduModel):
+    entry_id: str
+    message: Message
+
+
+class MessageHistory(EduModel):
+    """
+    A page of the message history of a conversation, newest first.
+    `next_before` is passed as `before` to get the next page, and is None on
+    the last page.
+    """
+
+    entries: list[HistoryEntry]
+    next_before: str | None = None
+
+
+class PipelineLimits(EduModel):
+    max_steps: int
+    max_action_retries: int
+
+
+class StepRecord(EduModel):
+    step: int
+    previous_action: StateAction | None
+    action: StateAction
+    next_action: StateAction | None
+    duration_seconds: float
+
+
+class Job(EduModel):
+    job_id: str = Field(default_factory=lambda: str(uuid4()))
+    state: ConversationState
+    previous_action: StateAction | None
+    action: StateAction
+    enqueued_at: datetime = Field(default_factory=lambda: datetime.now())
+
+
+class Checkpoint(EduModel):
+    """
+    A pipeline between two steps: `previous_action` is the last completed step
+    and `next_action` the step to resume from.
+    """
+
+    conversation_id: str
+    job_id: str
+    # The job stream entry running the pipeline
+    entry_id: str | None = None
+    state: ConversationState
+    previous_action: StateAction | None
+    next_action: StateAction
+    steps_taken: int = 0
+    updated_at: datetime = Field(default_factory=lambda: datetime.now())
 
 
 class QuestionsRequest(BaseModel):
@@ -185,3 +323,14 @@ def create_initial_state(conversation_id: str) -> ConversationState:
         conversation_id=conversation_id, last_action=StateAction.BUILD_QUESTION
     )
     return state
+
+
+def create_conversation_summary(
+    state: ConversationState, state_action: StateAction
+) -> ConversationSummary:
+    return ConversationSummary(
+        state_action=state_action,
+        question_count=len(state.questions.questions) if state.questions else 0,
+        source_count=len(state.sources.links) if state.sources else 0,
+        has_answer=state.answer is not None,
+    )
@@ -1,5 +1,8 @@
+import os
+import socket
 import uvicorn
 import typer
+from rudeadvisor.config import settings
 
 app = typer.Typer()
 
@@ -12,5 +15,47 @@ def start_server():
     uvicorn.run("rudeadvisor.api:app", host="127.0.0.1", port=8000, reload=True)
 
 
+@app.command()
+def start_worker(
+    concurrency: int = typer.Option(
+        settings.worker_concurrency, help="Pipelines to run at the same time"
+    ),
+    consumer_name: str = typer.Option(
+        f"{socket.gethostname()}-{os.getpid()}",
+        help="Unique name of this worker in the consumer group",
+    ),
+):
+    """
+    Start a worker that runs pipelines from the Redis job stream.
+    """
+    from rudeadvisor import worker
+
+    worker.consume_jobs(consumer_name, concurrency)
+
+
+@app.command()
+def recover():
+    """
+    Requeue conversations whose pipeline stalled, to resume them from their last checkpoint.
+    """
+    from rudeadvisor import worker
+
+    requeued = worker.requeue_stalled_conversations()
+    typer.echo(f"Requeued {requeued} stalled conversations")
+
+
+@app.command()
+def conversation_stats():
+    """
+    Show the number and size of the live conversations in Redis, and of those that expired.
+    """
+    from rudeadvisor import conversations
+    from rudeadvisor import worker
+
+    stats = conversations.conversation_stats(worker.redis_client)
+    for name, value in stats.model_dump().items():
+        typer.echo(f"{name}: {value}")
+
+
 if __name__ == "__main__":
     app()
@@ -1,26 +1,274 @@
 from duckduckgo_search import DDGS
-from pydantic import ValidationError
-from bs4 import BeautifulSoup
-from io import BytesIO
+from pydantic import BaseModel, ValidationError
+from datetime import datetime
+from hashlib import sha256
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 from rudeadvisor import model as edu_model
-import pypdf
-import openai
+from rudeadvisor import cache
+from rudeadvisor import extract
+from rudeadvisor import llm
+from rudeadvisor import metrics
+from rudeadvisor.config import settings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+from weakref import WeakKeyDictionary
+import asyncio
+import multiprocessing
+import json
 import re
 import logging
-import requests
+import httpx
 
 
-openai_client = openai.OpenAI()
+T = TypeVar("T", bound=BaseModel)
 
 
-def answer_questions(
+class Upstreams:
+    """
+    Clients for the LLM providers and the scraped sites, with a semaphore
+    bounding the calls to each upstream. Asyncio clients and semaphores belong to
+    the event loop they are used in, so every event loop gets its own set.
+    """
+
+    def __init__(self):
+        self.http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                settings.scrape_read_timeout, connect=settings.scrape_connect_timeout
+            ),
+            limits=httpx.Limits(max_connections=settings.scrape_concurrency * 2),
+            follow_redirects=True,
+        )
+        self.search_semaphore = asyncio.Semaphore(settings.search_concurrency)
+        self.scrape_semaphore = asyncio.Semaphore(settings.scrape_concurrency)
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self._host_users: dict[str, int] = {}
+        self._llm_backends: dict[str, llm.LLMBackend] = {}
+
+    def llm_backend(self, provider: str) -> llm.LLMBackend:
+        if provider not in self._llm_backends:
+            self._llm_backends[provider] = llm.create_backend(provider)
+        return self._llm_backends[provider]
+
+    @asynccontextmanager
+    async def host_slot(self, link: str) -> AsyncIterator[None]:
+        """
+        Hold one of the scrape_per_host_concurrency slots of the host of a link.
+        The semaphore of a host is dropped once no scrape uses it, so that the
+        hosts scraped over the life of the worker do not pile up.
+        """
+        host = urlsplit(link).netloc
+        semaphore = self._host_semaphores.setdefault(
+            host, asyncio.Semaphore(settings.scrape_per_host_concurrency)
+        )
+        self._host_users[host] = self._host_users.get(host, 0) + 1
+        try:
+            async with semaphore:
+                yield
+        finally:
+            self._host_users[host] -= 1
+            if not self._host_users[host]:
+                del self._host_users[host]
+                del self._host_semaphores[host]
+
+    def host_count(self) -> int:
+        return len(self._host_semaphores)
+
+    async def close(self):
+        await self.http_client.aclose()
+        for backend in self._llm_backends.values():
+            await backend.close()
+
+
+upstreams_by_loop: WeakKeyDictionary[asyncio.AbstractEventLoop, Upstreams] = (
+    WeakKeyDictionary()
+)
+
+llm_cache_stats = cache.CacheStats("llm")
+llm_cache = cache.create_backend(
+    settings.llm_cache_backend, "llm", settings.llm_cache_max_bytes, llm_cache_stats
+)
+
+search_cache_stats = cache.CacheStats("search")
+search_cache = cache.create_backend(
+    settings.search_cache_backend,
+    "search",
+    settings.search_cache_max_bytes,
+    search_cache_stats,
+)
+search_flight = cache.SingleFlight(
+    "search",
+    cache.redis_client if settings.search_cache_backend == "redis" else None,
+    settings.search_lock_ttl_ms,
+    settings.search_lock_poll_ms,
+)
+
+content_cache_stats = cache.CacheStats("content")
+content_cache = cache.create_backend(
+    settings.content_cache_backend,
+    "content",
+    settings.content_cache_max_bytes,
+    content_cache_stats,
+)
+
+# Text extraction is CPU bound and runs in processes of its own, created when
+# the first page is extracted
+extract_pool: ProcessPoolExecutor | None = None
+extract_pool_lock = Lock()
+
+
+def get_upstreams() -> Upstreams:
+    loop = asyncio.get_running_loop()
+    if loop not in upstreams_by_loop:
+        upstreams_by_loop[loop] = Upstreams()
+    return upstreams_by_loop[loop]
+
+
+async def close_upstreams():
+    upstreams = upstreams_by_loop.pop(asyncio.get_running_loop(), None)
+    if upstreams:
+        await upstreams.close()
+
+
+def llm_route(tool: edu_model.LLMTool) -> tuple[str, str]:
+    """
+    The provider and model a tool uses: its own llm_provider_<tool> and
+    llm_model_<tool> settings, or else the defaults for the provider.
+    """
+    provider = getattr(settings, f"llm_provider_{tool.value}") or settings.llm_provider
+    default_model = (
+        settings.ollama_model if provider == "ollama" else settings.llm_model
+    )
+    return provider, getattr(settings, f"llm_model_{tool.value}") or default_model
+
+
+def get_cached_completion(key: str) -> bytes | None:
+    try:
+        return llm_cache.get(key)
+    except Exception as e:
+        logging.error(f"Failed to read from the LLM cache: {e}")
+        return None
+
+
+def put_cached_completion(tool: edu_model.LLMTool, key: str, value: bytes):
+    try:
+        llm_cache.set(key, value, ttl=getattr(settings, f"llm_cache_ttl_{tool.value}"))
+    except Exception as e:
+        logging.error(f"Failed to write to the LLM cache: {e}")
+
+
+def llm_cache_key(
+    model: str,
+    messages: list[dict],
+    response_format: type[BaseModel] | None,
+    max_tokens: int | None,
+) -> str:
+    request = {
+        "model": model,
+        "messages": messages,
+        "response_format": (
+            response_format.model_json_schema() if response_format else None
+        ),
+        "max_tokens": max_tokens,
+    }
+    return sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+async def structured_completion(
+    tool: edu_model.LLMTool,
+    messages: list[dict],
+    response_format: type[T],
+    max_tokens: int | None = None,
+) -> T | None:
+    """
+    Run a structured completion with the provider and model of the tool, and
+    return the result validated as response_format, or None if the model gave no
+    answer. Results are cached by model, messages and response schema for the
+    TTL configured for the tool.
+    """
+    provider, model = llm_route(tool)
+    use_cache = llm_cache is not None and settings.llm_cache_enabled
+    key = llm_cache_key(f"{provider}:{model}", messages, response_format, max_tokens)
+
+    if use_cache:
+        cached = await asyncio.to_thread(get_cached_completion, key)
+        if cached is not None:
+            logging.debug(f"Using cached {tool.value} completion")
+            llm_cache_stats.record_hit(bytes_saved=len(cached))
+            return response_format.model_validate_json(cached)
+        llm_cache_stats.record_miss()
+
+    metrics.increment(
+        "rudeadvisor_llm_calls_total", tool=tool.value, provider=provider, model=model
+    )
+    backend = get_upstreams().llm_backend(provider)
+    parsed = await backend.complete_structured(
+        model, messages, response_format, max_tokens
+    )
+
+    if use_cache and parsed is not None:
+        await asyncio.to_thread(
+            put_cached_completion, tool, key, parsed.model_dump_json().encode()
+        )
+    return parsed
+
+
+async def streamed_completion(
+    tool: edu_model.LLMTool,
+    messages: list[dict],
+    on_fragment: Callable[[str], Awaitable[None]],
+    max_tokens: int | None = None,
+) -> str | None:
+    """
+    Run a plain text completion and pass the text on to on_fragment as it is
+    generated. Returns the full text, or None if the model gave no answer. The
+    text is cached like structured completions are, and a cached text is passed
+    on as a single fragment.
+    """
+    provider, model = llm_route(tool)
+    use_cache = llm_cache is not None and settings.llm_cache_enabled
+    key = llm_cache_key(f"{provider}:{model}", messages, None, max_tokens)
+
+    if use_cache:
+        cached = await asyncio.to_thread(get_cached_completion, key)
+        if cached is not None:
+            logging.debug(f"Using cached {tool.value} completion")
+            llm_cache_stats.record_hit(bytes_saved=len(cached))
+            await on_fragment(cached.decode())
+            return cached.decode()
+        llm_cache_stats.record_miss()
+
+    metrics.increment(
+        "rudeadvisor_llm_calls_total", tool=tool.value, provider=provider, model=model
+    )
+    fragments = []
+    backend = get_upstreams().llm_backend(provider)
+    async for fragment in backend.complete_stream(model, messages, max_tokens):
+        fragments.append(fragment)
+        await on_fragment(fragment)
+    text = "".join(fragments)
+    if not text:
+        return None
+
+    if use_cache:
+        await asyncio.to_thread(put_cached_completion, tool, key, text.encode())
+    return text
+
+
+@metrics.timed_tool
+async def answer_questions(
     web_search_results: edu_model.WebSearchResults,
     sources: edu_model.Sources,
     questions: edu_model.Questions,
-    web_data_collection: edu_model.WebDataCollection | None,
+    context: edu_model.ContextSelection | None,
+    on_fragment: Callable[[str], Awaitable[None]] | None = None,
 ) -> edu_model.Answer | None:
     """
-    Use gathered data to generate an answer for the given questions.
+    Use gathered data to generate an answer for the given questions. Only the
+    passages selected for the context are put in the prompt. With on_fragment the
+    answer is streamed, and on_fragment gets the text as it is generated.
     """
     approved_links = set(sources.links)
     search_results_text = "\n".join(
@@ -33,13 +281,8 @@ def answer_questions(
     sources_text = "\n".join([f"Link: {link}" for link in sources.links])
     questions_text = "\n".join([f"Q: {q.question_text}" for q in questions.questions])
     web_data_text = (
-        "\n".join(
-            [
-                f"Data: {web_data.data}"
-                for web_data in web_data_collection.web_data_collection
-            ]
-        )
-        if web_data_collection
+        "\n".join([f"Data: {passage.text}" for passage in context.passages])
+        if context
         else ""
     )
 
@@ -50,94 +293,248 @@ def answer_questions(
         f"Keep the answer to less than 800 characters, but do not keep it too short if the user is asking for it. Typically an essay or discussion is a bit longer"
     )
 
+    messages = [
+        {"role": "system", "content": prompt},
+        {
+            "role": "user",
+            "content": f"Please answer the following questions:\n{questions_text}",
+        },
+    ]
+
     try:
-        completions = openai_client.beta.chat.completions.parse(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": prompt},
-                {
-                    "role": "user",
-                    "content": f"Please answer the following questions:\n{questions_text}",
-                },
-            ],
-            max_tokens=1000,
-            response_format=edu_model.Answer,
-        )
+        if on_fragment:
+            answer_text = await streamed_completion(
+                edu_model.LLMTool.ANSWER, messages, on_fragment, max_tokens=1000
+            )
+            answer = edu_model.Answer(answer_text=answer_text) if answer_text else None
+        else:
+            answer = await structured_completion(
+                edu_model.LLMTool.ANSWER,
+                messages=messages,
+                max_tokens=1000,
+                response_format=edu_model.Answer,
+            )
     except Exception as e:
         logging.error(f"Failed to to getting an answer {e} ")
         return None
 
-    if len(completions.choices) == 0:
+    if answer is None:
+        logging.warning("No completions found for answer generation.")
+    elif answer.answer_text.strip() == "":
         logging.warning("No completions found for answer generation.")
-        return None
-    else:
-        answer = completions.choices[0].message.parsed
-        if answer and answer.answer_text.strip() == "":
-            logging.warning("No completions found for answer generation.")
 
-        return answer
+    return answer
 
 
-def is_text_content(content: str) -> bool:
+async def fetch_link(
+    link: str, headers: dict[str, str] | None = None
+) -> edu_model.WebPage:
     """
-    Checks if the content is primarily textual. Returns True if it is, False otherwise.
+    Download a link with the shared client. The body is streamed and the download
+    is aborted as soon as it grows past scrape_max_bytes. A 304 answer to a
+    conditional request is returned as a page without content.
     """
-    non_printable_chars = sum(1 for char in content if not char.isprintable())
-    if non_printable_chars / len(content) > 0.1:
-        return False
-    return True
+    upstreams = get_upstreams()
+    async with upstreams.scrape_semaphore, upstreams.host_slot(link):
+        async with upstreams.http_client.stream(
+            "GET", link, headers=headers
+        ) as response:
+            if response.status_code == 304:
+                return edu_model.WebPage(
+                    link=link,
+                    status_code=304,
+                    content=b"",
+                    content_type=response.headers.get("content-type", ""),
+                    encoding="utf-8",
+                )
+            response.raise_for_status()
+            content_length = int(response.headers.get("content-length", 0))
+            if content_length > settings.scrape_max_bytes:
+                raise ValueError(
+                    f"Response is {content_length} bytes, more than the limit of {settings.scrape_max_bytes}"
+                )
+
+            content = bytearray()
+            async for chunk in response.aiter_bytes():
+                content.extend(chunk)
+                if len(content) > settings.scrape_max_bytes:
+                    raise ValueError(
+                        f"Response is larger than the limit of {settings.scrape_max_bytes} bytes"
+                    )
+
+    return edu_model.WebPage(
+        link=link,
+        status_code=response.status_code,
+        content=bytes(content),
+        content_type=response.headers.get("content-type", ""),
+        encoding=response.charset_encoding or "utf-8",
+        etag=response.headers.get("etag"),
+        last_modified=response.headers.get("last-modified"),
+    )
 
 
-def scrape_links(source: edu_model.Sources) -> edu_model.WebDataCollection:
+def normalize_url(link: str) -> str:
     """
-    Scrape and retrieve all text content from the site and PDFs. It attempts to pre-sanitize the text and remove known ads.
+    Normalize a link so that trivially different spellings of the same page
+    share a cache entry: lower case scheme and host, no default port, no
+    fragment, no tracking parameters and sorted query parameters.
     """
-    web_data = []
-    errors = []
+    parts = urlsplit(link.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in [("http", 80), ("https", 443)]:
+        host = f"{host}:{parts.port}"
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not key.startswith("utm_")
+        )
+    )
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
 
-    for link in source.links:
-        try:
-            logging.debug(f"Attempting to scrape link: {link}")
-
-            if link.endswith(".pdf"):
-                response = requests.get(link)
-                response.raise_for_status()
-
-                with BytesIO(response.content) as pdf_file:
-                    reader = pypdf.PdfReader(pdf_file)
-                    text = ""
-                    for page in reader.pages:
-                        text += page.extract_text()
-                if not is_text_content(text):
-                    raise ValueError(
-                        f"Extracted content from {link} is not primarily textual."
-                    )
 
-                logging.debug(f"Scraped data from {link} (PDF): {text[:100]}...")
-                web_data.append(edu_model.WebData(link=link, data=text))
-            else:
-                response = requests.get(link)
-                response.raise_for_status()
+def get_cached_web_data(key: str) -> edu_model.CachedWebData | None:
+    if content_cache is None:
+        return None
+    try:
+        cached = content_cache.get(key)
+        return edu_model.CachedWebData.model_validate_json(cached) if cached else None
+    except Exception as e:
+        logging.error(f"Failed to read {key} from the content cache: {e}")
+        return None
 
-                soup = BeautifulSoup(response.text, "html.parser")
 
-                for script in soup(
-                    ["script", "style", "header", "footer", "nav", "aside"]
-                ):
-                    script.decompose()
+def put_cached_web_data(key: str, cached: edu_model.CachedWebData):
+    if content_cache is None:
+        return
+    try:
+        content_cache.set(key, cached.model_dump_json().encode())
+    except Exception as e:
+        logging.error(f"Failed to write {key} to the content cache: {e}")
 
-                text = " ".join(re.split(r"[\n\t]+", soup.get_text()))
-                if not is_text_content(text):
-                    raise ValueError(
-                        f"Extracted content from {link} is not primarily textual."
-                    )
 
-                logging.debug(f"Scraped data from {link}: {text[:100]}...")
-                web_data.append(edu_model.WebData(link=link, data=text))
+def revalidation_headers(cached: edu_model.CachedWebData | None) -> dict[str, str]:
+    headers = {}
+    if cached and cached.etag:
+        headers["If-None-Match"] = cached.etag
+    if cached and cached.last_modified:
+        headers["If-Modified-Since"] = cached.last_modified
+    return headers
 
-        except Exception as e:
-            logging.error(f"Error scraping {link}: {e}")
-            errors.append(str(e))
+
+def get_extract_pool() -> ProcessPoolExecutor:
+    global extract_pool
+    with extract_pool_lock:
+        if extract_pool is None:
+            extract_pool = ProcessPoolExecutor(
+                max_workers=settings.extract_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return extract_pool
+
+
+async def extract_page_text(link: str, page: edu_model.WebPage) -> str:
+    """
+    Extract the text of a page in the extraction process pool, or in a thread
+    when extract_processes is 0. A pool that lost a process is replaced on the
+    next call.
+    """
+    global extract_pool
+    if settings.extract_processes <= 0:
+        return await asyncio.to_thread(extract.extract_text, link, page)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            get_extract_pool(), extract.extract_text, link, page
+        )
+    except BrokenProcessPool:
+        with extract_pool_lock:
+            extract_pool = None
+        raise
+
+
+async def scrape_link(link: str) -> edu_model.WebData:
+    """
+    Scrape one link. Extracted text is cached by normalized URL: fresh entries
+    are used without touching the network and older ones are revalidated with
+    ETag and Last-Modified before they are used. The cache runs in a thread
+    and the text extraction in the extraction processes, to keep the event
+    loop free.
+    """
+    logging.debug(f"Attempting to scrape link: {link}")
+    key = normalize_url(link)
+    cached = await asyncio.to_thread(get_cached_web_data, key)
+    if cached and (
+        (datetime.now() - cached.stored_at).total_seconds()
+        < settings.content_cache_fresh_seconds
+    ):
+        logging.debug(f"Using cached content for {link}")
+        content_cache_stats.record_hit(bytes_saved=cached.downloaded_bytes)
+        metrics.increment("rudeadvisor_scrapes_total", outcome="cached")
+        return edu_model.WebData(link=link, data=cached.data)
+
+    page = await fetch_link(link, revalidation_headers(cached))
+    if page.status_code == 304 and cached:
+        logging.debug(f"Cached content for {link} is still valid")
+        content_cache_stats.record_hit(
+            bytes_saved=cached.downloaded_bytes, revalidated=True
+        )
+        metrics.increment("rudeadvisor_scrapes_total", outcome="revalidated")
+        await asyncio.to_thread(
+            put_cached_web_data, key, cached.immutable_update(stored_at=datetime.now())
+        )
+        return edu_model.WebData(link=link, data=cached.data)
+    content_cache_stats.record_miss()
+
+    text = await extract_page_text(link, page)
+    metrics.increment("rudeadvisor_scrapes_total", outcome="fetched")
+    metrics.observe("rudeadvisor_scrape_fetched_bytes", len(page.content))
+    metrics.observe("rudeadvisor_scrape_text_bytes", len(text.encode()))
+
+    if not extract.is_text_content(text):
+        raise ValueError(f"Extracted content from {link} is not primarily textual.")
+
+    logging.debug(f"Scraped data from {link}: {text[:100]}...")
+    await asyncio.to_thread(
+        put_cached_web_data,
+        key,
+        edu_model.CachedWebData(
+            link=link,
+            data=text,
+            etag=page.etag,
+            last_modified=page.last_modified,
+            downloaded_bytes=len(page.content),
+        ),
+    )
+    return edu_model.WebData(link=link, data=text)
+
+
+async def scrape_link_or_error(link: str) -> edu_model.WebData | str:
+    try:
+        return await scrape_link(link)
+    except Exception as e:
+        logging.error(f"Error scraping {link}: {e}")
+        metrics.increment("rudeadvisor_scrapes_total", outcome="error")
+        return f"{link}: {e}"
+
+
+@metrics.timed_tool
+async def scrape_links(source: edu_model.Sources) -> edu_model.WebDataCollection:
+    """
+    Scrape and retrieve all text content from the site and PDFs. It attempts to pre-sanitize the text and remove known ads.
+    The links are fetched concurrently and the results are kept in link order.
+    """
+    if not source.links:
+        return edu_model.WebDataCollection(
+            web_data_collection=[], web_data_retrival_errors=[]
+        )
+
+    results = await asyncio.gather(
+        *(scrape_link_or_error(link) for link in source.links)
+    )
+
+    web_data = [result for result in results if isinstance(result, edu_model.WebData)]
+    errors = [result for result in results if isinstance(result, str)]
 
     logging.debug(
         f"Scraping finished with {len(web_data)} successes and {len(errors)} errors."
@@ -160,12 +557,80 @@ def clean_and_parse(input_string: str) -> list[dict[str, str]]:
     return parsed_results
 
 
-def query_duckduckgo(
+def normalize_query(query_text: str) -> str:
+    return " ".join(query_text.lower().split())
+
+
+def get_cached_search_results(key: str) -> edu_model.WebSearchResults | None:
+    if search_cache is None:
+        return None
+    try:
+        cached = search_cache.get(key)
+        return (
+            edu_model.WebSearchResults.model_validate_json(cached) if cached else None
+        )
+    except Exception as e:
+        logging.error(f"Failed to read {key} from the search cache: {e}")
+        return None
+
+
+def search_and_cache(
+    key: str, query: edu_model.Query
+) -> edu_model.WebSearchResults | edu_model.WebSearchError:
+    search_results = search_duckduckgo(query)
+    metrics.increment(
+        "rudeadvisor_searches_total",
+        outcome=(
+            "error"
+            if isinstance(search_results, edu_model.WebSearchError)
+            else "searched"
+        ),
+    )
+    if search_cache is not None and isinstance(
+        search_results, edu_model.WebSearchResults
+    ):
+        try:
+            search_cache.set(
+                key,
+                search_results.model_dump_json().encode(),
+                ttl=settings.search_cache_ttl,
+            )
+        except Exception as e:
+            logging.error(f"Failed to write {key} to the search cache: {e}")
+    return search_results
+
+
+@metrics.timed_tool
+async def query_duckduckgo(
     query: edu_model.Query,
 ) -> edu_model.WebSearchResults | edu_model.WebSearchError:
     """
-    Queries DuckDuckGo and returns snippets with URLs.
+    Queries DuckDuckGo and returns snippets with URLs. Results are cached by the
+    normalized query text, and identical searches running at the same time in
+    any worker share a single call to DuckDuckGo. The DuckDuckGo client is
+    blocking, so searches run in a thread.
     """
+    key = normalize_query(query.query_text)
+    cached = await asyncio.to_thread(get_cached_search_results, key)
+    if cached is not None:
+        logging.debug(f"Using cached search results for: {key}")
+        search_cache_stats.record_hit()
+        metrics.increment("rudeadvisor_searches_total", outcome="cached")
+        return cached
+    search_cache_stats.record_miss()
+
+    async with get_upstreams().search_semaphore:
+        return await asyncio.to_thread(
+            search_flight.run,
+            key,
+            lambda: search_and_cache(key, query),
+            lambda: get_cached_search_results(key),
+        )
+
+
+def search_duckduckgo(
+    query: edu_model.Query,
+) -> edu_model.WebSearchResults | edu_model.WebSearchError:
     logging.debug(f"Querying DuckDuckGo for: {query.query_text}")
     try:
         ddgs = DDGS()
@@ -190,7 +655,8 @@ def query_duckduckgo(
         )
 
 
-def evaluate_the_sources(
+@metrics.timed_tool
+async def evaluate_the_sources(
     web_search_results: edu_model.WebSearchResults, query: edu_model.Query
 ) -> edu_model.Sources | None:
     """
@@ -230,20 +696,21 @@ def evaluate_the_sources(
         },
     ]
 
-    completions = openai_client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
+    sources = await structured_completion(
+        edu_model.LLMTool.SOURCES,
         messages=messages,
         response_format=edu_model.Sources,
     )
 
-    if len(completions.choices) == 0:
+    if sources is None:
         logging.warning("No completions found for evaluating sources.")
         return None
     logging.info("Source evaluation completed.")
-    return completions.choices[0].message.parsed
+    return sources
 
 
-def quality_check_your_questions(
+@metrics.timed_tool
+async def quality_check_your_questions(
     questions: edu_model.Questions,
 ) -> edu_model.QuestionsScore | None:
 
@@ -251,8 +718,8 @@ def quality_check_your_questions(
         [f"{i}. " + q.question_text for i, q in enumerate(questions.questions)]
     )
 
-    completions = openai_client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
+    return await structured_completion(
+        edu_model.LLMTool.SCORE,
         messages=[
             {
                 "role": "system",
@@ -281,13 +748,12 @@ def quality_check_your_questions(
         ],
         response_format=edu_model.QuestionsScore,
     )
-    if len(completions.choices) == 0:
-        return None
-
-    return completions.choices[0].message.parsed
 
 
-def challenge_llm(question: edu_model.Questions) -> edu_model.RefinedQuestions | None:
+@metrics.timed_tool
+async def challenge_llm(
+    question: edu_model.Questions,
+) -> edu_model.RefinedQuestions | None:
     contradiction = (
         [
             {
@@ -316,19 +782,15 @@ def challenge_llm(question: edu_model.Questions) -> edu_model.RefinedQuestions |
         },
     ]
     messages.extend(contradiction)
-    completions = openai_client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
+    return await structured_completion(
+        edu_model.LLMTool.CHALLENGE,
         messages=messages,
         response_format=edu_model.RefinedQuestions,
     )
 
-    if len(completions.choices) == 0:
-        return None
-
-    return completions.choices[0].message.parsed
-
 
-def extract_search_query(
+@metrics.timed_tool
+async def extract_search_query(
     questions: edu_model.Questions,
     previous_query: edu_model.Query | None,
     source: edu_model.Sources | None,
@@ -387,13 +849,13 @@ def extract_search_query(
         messages.append(adjustments)
 
     # Making an API call to the AI model to generate the search query
-    completions = openai_client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
+    query = await structured_completion(
+        edu_model.LLMTool.QUERY,
         messages=messages,
         response_format=edu_model.Query,
     )
-    if len(completions.choices) == 0:
+    if query is None:
         logging.debug("No completions found for extracting search query.")
         return None
     logging.debug("Search query extraction completed.")
-    return completions.choices[0].message.parsed
+    return query
@@ -1,46 +1,179 @@
+import asyncio
 import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from datetime import datetime
+from typing import Awaitable, Callable
+from uuid import uuid4
 from rudeadvisor import model as edu_model
 from rudeadvisor import agents
+from rudeadvisor import broadcast
+from rudeadvisor import checkpoint
+from rudeadvisor import conversations
+from rudeadvisor import history
+from rudeadvisor import jobs
+from rudeadvisor import metrics
+from rudeadvisor.config import settings
 import redis
+import redis.asyncio
+
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-redis_client = redis.Redis(host="localhost", port=6379, db=0)
+redis_client = redis.Redis(
+    host=settings.redis_host, port=settings.redis_port, db=settings.redis_db
+)
+# Used by the pipelines, which all run on the event loop of consume_jobs
+async_redis_client = redis.asyncio.Redis(
+    host=settings.redis_host, port=settings.redis_port, db=settings.redis_db
+)
 
 
-def send_process_message_to_user(
+async def publish_message(
+    state: edu_model.ConversationState,
+    action: edu_model.StateAction,
+    message_type: edu_model.MessageType,
+    message_content: str,
+    with_summary: bool = True,
+):
+    event = edu_model.ConversationEvent(
+        conversation_id=state.conversation_id,
+        message=edu_model.Message(
+            message_type=message_type,
+            state_action=action,
+            content=message_content,
+            timestamp=datetime.now(),
+        ),
+        summary=(
+            edu_model.create_conversation_summary(state, action)
+            if with_summary
+            else None
+        ),
+    )
+
+    channel_name = broadcast.channel_name(state.conversation_id)
+    # The event is logged first, so that it is published with its id and a
+    # client that reconnects can replay it
+    event_id = await history.append_event(
+        async_redis_client, event, event.model_dump_json()
+    )
+    event_json = event.immutable_update(event_id=event_id).model_dump_json()
+    metrics.observe(
+        "rudeadvisor_published_message_bytes",
+        len(event_json.encode()),
+        message_type=message_type.value,
+    )
+    await async_redis_client.publish(channel_name, event_json)
+    logger.debug(f"Message published to channel: {channel_name}")
+
+
+async def send_process_message_to_user(
     state: edu_model.ConversationState,
     action: edu_model.StateAction,
     message_content: str,
 ):
     logger.debug(f"Sending process message to user: {message_content}")
+    await publish_message(state, action, edu_model.MessageType.PROCESS, message_content)
 
-    state = state.model_copy(
-        update={
-            "messages": state.messages
-            + [
-                edu_model.Message(
-                    message_type=edu_model.MessageType.PROCESS,
-                    state_action=action,
-                    content=message_content,
-                    timestamp=datetime.now(),
-                )
-            ]
-        },
-        deep=True,
+
+async def send_answer_fragment_to_user(
+    state: edu_model.ConversationState,
+    action: edu_model.StateAction,
+    fragment: str,
+):
+    await publish_message(
+        state,
+        action,
+        edu_model.MessageType.ANSWER_FRAGMENT,
+        fragment,
+        with_summary=False,
     )
 
-    channel_name = f"conversation:{state.conversation_id}"
-    redis_client.publish(channel_name, state.model_dump_json())
-    logger.debug(f"Message published to channel: {channel_name}")
 
+def checkpoint_after_step(
+    job_id: str, steps_taken: int, entry_id: str | None = None
+) -> Callable[[edu_model.StepRecord, edu_model.ConversationState], Awaitable[None]]:
+    async def on_step(
+        step_record: edu_model.StepRecord, state: edu_model.ConversationState
+    ):
+        if step_record.next_action is None:
+            return
+        await asyncio.to_thread(
+            checkpoint.save_checkpoint,
+            redis_client,
+            edu_model.Checkpoint(
+                conversation_id=state.conversation_id,
+                job_id=job_id,
+                entry_id=entry_id,
+                state=state,
+                previous_action=step_record.action,
+                next_action=step_record.next_action,
+                steps_taken=steps_taken + step_record.step + 1,
+            ),
+        )
+
+    return on_step
 
-def process_action(
+
+async def run_pipeline(
+    state: edu_model.ConversationState,
+    previous_action: edu_model.StateAction | None,
+    action: edu_model.StateAction,
+    job_id: str,
+    steps_taken: int = 0,
+    entry_id: str | None = None,
+) -> edu_model.ConversationState:
+    """
+    Run the agents, checkpointing the state after every step so that the
+    pipeline can be resumed from its last completed step if this worker dies.
+    The final state is written to the conversation store, which keeps the
+    conversation alive and accounts for its size.
+    """
+    await asyncio.to_thread(
+        checkpoint.save_checkpoint,
+        redis_client,
+        edu_model.Checkpoint(
+            conversation_id=state.conversation_id,
+            job_id=job_id,
+            entry_id=entry_id,
+            state=state,
+            previous_action=previous_action,
+            next_action=action,
+            steps_taken=steps_taken,
+        ),
+    )
+    state = await agents.transition_async(
+        state,
+        previous_action,
+        action,
+        send_process_message_to_user,
+        limits=edu_model.PipelineLimits(
+            max_steps=max(settings.pipeline_max_steps - steps_taken, 1),
+            max_action_retries=settings.pipeline_max_action_retries,
+        ),
+        on_step=checkpoint_after_step(job_id, steps_taken, entry_id),
+        send_fragment_to_user=send_answer_fragment_to_user,
+    )
+    try:
+        await asyncio.to_thread(conversations.save_conversation, redis_client, state)
+    except conversations.ConversationTooLarge as e:
+        # The conversation keeps its previous state, the next question starts
+        # from that
+        logger.warning(f"Not storing the final state: {e}")
+    await asyncio.to_thread(
+        checkpoint.clear_checkpoint, redis_client, state.conversation_id
+    )
+    return state
+
+
+async def process_action(
     conversation_state: edu_model.ConversationState | str,
     previous_action: edu_model.StateAction | None,
     action: edu_model.StateAction,
+    job_id: str | None = None,
+    entry_id: str | None = None,
 ):
     logger.debug("Starting process_action task")
 
@@ -50,15 +183,172 @@ def process_action(
     else:
         state = conversation_state
 
-    send_process_message_to_user(state, action, f"Processing your {action} request")
+    await send_process_message_to_user(
+        state, action, f"Processing your {action} request"
+    )
     logger.debug(f"Process message sent for action: {action}")
 
-    state = agents.transition(
-        state, previous_action, action, send_process_message_to_user
+    state = await run_pipeline(
+        state, previous_action, action, job_id or str(uuid4()), entry_id=entry_id
     )
     logger.debug("State transitioned")
 
-    send_process_message_to_user(
+    await send_process_message_to_user(
         state, action, f"We finished the processing of your request"
     )
     logger.debug("Final process message sent")
+
+
+async def resume_conversation(saved: edu_model.Checkpoint, entry_id: str | None = None):
+    logger.info(
+        f"Resuming {saved.conversation_id} from {saved.next_action} after {saved.steps_taken} steps"
+    )
+    await send_process_message_to_user(
+        saved.state, saved.next_action, "Picking up your request where we left off"
+    )
+
+    state = await run_pipeline(
+        saved.state,
+        saved.previous_action,
+        saved.next_action,
+        saved.job_id,
+        saved.steps_taken,
+        entry_id,
+    )
+
+    await send_process_message_to_user(
+        state, saved.next_action, "We finished the processing of your request"
+    )
+
+
+async def run_job(entry_id, fields: dict):
+    job = jobs.parse_job(fields)
+    logger.debug(f"Running job {job.job_id} from stream entry {entry_id}")
+
+    saved = await asyncio.to_thread(
+        checkpoint.load_checkpoint, redis_client, job.state.conversation_id
+    )
+    entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+    if saved and saved.job_id == job.job_id:
+        await resume_conversation(saved, entry_id)
+    else:
+        await process_action(
+            job.state, job.previous_action, job.action, job.job_id, entry_id
+        )
+    await asyncio.to_thread(jobs.ack_job, redis_client, entry_id)
+
+
+def requeue_stalled_conversations() -> int:
+    """
+    Put a resume job on the stream for every pipeline that has not completed a
+    step for checkpoint_stall_seconds. A pipeline whose job is still on the
+    stream is left alone, it is redelivered or dead-lettered from there.
+    """
+    stalled = checkpoint.find_stalled_conversations(
+        redis_client, settings.checkpoint_stall_seconds
+    )
+    requeued = 0
+    for conversation_id in stalled:
+        saved = checkpoint.load_checkpoint(redis_client, conversation_id)
+        if saved is None:
+            checkpoint.clear_checkpoint(redis_client, conversation_id)
+            continue
+        if saved.entry_id and jobs.is_queued(redis_client, saved.entry_id):
+            logger.debug(
+                f"Not requeueing {conversation_id}, its job {saved.entry_id} is queued"
+            )
+            continue
+
+        logger.warning(f"Requeueing stalled conversation {conversation_id}")
+        entry_id = jobs.enqueue_job(
+            redis_client,
+            edu_model.Job(
+                job_id=saved.job_id,
+                state=saved.state,
+                previous_action=saved.previous_action,
+                action=saved.next_action,
+            ),
+        )
+        # Until a worker picks it up, the new entry is the one to wait for
+        checkpoint.save_checkpoint(
+            redis_client,
+            saved.immutable_update(
+                entry_id=(
+                    entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+                )
+            ),
+        )
+        requeued += 1
+    return requeued
+
+
+def consume_jobs(consumer_name: str, concurrency: int):
+    """
+    Run pipelines from the job stream until interrupted, at most `concurrency`
+    at a time. A job is acknowledged only when its pipeline finished, so the
+    jobs of a consumer that dies are claimed and redelivered by the others.
+    The pipelines all run on one event loop in a background thread, while this
+    thread reads the job stream.
+    """
+    jobs.ensure_consumer_group(redis_client)
+    logger.info(f"Worker {consumer_name} consuming jobs with concurrency {concurrency}")
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="pipelines", daemon=True).start()
+
+    running: dict[Future, bytes | str] = {}
+    last_recovery_scan = 0.0
+    last_metrics_flush = time.monotonic()
+    try:
+        while True:
+            if (
+                time.monotonic() - last_metrics_flush
+                > settings.metrics_flush_interval_seconds
+            ):
+                last_metrics_flush = time.monotonic()
+                metrics.flush(redis_client)
+
+            if (
+                time.monotonic() - last_recovery_scan
+                > settings.checkpoint_scan_interval_seconds
+            ):
+                last_recovery_scan = time.monotonic()
+                if checkpoint.claim_recovery_scan(redis_client):
+                    requeue_stalled_conversations()
+                    conversations.prune_expired_conversations(redis_client)
+
+            done = [future for future in running if future.done()]
+            for future in done:
+                entry_id = running.pop(future)
+                if future.exception():
+                    logger.error(
+                        f"Job {entry_id} failed and will be redelivered: {future.exception()}"
+                    )
+
+            free_slots = concurrency - len(running)
+            if free_slots == 0:
+                jobs.keep_jobs_alive(
+                    redis_client, consumer_name, list(running.values())
+                )
+                wait(
+                    running,
+                    timeout=settings.job_block_ms / 1000,
+                    return_when=FIRST_COMPLETED,
+                )
+                continue
+
+            entries = jobs.claim_stale_jobs(redis_client, consumer_name, free_slots)
+            if not entries:
+                jobs.keep_jobs_alive(
+                    redis_client, consumer_name, list(running.values())
+                )
+                entries = jobs.read_new_jobs(redis_client, consumer_name, free_slots)
+
+            for entry_id, fields in entries:
+                future = asyncio.run_coroutine_threadsafe(
+                    run_job(entry_id, fields), loop
+                )
+                running[future] = entry_id
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        metrics.flush(redis_client)
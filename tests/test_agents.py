@@ -0,0 +1,111 @@
+import asyncio
+from rudeadvisor import agents
+from rudeadvisor import index
+from rudeadvisor import model as edu_model
+from rudeadvisor import tools
+
+
+def returning(value):
+    async def fake(*args):
+        return value
+
+    return fake
+
+
+def test_transition_stops_retrying_bad_sources(monkeypatch):
+    monkeypatch.setattr(index, "search", lambda questions, limit: [])
+    monkeypatch.setattr(
+        tools,
+        "quality_check_your_questions",
+        returning(edu_model.QuestionsScore(score=90, score_comment="fine")),
+    )
+    monkeypatch.setattr(
+        tools,
+        "extract_search_query",
+        returning(edu_model.Query(query_text="cats")),
+    )
+    monkeypatch.setattr(
+        tools,
+        "query_duckduckgo",
+        returning(
+            edu_model.WebSearchResults(
+                web_search_results=[
+                    edu_model.WebSearchResult(
+                        snippet="snippet", title="title", link="link"
+                    )
+                ]
+            )
+        ),
+    )
+    monkeypatch.setattr(
+        tools,
+        "evaluate_the_sources",
+        returning(
+            edu_model.Sources(
+                links=["link"],
+                query_tuning_suggestion=None,
+                removed_links_explaination=None,
+            )
+        ),
+    )
+    state = edu_model.create_initial_state("c1").immutable_copy_questions(
+        edu_model.Questions(
+            questions=[edu_model.Question(question_text="Why?")], questions_score=None
+        )
+    )
+    steps = []
+
+    agents.transition(
+        state,
+        None,
+        edu_model.StateAction.COORDINATE,
+        lambda state, action, content: None,
+        limits=edu_model.PipelineLimits(max_steps=50, max_action_retries=1),
+        on_step=lambda step, state: steps.append(step.action),
+    )
+
+    assert steps.count(edu_model.StateAction.SOURCE_APPROVE) == 2
+    assert steps[-1] == edu_model.StateAction.QUERY_LLM
+
+
+def test_buffered_fragments_coalesces_small_fragments():
+    sent = []
+
+    async def send(fragments):
+        sent.append(fragments)
+
+    async def stream():
+        add, flush = agents.buffered_fragments(send, min_chars=5)
+        for fragment in ["a", "bc", "de", "f"]:
+            await add(fragment)
+        await flush()
+
+    asyncio.run(stream())
+
+    assert sent == ["abcde", "f"]
+
+
+def test_scraped_text_stays_inline_when_the_blob_store_fails(monkeypatch):
+    scraped = edu_model.WebDataCollection(
+        web_data_collection=[edu_model.WebData(link="link", data="Napoleon " * 500)],
+        web_data_retrival_errors=[],
+    )
+    monkeypatch.setattr(tools, "scrape_links", returning(scraped))
+    monkeypatch.setattr(index, "add_web_data", lambda web_data_collection: None)
+
+    def failing(web_data_collection):
+        raise ConnectionError("blob store is down")
+
+    monkeypatch.setattr(agents.blobs, "offload_web_data", failing)
+    state = edu_model.create_initial_state("c1").immutable_copy_sources(
+        edu_model.Sources(
+            links=["link"],
+            query_tuning_suggestion=None,
+            removed_links_explaination=None,
+        )
+    )
+
+    state, action = asyncio.run(agents.web_scrape_sites(state, None, returning(None)))
+
+    assert state.web_data_collection == scraped
+    assert action == edu_model.StateAction.ANSWER_QUESTION
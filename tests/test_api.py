@@ -0,0 +1,114 @@
+from contextlib import asynccontextmanager
+import asyncio
+import redis
+from rudeadvisor import api
+from rudeadvisor import model as edu_model
+
+
+def event(event_id: str) -> edu_model.ConversationEvent:
+    return edu_model.ConversationEvent(
+        conversation_id="c1",
+        message=edu_model.Message(
+            message_type=edu_model.MessageType.PROCESS,
+            state_action=edu_model.StateAction.COORDINATE,
+            content=event_id,
+        ),
+        event_id=event_id,
+    )
+
+
+class FakeBroadcaster:
+    """
+    Hands the listener a queue that already holds the live events.
+    """
+
+    def __init__(self, live_events: list[edu_model.ConversationEvent]):
+        self.live_events = live_events
+        self.queue: asyncio.Queue | None = None
+
+    @asynccontextmanager
+    async def listen(self, conversation_id: str):
+        self.queue = asyncio.Queue()
+        for live_event in self.live_events:
+            self.queue.put_nowait(live_event.model_dump_json())
+        yield self.queue
+
+
+def stream(monkeypatch, last_event_id, read_events_after, live_events, count):
+    broadcaster = FakeBroadcaster(live_events)
+    monkeypatch.setattr(api, "broadcaster", broadcaster)
+    monkeypatch.setattr(
+        api.conversations, "touch_conversation", lambda redis_client, id: True
+    )
+    monkeypatch.setattr(api.history, "read_events_after", read_events_after)
+
+    async def sent_event_ids():
+        response = await api.stream_conversation("c1", last_event_id=last_event_id)
+        events = response.body_iterator
+        sent = [(await anext(events))["id"] for _ in range(count)]
+        await events.aclose()
+        return sent, broadcaster.queue.qsize()
+
+    return asyncio.run(sent_event_ids())
+
+
+def test_replayed_events_are_sent_once(monkeypatch):
+    async def read_events_after(redis_client, conversation_id, last_event_id):
+        assert last_event_id == "1-0"
+        return [event("2-0"), event("3-0")]
+
+    sent, unread = stream(
+        monkeypatch,
+        "1-0",
+        read_events_after,
+        [event("2-0"), event("1-0"), event("3-0"), event("4-0")],
+        count=3,
+    )
+
+    assert sent == ["2-0", "3-0", "4-0"]
+    assert unread == 0
+
+
+def test_a_failed_replay_falls_back_to_live_events(monkeypatch):
+    async def read_events_after(redis_client, conversation_id, last_event_id):
+        raise redis.ResponseError("Invalid stream ID")
+
+    sent, _ = stream(monkeypatch, "9-0", read_events_after, [event("6-0")], count=1)
+
+    assert sent == ["6-0"]
+
+
+def test_event_ids_redis_rejects_are_not_valid():
+    assert api.valid_event_id("1700000000000-0")
+    assert not api.valid_event_id(f"{2**64}-0")
+    assert not api.valid_event_id("1-x")
+
+
+def test_a_new_question_starts_from_a_clean_state(monkeypatch):
+    previous = (
+        edu_model.create_initial_state("c1")
+        .immutable_copy_query(edu_model.Query(query_text="napoleon"))
+        .immutable_copy_answer(edu_model.Answer(answer_text="In 1796"))
+    )
+    monkeypatch.setattr(
+        api.conversations, "load_conversation", lambda redis_client, id: previous
+    )
+    enqueued = []
+
+    async def enqueue_job_async(redis_client, job):
+        enqueued.append(job)
+
+    monkeypatch.setattr(api.jobs, "enqueue_job_async", enqueue_job_async)
+
+    asyncio.run(
+        api.handle_action(
+            "c1", edu_model.QuestionsRequest(questions_list="Why do cats purr?")
+        )
+    )
+
+    (job,) = enqueued
+    assert job.state.conversation_id == "c1"
+    assert [question.question_text for question in job.state.questions.questions] == [
+        "Why do cats purr?"
+    ]
+    assert job.state.query is None and job.state.answer is None
@@ -0,0 +1,53 @@
+from rudeadvisor import blobs
+from rudeadvisor import cache
+from rudeadvisor import model as edu_model
+
+
+def collection(*pages: tuple[str, str]) -> edu_model.WebDataCollection:
+    return edu_model.WebDataCollection(
+        web_data_collection=[
+            edu_model.WebData(link=link, data=data) for link, data in pages
+        ],
+        web_data_retrival_errors=[],
+    )
+
+
+def test_large_pages_are_stored_once_and_resolved(monkeypatch):
+    store = cache.MemoryCacheBackend(1_000_000, cache.CacheStats())
+    monkeypatch.setattr(blobs, "blob_store", store)
+    page = "Napoleon married Josephine in 1796. " * 100
+    scraped = collection(("a", page), ("b", page), ("c", "Short"))
+
+    offloaded = blobs.offload_web_data(scraped)
+
+    first, second, short = offloaded.web_data_collection
+    assert first.data == "" and first.blob_key == second.blob_key
+    assert short.data == "Short" and short.blob_key is None
+    assert len(store._entries) == 1
+    assert blobs.resolve_web_data(offloaded) == scraped
+
+
+def test_evicted_blobs_resolve_to_empty_pages(monkeypatch):
+    monkeypatch.setattr(
+        blobs, "blob_store", cache.MemoryCacheBackend(1_000_000, cache.CacheStats())
+    )
+    offloaded = blobs.offload_web_data(collection(("a", "Napoleon " * 500)))
+    blobs.blob_store.delete(offloaded.web_data_collection[0].blob_key)
+
+    resolved = blobs.resolve_web_data(offloaded)
+
+    assert resolved.web_data_collection[0].data == ""
+
+
+def test_storing_a_blob_again_only_renews_its_ttl(monkeypatch):
+    store = cache.MemoryCacheBackend(1_000_000, cache.CacheStats())
+    monkeypatch.setattr(blobs, "blob_store", store)
+    writes = []
+    monkeypatch.setattr(store, "set", lambda *args: writes.append(args))
+    monkeypatch.setattr(store, "touch", lambda key, ttl: len(writes) > 0)
+
+    first = blobs.put_text("Napoleon " * 500)
+    second = blobs.put_text("Napoleon " * 500)
+
+    assert first == second
+    assert len(writes) == 1
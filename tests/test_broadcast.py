@@ -0,0 +1,114 @@
+import asyncio
+from rudeadvisor import broadcast
+import pytest
+
+
+class FakePubSub:
+    """
+    Records the subscribed channels and hands out the published messages.
+    """
+
+    def __init__(self):
+        self.channels: set[str] = set()
+        self.subscribe_calls = 0
+        self.failures = 0
+        self.messages: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, channel: str):
+        self.subscribe_calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Connection reset by peer")
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+
+    async def get_message(self, ignore_subscribe_messages: bool, timeout):
+        return await self.messages.get()
+
+    def publish(self, conversation_id: str, data: bytes):
+        self.messages.put_nowait(
+            {
+                "type": "message",
+                "channel": broadcast.channel_name(conversation_id).encode(),
+                "data": data,
+            }
+        )
+
+    async def aclose(self):
+        pass
+
+
+class FakeRedis:
+    def __init__(self):
+        self.pubsub_client = FakePubSub()
+
+    def pubsub(self):
+        return self.pubsub_client
+
+
+async def delivered(pubsub: FakePubSub):
+    # The reader takes a message and dispatches it in one step
+    while not pubsub.messages.empty():
+        await asyncio.sleep(0)
+
+
+def test_channels_are_subscribed_by_the_first_listener_only():
+    async def scenario():
+        redis_client = FakeRedis()
+        broadcaster = broadcast.ConversationBroadcaster(redis_client)
+        pubsub = redis_client.pubsub_client
+
+        async with broadcaster.listen("c1") as first:
+            async with broadcaster.listen("c1") as second:
+                assert broadcaster.listener_count("c1") == 2
+                pubsub.publish("c1", b"hello")
+                await delivered(pubsub)
+                assert first.get_nowait() == second.get_nowait() == b"hello"
+            assert pubsub.channels == {"conversation:c1"}
+        assert pubsub.channels == set()
+        assert pubsub.subscribe_calls == 1
+        assert broadcaster.listener_count("c1") == 0
+        await broadcaster.close()
+
+    asyncio.run(scenario())
+
+
+def test_slow_listeners_lose_their_oldest_messages():
+    async def scenario():
+        redis_client = FakeRedis()
+        broadcaster = broadcast.ConversationBroadcaster(redis_client, queue_size=2)
+        pubsub = redis_client.pubsub_client
+
+        async with broadcaster.listen("c1") as queue:
+            for data in [b"1", b"2", b"3"]:
+                pubsub.publish("c1", data)
+            await delivered(pubsub)
+            assert [queue.get_nowait() for _ in range(queue.qsize())] == [b"2", b"3"]
+        await broadcaster.close()
+
+    asyncio.run(scenario())
+
+
+def test_a_failed_subscription_leaves_no_listener_behind():
+    async def scenario():
+        redis_client = FakeRedis()
+        broadcaster = broadcast.ConversationBroadcaster(redis_client)
+        pubsub = redis_client.pubsub_client
+        pubsub.failures = 1
+
+        with pytest.raises(ConnectionError):
+            async with broadcaster.listen("c1"):
+                pass
+        assert broadcaster.listener_count("c1") == 0
+
+        async with broadcaster.listen("c1") as queue:
+            assert broadcaster.listener_count("c1") == 1
+            assert pubsub.channels == {"conversation:c1"}
+            pubsub.publish("c1", b"hello")
+            await delivered(pubsub)
+            assert queue.get_nowait() == b"hello"
+        await broadcaster.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,297 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha256
+from threading import Event, Semaphore
+from rudeadvisor import cache
+from rudeadvisor import metrics
+import pytest
+
+
+def test_memory_backend_evicts_least_recently_used():
+    stats = cache.CacheStats()
+    backend = cache.MemoryCacheBackend(max_bytes=250, stats=stats)
+    backend.set("first", b"x" * 100)
+    backend.set("second", b"x" * 100)
+    backend.get("first")
+
+    backend.set("third", b"x" * 100)
+
+    assert backend.get("first") is not None
+    assert backend.get("second") is None
+    assert backend.get("third") is not None
+    assert stats.evictions == 1
+
+
+def test_disk_backend_round_trip_and_expiry(tmp_path):
+    backend = cache.DiskCacheBackend(tmp_path, max_bytes=1000, stats=cache.CacheStats())
+    backend.set("fresh", b"value")
+    backend.set("expired", b"value", ttl=-1)
+
+    assert backend.get("fresh") == b"value"
+    assert backend.get("expired") is None
+
+
+def test_disk_backend_creates_its_directory_on_first_write(tmp_path):
+    directory = tmp_path / "content"
+    backend = cache.DiskCacheBackend(
+        directory, max_bytes=1000, stats=cache.CacheStats()
+    )
+
+    assert backend.get("missing") is None
+    assert not directory.exists()
+    backend.set("key", b"value")
+    assert backend.get("key") == b"value"
+
+
+class FakeRedis:
+    """
+    The commands used by the Redis backend. Deleting an entry key stands in
+    for Redis expiring it.
+    """
+
+    def __init__(self):
+        self.values: dict[str, object] = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, px=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        return int(self.values.pop(key, None) is not None)
+
+    def hget(self, key, field):
+        return self.values.get(key, {}).get(field)
+
+    def hexists(self, key, field):
+        return field in self.values.get(key, {})
+
+    def hset(self, key, field, value):
+        self.values.setdefault(key, {})[field] = str(value).encode()
+
+    def hdel(self, key, field):
+        return int(self.values.get(key, {}).pop(field, None) is not None)
+
+    def zadd(self, key, mapping):
+        self.values.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, member):
+        return self.hdel(key, member)
+
+    def zpopmin(self, key):
+        members = self.values.get(key, {})
+        if not members:
+            return []
+        member = min(members, key=members.get)
+        return [(member.encode(), members.pop(member))]
+
+    def incrby(self, key, amount):
+        self.values[key] = self.values.get(key, 0) + amount
+        return self.values[key]
+
+    def decrby(self, key, amount):
+        return self.incrby(key, -amount)
+
+
+class FakePipeline:
+    def __init__(self, redis_client: FakeRedis):
+        self._redis_client = redis_client
+        self._results = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self._results.append(getattr(self._redis_client, name)(*args, **kwargs))
+
+        return queue
+
+    def execute(self):
+        return self._results
+
+
+def test_redis_backend_forgets_the_size_of_expired_entries():
+    redis_client = FakeRedis()
+    stats = cache.CacheStats()
+    backend = cache.RedisCacheBackend(redis_client, "test", max_bytes=250, stats=stats)
+    backend.set("first", b"x" * 100, ttl=1)
+    backend.set("second", b"x" * 100)
+    redis_client.delete("cache:test:entry:first")
+
+    assert backend.get("first") is None
+    assert redis_client.get("cache:test:bytes") == 100
+    assert not redis_client.hexists("cache:test:sizes", "first")
+
+
+def test_redis_backend_does_not_count_expired_entries_as_evictions():
+    redis_client = FakeRedis()
+    stats = cache.CacheStats()
+    backend = cache.RedisCacheBackend(redis_client, "test", max_bytes=250, stats=stats)
+    backend.set("first", b"x" * 100, ttl=1)
+    backend.set("second", b"x" * 100)
+    redis_client.delete("cache:test:entry:first")
+
+    backend.set("third", b"x" * 100)
+
+    assert backend.get("second") == b"x" * 100
+    assert backend.get("third") == b"x" * 100
+    assert redis_client.get("cache:test:bytes") == 200
+    assert stats.evictions == 0
+
+
+def test_disk_backend_touch_renews_only_live_entries(tmp_path):
+    backend = cache.DiskCacheBackend(tmp_path, max_bytes=1000, stats=cache.CacheStats())
+    backend.set("fresh", b"value", ttl=-1)
+
+    assert not backend.touch("fresh", ttl=60)
+    assert not backend.touch("missing", ttl=60)
+    backend.set("fresh", b"value", ttl=1)
+    assert backend.touch("fresh", ttl=60)
+    assert backend.get("fresh") == b"value"
+
+
+def test_named_cache_counters_are_recorded_as_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, "pending", {})
+    stats = cache.CacheStats("content")
+
+    stats.record_hit(bytes_saved=2_000, revalidated=True)
+    stats.record_hit(bytes_saved=500)
+    stats.record_evictions(3)
+
+    assert metrics.pending == {
+        ("rudeadvisor_cache_requests_total", 'cache="content",result="hit"'): 2,
+        ("rudeadvisor_cache_bytes_saved_total", 'cache="content"'): 2_500,
+        ("rudeadvisor_cache_revalidations_total", 'cache="content"'): 1,
+        ("rudeadvisor_cache_evictions_total", 'cache="content"'): 3,
+    }
+
+
+class CountingFuture(Future):
+    """
+    Lets a test wait until the callers that share a call are blocked on it.
+    """
+
+    waiting = Semaphore(0)
+
+    def result(self, timeout=None):
+        CountingFuture.waiting.release()
+        return super().result(timeout)
+
+
+class FakeLockRedis:
+    """
+    The string commands the cross-process lock uses.
+    """
+
+    def __init__(self):
+        self.values: dict[str, bytes] = {}
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value.encode()
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+def lock_key(namespace: str, key: str) -> str:
+    return f"singleflight:{namespace}:{sha256(key.encode()).hexdigest()}"
+
+
+def run_concurrently(monkeypatch, call, count: int) -> list:
+    """
+    Run `count` callers of one key, the first of which is in `call` while the
+    others join it.
+    """
+    monkeypatch.setattr(cache, "Future", CountingFuture)
+    CountingFuture.waiting = Semaphore(0)
+    single_flight = cache.SingleFlight("search", None, 1_000, 1)
+    release = Event()
+    started = Event()
+
+    def leader_call():
+        started.set()
+        release.wait()
+        return call()
+
+    def caller(function):
+        try:
+            return single_flight.run("cats", function, lambda: None)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(count) as executor:
+        results = [executor.submit(caller, leader_call)]
+        started.wait()
+        results += [executor.submit(caller, call) for _ in range(count - 1)]
+        for _ in range(count - 1):
+            CountingFuture.waiting.acquire()
+        release.set()
+        return [result.result() for result in results]
+
+
+def test_concurrent_callers_share_one_call(monkeypatch):
+    calls = []
+
+    def call():
+        calls.append(1)
+        return "results"
+
+    assert run_concurrently(monkeypatch, call, 5) == ["results"] * 5
+    assert len(calls) == 1
+
+
+def test_every_caller_gets_the_exception_of_the_shared_call(monkeypatch):
+    def call():
+        raise ConnectionError("search failed")
+
+    results = run_concurrently(monkeypatch, call, 4)
+
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert len({id(result) for result in results}) == 1
+
+
+def test_callers_poll_the_cache_while_another_process_holds_the_lock():
+    redis_client = FakeLockRedis()
+    single_flight = cache.SingleFlight("search", redis_client, 1_000, 1)
+    redis_client.set(lock_key("search", "cats"), "other-process")
+    lookups = iter([None, None, "shared results"])
+
+    result = single_flight.run(
+        "cats", lambda: pytest.fail("the call is made once"), lambda: next(lookups)
+    )
+
+    assert result == "shared results"
+    assert redis_client.get(lock_key("search", "cats")) == b"other-process"
+
+
+def test_callers_make_the_call_when_the_lock_is_held_too_long():
+    redis_client = FakeLockRedis()
+    single_flight = cache.SingleFlight("search", redis_client, 20, 1)
+    redis_client.set(lock_key("search", "cats"), "other-process")
+
+    assert single_flight.run("cats", lambda: "own results", lambda: None) == (
+        "own results"
+    )
+
+
+def test_the_lock_is_only_released_by_its_owner():
+    redis_client = FakeLockRedis()
+    single_flight = cache.SingleFlight("search", redis_client, 1_000, 1)
+    key = lock_key("search", "cats")
+
+    def call_that_outlives_the_lock():
+        # The lock expired and another process took it
+        redis_client.set(key, "other-process")
+        return "results"
+
+    single_flight.run("cats", lambda: "results", lambda: None)
+    assert redis_client.get(key) is None
+    single_flight.run("cats", call_that_outlives_the_lock, lambda: None)
+    assert redis_client.get(key) == b"other-process"
@@ -0,0 +1,40 @@
+from rudeadvisor import codec
+from rudeadvisor import model as edu_model
+import pytest
+
+
+def state_with_page(text: str) -> edu_model.ConversationState:
+    return edu_model.create_initial_state("c1").immutable_copy_web_data_collection(
+        edu_model.WebDataCollection(
+            web_data_collection=[edu_model.WebData(link="link1", data=text)],
+            web_data_retrival_errors=[],
+        )
+    )
+
+
+def test_binary_frames_compress_large_states_and_read_back():
+    state = state_with_page("Napoleon married Josephine in 1796. " * 1_000)
+
+    data = codec.encode(state, codec="binary", encoding="json", compress_min_bytes=1)
+
+    assert data.startswith(codec.FRAME_MAGIC)
+    assert len(data) < len(state.model_dump_json()) / 10
+    assert codec.decode(data, edu_model.ConversationState) == state
+
+
+def test_plain_json_from_older_versions_is_read():
+    state = state_with_page("Napoleon")
+
+    assert codec.decode(state.model_dump_json(), edu_model.ConversationState) == state
+    assert (
+        codec.decode(codec.encode(state, codec="json"), edu_model.ConversationState)
+        == state
+    )
+
+
+def test_frames_of_a_newer_version_are_rejected():
+    data = bytearray(codec.encode(state_with_page("Napoleon"), codec="binary"))
+    data[len(codec.FRAME_MAGIC)] = codec.FRAME_VERSION + 1
+
+    with pytest.raises(ValueError, match="version"):
+        codec.decode(bytes(data), edu_model.ConversationState)
@@ -0,0 +1,59 @@
+from rudeadvisor import context
+from rudeadvisor import model as edu_model
+
+
+def make_questions(*texts: str) -> edu_model.Questions:
+    return edu_model.Questions(
+        questions=[edu_model.Question(question_text=text) for text in texts],
+        questions_score=None,
+    )
+
+
+def test_build_context_prefers_relevant_passages_within_budget():
+    web_data_collection = edu_model.WebDataCollection(
+        web_data_collection=[
+            edu_model.WebData(link="cooking", data="pasta sauce tomato " * 20),
+            edu_model.WebData(link="napoleon", data="napoleon married josephine " * 20),
+            edu_model.WebData(link="weather", data="rain sun clouds wind " * 20),
+        ],
+        web_data_retrival_errors=[],
+    )
+
+    selection = context.build_context(
+        web_data_collection,
+        make_questions("Who did Napoleon marry?"),
+        token_budget=context.estimate_tokens("napoleon married josephine " * 20),
+        passage_words=100,
+    )
+
+    assert [passage.link for passage in selection.passages] == ["napoleon"]
+    assert selection.passages[0].score > 0
+    assert selection.candidate_count == 3
+
+
+def test_build_context_keeps_page_order():
+    web_data_collection = edu_model.WebDataCollection(
+        web_data_collection=[
+            edu_model.WebData(link="first", data="cats"),
+            edu_model.WebData(link="second", data="cats dogs"),
+        ],
+        web_data_retrival_errors=[],
+    )
+
+    selection = context.build_context(
+        web_data_collection,
+        make_questions("Cats and dogs?"),
+        token_budget=1000,
+        passage_words=10,
+    )
+
+    assert [passage.link for passage in selection.passages] == ["first", "second"]
+
+
+def test_build_context_without_data():
+    selection = context.build_context(
+        None, make_questions("Why?"), token_budget=1000, passage_words=10
+    )
+
+    assert selection.passages == []
+    assert selection.token_estimate == 0
@@ -0,0 +1,173 @@
+from rudeadvisor import conversations
+from rudeadvisor import model as edu_model
+from rudeadvisor.config import settings
+import pytest
+
+
+class FakeRedis:
+    """
+    The hash, sorted set and expiry commands used by the conversation store,
+    with a clock the tests move forward.
+    """
+
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.values: dict[str, dict | bytes] = {}
+        self.expires_at: dict[str, float] = {}
+
+    def _live(self, key: str):
+        if key in self.expires_at and self.expires_at[key] <= self.now:
+            del self.values[key]
+            del self.expires_at[key]
+        return self.values.get(key)
+
+    def _hash(self, key: str) -> dict:
+        return self._live(key) or self.values.setdefault(key, {})
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def hget(self, key, field):
+        return (self._live(key) or {}).get(field)
+
+    def hmget(self, key, fields):
+        values = self._live(key) or {}
+        return [values.get(field) for field in fields]
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        values = self._hash(key)
+        for name, item in (mapping or {field: value}).items():
+            values[name] = item if isinstance(item, bytes) else str(item).encode()
+
+    def hincrby(self, key, field, amount):
+        values = self._hash(key)
+        values[field] = str(int(values.get(field, b"0")) + amount).encode()
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self._hash(key).pop(field, None)
+
+    def hvals(self, key):
+        return list((self._live(key) or {}).values())
+
+    def hgetall(self, key):
+        return {field.encode(): value for field, value in self._hash(key).items()}
+
+    def expire(self, key, seconds):
+        if key in self.values:
+            self.expires_at[key] = self.now + seconds
+
+    def delete(self, key):
+        self.values.pop(key, None)
+        self.expires_at.pop(key, None)
+
+    def zadd(self, key, mapping):
+        self._hash(key).update(mapping)
+
+    def zrem(self, key, *members):
+        self.hdel(key, *members)
+
+    def zcard(self, key):
+        return len(self._live(key) or {})
+
+    def zrangebyscore(self, key, minimum, maximum):
+        return [
+            member
+            for member, score in (self._live(key) or {}).items()
+            if score <= maximum
+        ]
+
+
+class FakePipeline:
+    def __init__(self, redis_client: FakeRedis):
+        self._redis_client = redis_client
+        self._results = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self._results.append(getattr(self._redis_client, name)(*args, **kwargs))
+            return self
+
+        return queue
+
+    def execute(self):
+        return self._results
+
+
+@pytest.fixture
+def redis_client(monkeypatch) -> FakeRedis:
+    fake = FakeRedis()
+    monkeypatch.setattr(conversations.time, "time", lambda: fake.now)
+    return fake
+
+
+def test_active_conversations_get_the_idle_ttl():
+    now = 1_000_000.0
+
+    assert (
+        conversations.time_to_live(now - 60, now)
+        == settings.conversation_idle_ttl_seconds
+    )
+
+
+def test_ttl_never_passes_the_maximum_age():
+    now = 1_000_000.0
+    created_at = now - settings.conversation_max_age_seconds + 30
+
+    assert conversations.time_to_live(created_at, now) == 30
+    assert conversations.time_to_live(created_at - 60, now) <= 0
+
+
+def test_loading_a_conversation_refreshes_its_ttl(redis_client):
+    state = edu_model.create_initial_state("c1")
+    conversations.save_conversation(redis_client, state)
+
+    redis_client.now += settings.conversation_idle_ttl_seconds - 10
+    assert conversations.load_conversation(redis_client, "c1") == state
+    redis_client.now += settings.conversation_idle_ttl_seconds - 10
+
+    assert conversations.load_conversation(redis_client, "c1") == state
+
+
+def test_idle_conversations_expire_and_are_counted(redis_client):
+    conversations.save_conversation(redis_client, edu_model.create_initial_state("c1"))
+    conversations.save_conversation(redis_client, edu_model.create_initial_state("c2"))
+    conversations.delete_conversation(redis_client, "c2")
+
+    redis_client.now += settings.conversation_idle_ttl_seconds + 1
+
+    assert conversations.load_conversation(redis_client, "c1") is None
+    stats = conversations.conversation_stats(redis_client)
+    assert (stats.live_count, stats.live_bytes) == (0, 0)
+    assert (stats.created_count, stats.deleted_count, stats.expired_count) == (2, 1, 1)
+    assert stats.expired_bytes > 0
+
+
+def test_conversations_expire_at_their_maximum_age(redis_client):
+    conversations.save_conversation(redis_client, edu_model.create_initial_state("c1"))
+
+    for _ in range(
+        settings.conversation_max_age_seconds // settings.conversation_idle_ttl_seconds
+    ):
+        redis_client.now += settings.conversation_idle_ttl_seconds - 10
+        conversations.touch_conversation(redis_client, "c1")
+    redis_client.now += settings.conversation_idle_ttl_seconds - 10
+
+    assert conversations.load_conversation(redis_client, "c1") is None
+
+
+def test_states_over_the_size_limit_are_rejected(redis_client, monkeypatch):
+    monkeypatch.setattr(
+        conversations,
+        "settings",
+        settings.model_copy(update={"conversation_max_bytes": 100}),
+    )
+    state = edu_model.create_initial_state("c1").immutable_copy_answer(
+        edu_model.Answer(answer_text="".join(chr(0x4E00 + i) for i in range(5_000)))
+    )
+
+    with pytest.raises(conversations.ConversationTooLarge):
+        conversations.save_conversation(redis_client, state)
+
+    assert conversations.load_conversation(redis_client, "c1") is None
+    assert conversations.conversation_stats(redis_client).rejected_count == 1
@@ -0,0 +1,50 @@
+from rudeadvisor import extract
+
+
+def test_extract_pdf_text_stops_at_the_page_budget(monkeypatch):
+    pages_read = []
+
+    def pages(content):
+        for number in range(500):
+            pages_read.append(number)
+            yield f"Page {number} is about Napoleon."
+
+    monkeypatch.setattr(extract, "iter_pdf_pages", pages)
+
+    text = extract.extract_pdf_text(
+        b"", max_pages=10, max_chars=100_000, sample_pages=3
+    )
+
+    assert text.count("Napoleon") == 10
+    assert len(pages_read) == 11
+
+
+def test_extract_pdf_text_stops_after_a_binary_sample(monkeypatch):
+    pages_read = []
+
+    def pages(content):
+        for number in range(500):
+            pages_read.append(number)
+            yield "\x00\x01\x02" * 10
+
+    monkeypatch.setattr(extract, "iter_pdf_pages", pages)
+
+    text = extract.extract_pdf_text(
+        b"", max_pages=50, max_chars=100_000, sample_pages=3
+    )
+
+    assert not extract.is_text_content(text)
+    assert len(pages_read) == 4
+
+
+def test_streaming_html_extractor_skips_boilerplate():
+    html = (
+        "<html><head><title>Napoleon</title><style>p { color: red; }</style></head>"
+        "<body><nav><a href='/'>Home</a></nav><p>Napoleon married</p>"
+        "<p>Jos&eacute;phine in <b>1796</b>.</p><script>var x = '<p>';</script>"
+        "<footer>Copyright</footer></body></html>"
+    ).encode()
+
+    text = extract.extract_html_text_streaming(html, "utf-8")
+
+    assert text == "Napoleon Napoleon married Joséphine in 1796."
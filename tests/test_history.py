@@ -0,0 +1,104 @@
+import asyncio
+from rudeadvisor import history
+from rudeadvisor import model as edu_model
+import pytest
+
+
+def test_parse_entry_sets_the_event_id():
+    event = edu_model.ConversationEvent(
+        conversation_id="c1",
+        message=edu_model.Message(
+            message_type=edu_model.MessageType.PROCESS,
+            state_action=edu_model.StateAction.COORDINATE,
+            content="Processing",
+        ),
+    )
+
+    parsed = history.parse_entry(
+        b"1700000000000-0", {b"event": event.model_dump_json().encode()}
+    )
+
+    assert parsed == event.immutable_update(event_id="1700000000000-0")
+
+
+def test_event_ids_are_ordered_as_numbers():
+    assert history.event_id_order("999-5") < history.event_id_order("1000-0")
+    with pytest.raises(ValueError):
+        history.event_id_order("0-0-0")
+
+
+class FakeRedis:
+    """
+    XREVRANGE over the entries of one history stream.
+    """
+
+    def __init__(self, message_types: list[edu_model.MessageType]):
+        self.entries = [
+            (f"{number}-0".encode(), {b"event": event_json(number, message_type)})
+            for number, message_type in enumerate(message_types, start=1)
+        ]
+        self.fetches = 0
+
+    async def xrevrange(self, key, max, min, count):
+        self.fetches += 1
+        newest_first = reversed(self.entries)
+        if max != "+":
+            upper = history.event_id_order(max.removeprefix("("))
+            newest_first = (
+                (entry_id, fields)
+                for entry_id, fields in newest_first
+                if history.event_id_order(entry_id.decode()) < upper
+            )
+        return list(newest_first)[:count]
+
+
+def event_json(number: int, message_type: edu_model.MessageType) -> bytes:
+    return (
+        edu_model.ConversationEvent(
+            conversation_id="c1",
+            message=edu_model.Message(
+                message_type=message_type,
+                state_action=edu_model.StateAction.QUERY_LLM,
+                content=str(number),
+            ),
+        )
+        .model_dump_json()
+        .encode()
+    )
+
+
+def read_page(redis_client: FakeRedis, before: str | None, limit: int):
+    return asyncio.run(history.read_history(redis_client, "c1", before, limit))
+
+
+PROCESS = edu_model.MessageType.PROCESS
+FRAGMENT = edu_model.MessageType.ANSWER_FRAGMENT
+QUESTION = edu_model.MessageType.REFINED_QUESTION
+
+
+def test_history_pages_skip_fragments_and_fill_up_across_fetches():
+    redis_client = FakeRedis([PROCESS, QUESTION, FRAGMENT, FRAGMENT, PROCESS])
+
+    page = read_page(redis_client, None, limit=2)
+
+    assert [entry.entry_id for entry in page.entries] == ["5-0", "2-0"]
+    assert page.next_before == "2-0"
+    assert redis_client.fetches == 2
+
+
+def test_the_last_history_page_has_no_next_page():
+    redis_client = FakeRedis([PROCESS, QUESTION, FRAGMENT, FRAGMENT, PROCESS])
+
+    page = read_page(redis_client, "2-0", limit=2)
+
+    assert [entry.message.content for entry in page.entries] == ["1"]
+    assert page.next_before is None
+
+
+def test_a_history_that_fits_the_page_exactly_has_no_next_page():
+    redis_client = FakeRedis([PROCESS, FRAGMENT, QUESTION])
+
+    page = read_page(redis_client, None, limit=2)
+
+    assert [entry.entry_id for entry in page.entries] == ["3-0", "1-0"]
+    assert page.next_before is None
@@ -0,0 +1,26 @@
+import sqlite3
+from rudeadvisor import index
+from rudeadvisor import model as edu_model
+
+
+def test_search_finds_indexed_passages(monkeypatch):
+    database = sqlite3.connect(":memory:", check_same_thread=False)
+    database.executescript(index.SCHEMA)
+    monkeypatch.setattr(index, "connection", database)
+    web_data_collection = edu_model.WebDataCollection(
+        web_data_collection=[
+            edu_model.WebData(link="napoleon", data="Napoleon married Josephine."),
+            edu_model.WebData(link="pasta", data="Cook the pasta in salted water."),
+        ],
+        web_data_retrival_errors=[],
+    )
+    questions = edu_model.Questions(
+        questions=[edu_model.Question(question_text="Who was Josephine's Napoleon?")],
+        questions_score=None,
+    )
+
+    index.add_web_data(web_data_collection)
+    index.add_web_data(web_data_collection)
+    passages = index.search(questions, limit=10)
+
+    assert [passage.link for passage in passages] == ["napoleon"]
@@ -0,0 +1,229 @@
+import asyncio
+from rudeadvisor import checkpoint
+from rudeadvisor import codec
+from rudeadvisor import jobs
+from rudeadvisor import model as edu_model
+from rudeadvisor import worker
+from rudeadvisor.config import settings
+import pytest
+
+
+DEAD_LETTERS = settings.job_stream + jobs.DEAD_LETTER_SUFFIX
+
+
+class FakeRedis:
+    """
+    The stream, consumer group and key commands used by the job queue and the
+    checkpoints. The pending entries of the one consumer group are kept with
+    their delivery count and idle time, which the tests set directly.
+    """
+
+    def __init__(self):
+        self.streams: dict[str, list[tuple[bytes, dict]]] = {}
+        self.pending: dict[bytes, dict] = {}
+        self.values: dict[str, object] = {}
+        self.last_id = 0
+
+    def pipeline(self, transaction: bool = True):
+        return FakePipeline(self)
+
+    def xadd(self, name, fields):
+        self.last_id += 1
+        entry_id = f"{self.last_id}-0".encode()
+        self.streams.setdefault(name, []).append((entry_id, fields))
+        return entry_id
+
+    def xrange(self, name, min, max, count=None):
+        return [
+            (entry_id, fields)
+            for entry_id, fields in self.streams.get(name, [])
+            if entry_id == as_bytes(min)
+        ]
+
+    def xdel(self, name, entry_id):
+        entries = self.streams.get(name, [])
+        self.streams[name] = [entry for entry in entries if entry[0] != as_bytes(entry_id)]
+
+    def xack(self, name, group, entry_id):
+        self.pending.pop(as_bytes(entry_id), None)
+
+    def xpending_range(self, name, group, min, max, count, idle):
+        return [
+            {"message_id": entry_id, "times_delivered": entry["times_delivered"]}
+            for entry_id, entry in self.pending.items()
+            if entry["idle"] >= idle
+        ][:count]
+
+    def xclaim(self, name, group, consumer, min_idle_time, entry_ids, justid=False):
+        fields_by_id = dict(self.streams.get(name, []))
+        for entry_id in entry_ids:
+            self.pending[entry_id].update(idle=0, consumer=consumer)
+            self.pending[entry_id]["times_delivered"] += 1
+        return [(entry_id, fields_by_id.get(entry_id)) for entry_id in entry_ids]
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def zadd(self, key, mapping):
+        self.values.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, member):
+        self.values.get(key, {}).pop(member, None)
+
+    def zrangebyscore(self, key, minimum, maximum):
+        return [
+            member
+            for member, score in self.values.get(key, {}).items()
+            if score <= maximum
+        ]
+
+
+class FakePipeline:
+    def __init__(self, redis_client: FakeRedis):
+        self._redis_client = redis_client
+        self._calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+
+        return queue
+
+    def execute(self):
+        return [
+            getattr(self._redis_client, name)(*args, **kwargs)
+            for name, args, kwargs in self._calls
+        ]
+
+
+def as_bytes(entry_id) -> bytes:
+    return entry_id.encode() if isinstance(entry_id, str) else entry_id
+
+
+def job(conversation_id: str = "c1") -> edu_model.Job:
+    return edu_model.Job(
+        state=edu_model.create_initial_state(conversation_id),
+        previous_action=None,
+        action=edu_model.StateAction.COORDINATE,
+    )
+
+
+def delivered(redis_client: FakeRedis, fields: dict, times_delivered: int) -> bytes:
+    entry_id = redis_client.xadd(settings.job_stream, fields)
+    redis_client.pending[entry_id] = {
+        "times_delivered": times_delivered,
+        "idle": settings.job_claim_idle_ms,
+    }
+    return entry_id
+
+
+def saved_checkpoint(
+    redis_client: FakeRedis, queued_job: edu_model.Job, entry_id: bytes | None
+):
+    checkpoint.save_checkpoint(
+        redis_client,
+        edu_model.Checkpoint(
+            conversation_id=queued_job.state.conversation_id,
+            job_id=queued_job.job_id,
+            entry_id=entry_id.decode() if entry_id else None,
+            state=queued_job.state,
+            previous_action=edu_model.StateAction.COORDINATE,
+            next_action=edu_model.StateAction.QUERY_LLM,
+            steps_taken=1,
+        ),
+    )
+
+
+def test_stale_jobs_are_claimed_and_exhausted_ones_dead_lettered():
+    redis_client = FakeRedis()
+    retried, exhausted = job("c1"), job("c2")
+    retried_id = delivered(redis_client, jobs.job_fields(retried), 1)
+    exhausted_id = delivered(
+        redis_client, jobs.job_fields(exhausted), settings.job_max_deliveries
+    )
+    saved_checkpoint(redis_client, exhausted, exhausted_id)
+
+    claimed = jobs.claim_stale_jobs(redis_client, "worker-2", count=10)
+
+    assert [entry_id for entry_id, _ in claimed] == [retried_id]
+    assert redis_client.pending[retried_id]["consumer"] == "worker-2"
+    assert exhausted_id not in redis_client.pending
+    assert not jobs.is_queued(redis_client, exhausted_id)
+    assert len(redis_client.streams[DEAD_LETTERS]) == 1
+    assert checkpoint.load_checkpoint(redis_client, "c2") is None
+
+
+def test_unreadable_jobs_are_dead_lettered_once_and_acknowledged():
+    redis_client = FakeRedis()
+    # A frame with an encoding this worker does not know
+    unreadable = codec.FRAME_HEADER.pack(
+        codec.FRAME_MAGIC, codec.FRAME_VERSION, 99, codec.COMPRESSION_NONE
+    )
+    entry_id = delivered(
+        redis_client, {jobs.JOB_FIELD: unreadable}, settings.job_max_deliveries
+    )
+
+    assert jobs.claim_stale_jobs(redis_client, "worker-1", count=10) == []
+    assert jobs.claim_stale_jobs(redis_client, "worker-2", count=10) == []
+
+    assert redis_client.pending == {}
+    assert not jobs.is_queued(redis_client, entry_id)
+    assert redis_client.streams[DEAD_LETTERS] == [
+        (b"2-0", {jobs.JOB_FIELD: unreadable})
+    ]
+
+
+@pytest.fixture
+def worker_redis(monkeypatch) -> FakeRedis:
+    redis_client = FakeRedis()
+    monkeypatch.setattr(worker, "redis_client", redis_client)
+    # Every checkpoint counts as stalled
+    monkeypatch.setattr(
+        worker, "settings", settings.model_copy(update={"checkpoint_stall_seconds": -1})
+    )
+    return redis_client
+
+
+def test_stalled_conversations_are_requeued_once(worker_redis):
+    stalled = job()
+    entry_id = delivered(worker_redis, jobs.job_fields(stalled), 1)
+    saved_checkpoint(worker_redis, stalled, entry_id)
+
+    assert worker.requeue_stalled_conversations() == 0
+    jobs.ack_job(worker_redis, entry_id)
+    assert worker.requeue_stalled_conversations() == 1
+    assert worker.requeue_stalled_conversations() == 0
+
+    ((requeued_id, fields),) = worker_redis.streams[settings.job_stream]
+    requeued = jobs.parse_job(fields)
+    assert requeued.job_id == stalled.job_id
+    assert requeued.action == edu_model.StateAction.QUERY_LLM
+    assert checkpoint.load_checkpoint(worker_redis, "c1").entry_id == "2-0"
+
+
+def test_jobs_with_a_checkpoint_resume_from_it(worker_redis, monkeypatch):
+    resumed_job = job()
+    entry_id = delivered(worker_redis, jobs.job_fields(resumed_job), 2)
+    saved_checkpoint(worker_redis, resumed_job, entry_id)
+    calls = []
+
+    async def resume_conversation(saved, entry_id):
+        calls.append(("resume", saved.next_action, entry_id))
+
+    async def process_action(*args):
+        calls.append(("process",))
+
+    monkeypatch.setattr(worker, "resume_conversation", resume_conversation)
+    monkeypatch.setattr(worker, "process_action", process_action)
+
+    asyncio.run(worker.run_job(entry_id, jobs.job_fields(resumed_job)))
+
+    assert calls == [("resume", edu_model.StateAction.QUERY_LLM, "1-0")]
+    assert worker_redis.pending == {}
+    assert not jobs.is_queued(worker_redis, entry_id)
@@ -0,0 +1,50 @@
+import asyncio
+from rudeadvisor import llm
+from rudeadvisor import model as edu_model
+from rudeadvisor import tools
+from rudeadvisor.config import settings
+
+
+class FakeOllamaClient:
+    def __init__(self, content: str):
+        self.content = content
+        self.requests = []
+
+    async def chat(self, **request):
+        self.requests.append(request)
+        return {"message": {"content": self.content}}
+
+
+def test_ollama_backend_validates_structured_output():
+    backend = llm.OllamaBackend("http://localhost:11434", concurrency=1)
+    backend._client = FakeOllamaClient('{"query_text": "cats"}')
+
+    query = asyncio.run(
+        backend.complete_structured(
+            "llama3.1", [{"role": "user", "content": "cats?"}], edu_model.Query, 100
+        )
+    )
+    backend._client.content = '{"text": "cats"}'
+    invalid = asyncio.run(
+        backend.complete_structured(
+            "llama3.1", [{"role": "user", "content": "cats?"}], edu_model.Query, 100
+        )
+    )
+
+    assert query == edu_model.Query(query_text="cats")
+    assert invalid is None
+    assert backend._client.requests[0]["format"] == "json"
+
+
+def test_llm_route_uses_tool_overrides(monkeypatch):
+    monkeypatch.setattr(
+        tools,
+        "settings",
+        settings.model_copy(
+            update={"llm_provider_score": "ollama", "llm_model_answer": "gpt-4o"}
+        ),
+    )
+
+    assert tools.llm_route(edu_model.LLMTool.SCORE) == ("ollama", settings.ollama_model)
+    assert tools.llm_route(edu_model.LLMTool.ANSWER) == ("openai", "gpt-4o")
+    assert tools.llm_route(edu_model.LLMTool.QUERY) == ("openai", settings.llm_model)
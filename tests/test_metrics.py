@@ -0,0 +1,25 @@
+from rudeadvisor import metrics
+
+
+def test_render_histogram_from_pending_observations(monkeypatch):
+    monkeypatch.setattr(metrics, "pending", {})
+    metrics.observe("rudeadvisor_step_duration_seconds", 0.07, action="WebScrape")
+    metrics.observe("rudeadvisor_step_duration_seconds", 3, action="WebScrape")
+    metrics.increment("rudeadvisor_searches_total", outcome="cached")
+
+    totals: dict[str, dict[str, str]] = {}
+    for (name, field), amount in metrics.pending.items():
+        totals.setdefault(name, {})[field] = str(amount)
+    text = metrics.render(totals)
+
+    assert (
+        'rudeadvisor_step_duration_seconds_bucket{action="WebScrape",le="0.1"} 1'
+        in text
+    )
+    assert (
+        'rudeadvisor_step_duration_seconds_bucket{action="WebScrape",le="+Inf"} 2'
+        in text
+    )
+    assert 'rudeadvisor_step_duration_seconds_count{action="WebScrape"} 2' in text
+    assert 'rudeadvisor_searches_total{outcome="cached"} 1' in text
+    assert "# TYPE rudeadvisor_llm_tokens histogram" in text
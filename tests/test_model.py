@@ -0,0 +1,30 @@
+from rudeadvisor import model as edu_model
+
+
+def test_immutable_copy_shares_unchanged_fields():
+    web_data_collection = edu_model.WebDataCollection(
+        web_data_collection=[edu_model.WebData(link="link1", data="data1")],
+        web_data_retrival_errors=[],
+    )
+    state = edu_model.create_initial_state("c1").immutable_copy_web_data_collection(
+        web_data_collection
+    )
+
+    updated = state.immutable_copy_answer(edu_model.Answer(answer_text="answer"))
+
+    assert updated.web_data_collection is state.web_data_collection
+    assert updated.answer == edu_model.Answer(answer_text="answer")
+    assert state.answer is None
+
+
+def test_immutable_copy_questions_score_keeps_questions():
+    questions = edu_model.Questions(
+        questions=[edu_model.Question(question_text="Why?")], questions_score=None
+    )
+    score = edu_model.QuestionsScore(score=90, score_comment="fine")
+
+    updated = questions.immutable_copy_questions_score(score)
+
+    assert updated.questions_score == score
+    assert updated.questions is questions.questions
+    assert questions.questions_score is None
@@ -0,0 +1,103 @@
+import asyncio
+import httpx
+from rudeadvisor import model as edu_model
+from rudeadvisor import tools
+from rudeadvisor.config import settings
+import pytest
+
+
+MAX_BYTES = 1_000
+
+
+class FakeSites:
+    """
+    Pages under /ok/, a missing page and a page that streams far past the size
+    limit, counting the chunks it sent.
+    """
+
+    def __init__(self):
+        self.chunks_sent = 0
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.startswith("/ok/"):
+            return httpx.Response(
+                200,
+                html=f"<html><body><p>Napoleon page {request.url.path}</p></body></html>",
+            )
+        if request.url.path == "/huge":
+            return httpx.Response(200, content=self.huge_body())
+        return httpx.Response(404)
+
+    async def huge_body(self):
+        for _ in range(100):
+            self.chunks_sent += 1
+            yield b"x" * 500
+
+
+@pytest.fixture
+def sites(monkeypatch) -> FakeSites:
+    monkeypatch.setattr(tools, "content_cache", None)
+    monkeypatch.setattr(
+        tools,
+        "settings",
+        settings.model_copy(
+            update={"scrape_max_bytes": MAX_BYTES, "extract_processes": 0}
+        ),
+    )
+    return FakeSites()
+
+
+def scrape(
+    sites: FakeSites, links: list[str]
+) -> tuple[edu_model.WebDataCollection, int]:
+    async def scrape_with_fake_sites():
+        upstreams = tools.get_upstreams()
+        await upstreams.http_client.aclose()
+        upstreams.http_client = httpx.AsyncClient(
+            transport=httpx.MockTransport(sites.handle)
+        )
+        try:
+            scraped = await tools.scrape_links(
+                edu_model.Sources(
+                    links=links,
+                    query_tuning_suggestion=None,
+                    removed_links_explaination=None,
+                )
+            )
+            return scraped, upstreams.host_count()
+        finally:
+            await tools.close_upstreams()
+
+    return asyncio.run(scrape_with_fake_sites())
+
+
+def test_scraped_pages_keep_link_order_and_failures_become_errors(sites):
+    links = [
+        "https://a.example/ok/1",
+        "https://b.example/missing",
+        "https://a.example/ok/2",
+        "https://c.example/ok/3",
+    ]
+
+    scraped, host_count = scrape(sites, links)
+
+    assert [web_data.link for web_data in scraped.web_data_collection] == [
+        "https://a.example/ok/1",
+        "https://a.example/ok/2",
+        "https://c.example/ok/3",
+    ]
+    assert "/ok/2" in scraped.web_data_collection[1].data
+    (error,) = scraped.web_data_retrival_errors
+    assert error.startswith("https://b.example/missing: ")
+    assert "404" in error
+    assert host_count == 0
+
+
+def test_downloads_past_the_size_limit_are_aborted(sites):
+    scraped, _ = scrape(sites, ["https://a.example/huge"])
+
+    assert scraped.web_data_collection == []
+    assert scraped.web_data_retrival_errors == [
+        f"https://a.example/huge: Response is larger than the limit of {MAX_BYTES} bytes"
+    ]
+    assert sites.chunks_sent < 100